@@ -134,8 +134,16 @@
               --replace-fail '_PAPLAY = "paplay"' '_PAPLAY = "${pkgs.pulseaudio}/bin/paplay"' 
             substituteInPlace src/audio_guestbook/audio_manager.py \
               --replace-fail '_PACTL = "pactl"' '_PACTL = "${pkgs.pulseaudio}/bin/pactl"'   
+            substituteInPlace src/audio_guestbook/audio_manager.py \
+              --replace-fail '_PACAT = "pacat"' '_PACAT = "${pkgs.pulseaudio}/bin/pacat"'
+            substituteInPlace src/audio_guestbook/audio_manager.py \
+              --replace-fail '_PACMD = "pacmd"' '_PACMD = "${pkgs.pulseaudio}/bin/pacmd"'
             substituteInPlace src/audio_guestbook/audio_manager.py \
               --replace-fail '_FFMPEG = "ffmpeg"' '_FFMPEG = "${pkgs.ffmpeg}/bin/ffmpeg"' 
+            substituteInPlace src/audio_guestbook/encoder.py \
+              --replace-fail '_FFMPEG = "ffmpeg"' '_FFMPEG = "${pkgs.ffmpeg}/bin/ffmpeg"'
+            substituteInPlace src/audio_guestbook/transcode_cache.py \
+              --replace-fail '_FFMPEG = "ffmpeg"' '_FFMPEG = "${pkgs.ffmpeg}/bin/ffmpeg"'
           '';
         });
 
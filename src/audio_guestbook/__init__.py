@@ -1,10 +1,27 @@
 # This file makes the src directory a Python package
-from gpiozero.pins.mock import MockFactory
-from .statemachine import run_statemachine
-from .async_button import AsyncButton
+# Nothing is imported eagerly: the entry point only loads what the selected setup needs
+import sys
+
+_LAZY_EXPORTS = {
+    "run_statemachine": ".statemachine",
+    "run_phones": ".statemachine",
+    "Phone": ".statemachine",
+    "AsyncButton": ".async_button",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        import importlib
+        return getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-import asyncio
 
-from . import run
 def run_telephone_input_loop():
+    from .startup import report
+    if "--startup-report" in sys.argv:
+        # Before importing the rest, so the report sees every import
+        report.track_imports()
+    with report.phase("imports"):
+        from . import run
     run.main()
@@ -1,25 +1,80 @@
 import asyncio
+from dataclasses import dataclass
+from typing import Callable
 from gpiozero import Button
-from gpiozero.pins import Factory as PinFactory
+from .clock import Clock
+from .gpio_poller import GpioPoller
+from .latency import tracer
+
+
+@dataclass(frozen=True)
+class ButtonEvent:
+    pin: int
+    pressed: bool
+    # Clock.monotonic() in the gpiozero callback
+    timestamp: float
 
 
 class AsyncButton:
-    def __init__(self, pin, pin_factory=None,bounce_time=None):
-        self.button = Button(pin, pin_factory=pin_factory, pull_up=True, bounce_time=bounce_time)
+    def __init__(self, pin, pin_factory=None,bounce_time=None, events: asyncio.Queue | None = None,
+                 clock: Clock | None = None, poller: GpioPoller | None = None):
+        """`events` receives a ButtonEvent for every press and release edge, in order.
+
+        With a `poller` the pin is read and debounced by it instead of a gpiozero Button.
+        """
+        self.pin = pin
         self._loop = asyncio.get_event_loop()
+        self._events = events
+        self._clock = clock or Clock()
+        # Clock.monotonic() of the last press edge, for latency tracing
+        self.last_press_time: float | None = None
         self._press_event = asyncio.Event()
         self._depress_event = asyncio.Event()
-        self.button.when_pressed = self._handle_press
-        self.button.when_deactivated = self._handle_depress
+        # Called in the loop on every press edge, e.g. to end a call when the handset is hung up
+        self.on_press: list[Callable[[], None]] = []
+        if poller is not None:
+            self.button = None
+            poller.add(self)
+        else:
+            self.button = Button(pin, pin_factory=pin_factory, pull_up=True, bounce_time=bounce_time)
+            self.button.when_pressed = self._handle_press
+            self.button.when_deactivated = self._handle_depress
 
     def _handle_press(self, x):
-        self._loop.call_soon_threadsafe(self._depress_event.clear)
-        self._loop.call_soon_threadsafe(self._press_event.set)
+        # Runs in a gpiozero thread, everything else happens in the loop
+        self._loop.call_soon_threadsafe(self._pressed, self._clock.monotonic())
 
     def _handle_depress(self, x):
-        self._loop.call_soon_threadsafe(self._press_event.clear)
-        self._loop.call_soon_threadsafe(self._depress_event.set)
+        self._loop.call_soon_threadsafe(self._released, self._clock.monotonic())
+
+    def deliver(self, pressed: bool, timestamp: float):
+        """Handle an edge in the loop, for input backends that read the pin themselves."""
+        if pressed:
+            self._pressed(timestamp)
+        else:
+            self._released(timestamp)
+
+    def _pressed(self, timestamp: float):
+        tracer.observe("gpio→loop", self._clock.monotonic() - timestamp)
+        self.last_press_time = timestamp
+        if self._events is not None:
+            self._events.put_nowait(ButtonEvent(self.pin, True, timestamp))
+        self._depress_event.clear()
+        self._press_event.set()
+        for callback in list(self.on_press):
+            callback()
+
+    def _released(self, timestamp: float):
+        if self._events is not None:
+            self._events.put_nowait(ButtonEvent(self.pin, False, timestamp))
+        self._press_event.clear()
+        self._depress_event.set()
         
+    @property
+    def is_pressed(self) -> bool:
+        """Pressed since the last release, as far as the loop has seen."""
+        return self._press_event.is_set()
+
     async def wait_for_press_and_release(self):
         await self._press_event.wait()
         await self._depress_event.wait()
@@ -30,64 +85,11 @@ class AsyncButton:
     async def wait_for_depress(self):
         await self._depress_event.wait()
 
-async def wait_for_any_button(input_buttons: list[AsyncButton], timeout: int = None) -> AsyncButton:
-    button_tasks = {button: asyncio.create_task(
-        button.wait_for_press_and_release()) for button in input_buttons}
-    timeout_tasks = [asyncio.create_task(asyncio.sleep(timeout))] if timeout else []
-    done, pending = await asyncio.wait(list(button_tasks.values()) + timeout_tasks, return_when=asyncio.FIRST_COMPLETED)
-    # Cancel the others  that didn't finish
-    for task in pending:
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
-    # done_button is the first button in button_tasks.keys() that finished in done, so we search the button in button_tasks of the first task in done
-    done_without_timeout = [task for task in done if task not in timeout_tasks]
-    if len(done_without_timeout) > 0:
-        first_done_task = next(iter(done_without_timeout))
-        return next(button for button, button_task in button_tasks.items(
-        ) if button_task == first_done_task)
-    else:
-        return None
-
-# class AsyncButton:
-#     def __init__(self, pin, pin_factory=None):
-#         self.button = Button(pin, pin_factory=pin_factory)
-#         self._loop = asyncio.get_event_loop()
-#         self._queue = asyncio.Queue()
-#         self.button.when_pressed = self._handle_press
-
-#     def _handle_press(self):
-#         self._loop.call_soon_threadsafe(self._queue.put_nowait, True)
-
-#     async def wait_for_press(self):
-#         await self._queue.get()
-
-# class AsyncButton:
-#     def __init__(self, pin, pin_factory: PinFactory = None):
-#         self.button = Button(pin,pin_factory=pin_factory)
-#         self._loop = asyncio.get_event_loop()
-#         self._future = None
-#         self.button.when_pressed = self._handle_press
-
-#     def _handle_press(self):
-#         print("Button pressed")
-#         if self._future and not self._future.done():
-#             self._loop.call_soon_threadsafe(self._future.set_result, True)
-
-#     async def wait_for_press(self):
-#         print("Done waiting0")
-#         self._future = self._loop.create_future()
-#         print("Done waiting1")
-#         await self._future
-#         print("Done waiting2")
-#         self._future = None
-#         print("Done waiting3")
-from gpiozero.pins.mock import MockFactory, MockPin
-import asyncio
 
 async def test_async_button():
+    # Only this demo needs the mock backend, running the telephone imports just the selected one
+    from gpiozero.pins.mock import MockFactory
+
     # Create a mock pin and factory
     factory = MockFactory()
     mock_pin = factory.pin(17)
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import subprocess
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from .latency import Span
+from .tones import Cadence, cadence_segments, periodic_tone
+
+logger = logging.getLogger(__name__)
+
+
+class AudioEngineError(Exception):
+    """Raised when the in-process output stream is not (or no longer) usable."""
+
+
+def to_float32(pcm: np.ndarray) -> np.ndarray:
+    """Convert integer or float PCM frames to float32 samples in [-1, 1]."""
+    if pcm.dtype == np.float32:
+        return pcm
+    if pcm.dtype == np.uint8:
+        return (pcm.astype(np.float32) - 128.0) / 128.0
+    if pcm.dtype.kind == "i":
+        return pcm.astype(np.float32) / float(2 ** (8 * pcm.dtype.itemsize - 1))
+    return pcm.astype(np.float32)
+
+
+def resample(pcm: np.ndarray, from_rate: int, to_rate: int) -> np.ndarray:
+    """Linear-interpolation resampler, good enough for tones and voice prompts."""
+    if from_rate == to_rate or len(pcm) == 0:
+        return pcm
+    samples = to_float32(pcm)
+    frames = int(round(len(samples) * to_rate / from_rate))
+    positions = np.arange(frames, dtype=np.float64) * (from_rate / to_rate)
+    source = np.arange(len(samples), dtype=np.float64)
+    return np.stack([np.interp(positions, source, samples[:, ch]) for ch in range(samples.shape[1])],
+                    axis=1).astype(np.float32)
+
+
+def read_wav(file_path: str | Path) -> tuple[np.ndarray, int]:
+    """Read a PCM WAV file into a (frames, channels) array and its sample rate."""
+    with wave.open(str(file_path), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+
+    if width == 3:
+        # 24 bit has no numpy dtype, widen to int32
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        pcm = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+               | raw[:, 2].astype(np.int32) << 24)
+    else:
+        dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+        pcm = np.frombuffer(data, dtype=dtype)
+    return pcm.reshape(-1, channels), rate
+
+
+def decode_with_ffmpeg(ffmpeg: str, file_path: str | Path, rate: int, channels: int) -> np.ndarray:
+    """Decode any format ffmpeg understands (e.g. the MP3 greetings) to int16 PCM."""
+    result = subprocess.run(
+        [ffmpeg, "-v", "error", "-i", str(file_path),
+         "-f", "s16le", "-ar", str(rate), "-ac", str(channels), "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, channels)
+
+
+def load_pcm(file_path: str | Path, rate: int, channels: int, ffmpeg: str = "ffmpeg") -> np.ndarray:
+    """Load an audio file as (frames, channels) PCM at the given rate.
+
+    WAV files are read directly and keep their sample format, anything else is
+    decoded by ffmpeg. Channel count is left alone here, the mixer maps channels
+    while mixing.
+    """
+    if Path(file_path).suffix.lower() == ".wav":
+        pcm, file_rate = read_wav(file_path)
+        return resample(pcm, file_rate, rate)
+    return decode_with_ffmpeg(ffmpeg, file_path, rate, channels)
+
+
+class Voice:
+    """A PCM source currently being mixed into the output stream.
+
+    A looping voice wraps around at the end of its buffer without a gap and
+    only ends when it is cancelled.
+    """
+
+    def __init__(self, pcm: np.ndarray, loop: bool = False, span: Span | None = None):
+        self.pcm = pcm
+        self.loop = loop and len(pcm) > 0
+        # Ended when the voice is first mixed into the stream
+        self.span = span
+        self.position = 0
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def read(self, frames: int) -> np.ndarray:
+        """Return up to `frames` float32 frames, an empty array once exhausted."""
+        if not self.loop:
+            chunk = self.pcm[self.position:self.position + frames]
+            self.position += len(chunk)
+            return to_float32(chunk)
+
+        chunks = []
+        while frames > 0:
+            chunk = self.pcm[self.position:self.position + frames]
+            self.position = (self.position + len(chunk)) % len(self.pcm)
+            frames -= len(chunk)
+            chunks.append(to_float32(chunk))
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    @property
+    def finished(self) -> bool:
+        return not self.loop and self.position >= len(self.pcm)
+
+
+class CadenceVoice(Voice):
+    """A call-progress signal generated from one short tone buffer.
+
+    Plays `repeat` periods of the cadence, or runs until cancelled if `repeat` is None.
+    """
+
+    def __init__(self, cadence: Cadence, rate: int, repeat: int | None = None, span: Span | None = None):
+        super().__init__(periodic_tone(cadence.frequencies, rate, cadence.level), loop=True, span=span)
+        self._segments = cadence_segments(cadence, rate)
+        self._remaining_periods = repeat
+        self._segment = 0
+        self._segment_left = self._segments[0][1]
+
+    def read(self, frames: int) -> np.ndarray:
+        chunks = []
+        while frames > 0 and not self.finished:
+            on, _ = self._segments[self._segment]
+            n = min(frames, self._segment_left)
+            chunks.append(super().read(n) if on else np.zeros((n, 1), dtype=np.float32))
+            frames -= n
+            self._segment_left -= n
+            if self._segment_left == 0:
+                self._segment = (self._segment + 1) % len(self._segments)
+                self._segment_left = self._segments[self._segment][1]
+                if self._segment == 0:
+                    # Start every period at the same phase
+                    self.position = 0
+                    if self._remaining_periods is not None:
+                        self._remaining_periods -= 1
+        if not chunks:
+            return np.zeros((0, 1), dtype=np.float32)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    @property
+    def finished(self) -> bool:
+        return self._remaining_periods is not None and self._remaining_periods <= 0
+
+
+class Mixer:
+    """Mixes any number of voices into one long-lived playback stream.
+
+    The stream is a single `pacat` process that is started once and fed raw
+    s16le PCM through its stdin for the lifetime of the program. Blocks are
+    written paced to the wall clock, staying `latency` seconds ahead of what is
+    audible, so a newly added voice is heard within roughly one latency period.
+    """
+
+    def __init__(self, command: list[str], rate: int = 48000, channels: int = 2,
+                 block_frames: int = 480, latency: float = 0.04):
+        self._command = command
+        self.rate = rate
+        self.channels = channels
+        self._block_frames = block_frames
+        self._latency = latency
+        self._voices: list[Voice] = []
+        self._process: asyncio.subprocess.Process | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Open the output stream if it is not already running."""
+        if self.running:
+            return
+        # Mixing that failed leaves pacat running, don't open a second stream next to it
+        await self.close()
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *self._command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            raise AudioEngineError(f"Could not open output stream: {e}") from e
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop mixing and close the output stream."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._process and self._process.returncode is None:
+            self._process.stdin.close()
+            self._process.terminate()
+            await self._process.wait()
+        self._process = None
+
+    async def play(self, voice: Voice):
+        """Mix `voice` into the stream and wait until it was played. Can be cancelled/stopped."""
+        if not self.running:
+            raise AudioEngineError("Output stream is not running")
+        self._voices.append(voice)
+        try:
+            await asyncio.shield(voice.done)
+        except asyncio.CancelledError:
+            self._remove(voice)
+            raise
+
+    def _remove(self, voice: Voice):
+        if voice in self._voices:
+            self._voices.remove(voice)
+
+    def _mix(self) -> bytes:
+        out = np.zeros((self._block_frames, self.channels), dtype=np.float32)
+        for voice in list(self._voices):
+            if voice.span is not None:
+                # Audible once the frames ahead of this block are played
+                voice.span.end(delay=self._latency)
+                voice.span = None
+            chunk = voice.read(self._block_frames)
+            if len(chunk):
+                if chunk.shape[1] == self.channels or chunk.shape[1] == 1:
+                    out[:len(chunk)] += chunk
+                else:
+                    out[:len(chunk), :min(self.channels, chunk.shape[1])] += chunk[:, :self.channels]
+            if voice.finished:
+                self._remove(voice)
+                # The remaining frames are still in flight, resolve once they are audible
+                asyncio.get_running_loop().call_later(
+                    self._latency, lambda v=voice: v.done.done() or v.done.set_result(None))
+        np.clip(out, -1.0, 1.0, out=out)
+        return (out * 32767).astype("<i2").tobytes()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        silence = bytes(self._block_frames * self.channels * 2)
+        block_duration = self._block_frames / self.rate
+        next_time = loop.time()
+        try:
+            while True:
+                data = self._mix() if self._voices else silence
+                self._process.stdin.write(data)
+                await self._process.stdin.drain()
+
+                next_time += block_duration
+                delay = next_time - self._latency - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif delay < -0.5:
+                    # The loop stalled, resync instead of bursting to catch up
+                    next_time = loop.time()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logger.error("Output stream closed unexpectedly: %s", e)
+        except Exception:
+            logger.exception("Mixing failed, output stream stopped")
+        finally:
+            # However mixing ended, nobody may wait for a voice that is never played
+            error = AudioEngineError("Output stream closed")
+            for voice in self._voices:
+                if not voice.done.done():
+                    voice.done.set_exception(error)
+            self._voices.clear()
@@ -1,74 +1,209 @@
 import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import wave
 from pathlib import Path
+from .audio_engine import AudioEngineError, CadenceVoice, Mixer, Voice
+from .clock import Clock
+from .pulse_control import SinkControl
+from .capture import (PCM_CODECS, CaptureSink, CaptureStream, LevelMeterSink, SampleSpec, SilenceGate,
+                      negotiate_spec, probe_source_spec, record)
+from .sound_bank import SoundBank
+from .staging import StagedWavSink, part_path
+from .transcode_cache import TranscodeCache
+from .latency import Span
+from .tones import Cadence, render_cadence, render_dtmf
 from .settings import settings
 
 _PAPLAY = "paplay"
+_PACAT = "pacat"
 _FFMPEG = "ffmpeg"
 _PACTL = "pactl"
+_PACMD = "pacmd"
+
+logger = logging.getLogger(__name__)
+
+# Checked on startup, the first recording would fail otherwise
+if settings.record_format is not None and settings.record_format not in PCM_CODECS:
+    raise ValueError(f"Unknown RECORD_FORMAT {settings.record_format!r}, expected one of {list(PCM_CODECS)}")
 
 
 class AudioManager:
     def __init__(self, 
                  pulse_sink: str | None = None,
                  pulse_source: str | None = None,
-                 output_dir: str | None = None):
+                 output_dir: str | Path | None = None,
+                 backend: str | None = None,
+                 sound_bank: SoundBank | None = None,
+                 clock: Clock | None = None,
+                 transcode_cache: TranscodeCache | None = None):
         """Initialize the audio manager with optional PulseAudio device configurations.
         
         Args:
             pulse_sink: PulseAudio sink name for playback (e.g. "alsa_output.pci-0000_00_1f.3.analog-stereo")
             pulse_source: PulseAudio source name for recording (e.g. "alsa_input.pci-0000_00_1f.3.analog-stereo")
             output_dir: Directory to store recorded audio files
+            backend: "mixer" for long-lived in-process output and capture streams,
+                "subprocess" for one paplay/ffmpeg per sound and recording
+            sound_bank: Cache of decoded sounds, can be shared between audio managers
+            clock: Clock for timeouts, the real one unless simulating
+            transcode_cache: Sounds pre-decoded to the sink's format, can be shared between audio managers
         """
         self._pulse_sink = pulse_sink or settings.audio_sink
         self._pulse_source = pulse_source or settings.audio_source
-        
+        self.output_dir = Path(output_dir) if output_dir else settings.output_dir
+        self.clock = clock or Clock()
+        self._output_dir_ready = False
+        self._mixer: Mixer | None = None
+        self._capture: CaptureStream | None = None
+        self._capture_spec: SampleSpec | None = None
+        self._use_capture_stream = (backend or settings.audio_backend) == "mixer"
+        if (backend or settings.audio_backend) == "mixer":
+            cmd = [_PACAT, "--playback", "--raw", "--format=s16le",
+                   f"--rate={settings.audio_rate}", f"--channels={settings.audio_channels}",
+                   f"--latency-msec={settings.audio_latency_ms}", "--client-name=audio_guestbook"]
+            if self._pulse_sink:
+                cmd.append(f"--device={self._pulse_sink}")
+            self._mixer = Mixer(cmd, rate=settings.audio_rate, channels=settings.audio_channels,
+                                latency=settings.audio_latency_ms / 1000)
+        self._sink_control = SinkControl(self._pulse_sink, _PACTL, _PACMD) if self._pulse_sink else None
+        # Synthesized tones written to files for paplay, by what they were rendered from
+        self._rendered_files: dict[tuple, Path] = {}
+        self.sound_bank = sound_bank or SoundBank(
+            settings.sound_bank_bytes, settings.audio_rate, settings.audio_channels, _FFMPEG)
+        if transcode_cache is None and settings.transcode_cache_dir is not None:
+            transcode_cache = TranscodeCache(
+                settings.transcode_cache_dir, settings.audio_rate, settings.audio_channels, _FFMPEG)
+        self.transcode_cache = transcode_cache
+        # Transcodes started by cache misses, referenced until done
+        self._warming: set[asyncio.Task] = set()
+
+    async def start(self):
+        """Open the sink control channel and the output and capture streams of the mixer backend.
+
+        Falls back to paplay/ffmpeg for whichever stream can't be opened.
+        """
+        if not self._output_dir_ready:
+            # start() runs before every sound, only touch the card the first time
+            await asyncio.to_thread(self.output_dir.mkdir, parents=True, exist_ok=True)
+            self._output_dir_ready = True
+        if self._sink_control is not None:
+            await self._sink_control.start()
+        if self._mixer is not None and not self._mixer.running:
+            try:
+                await self._mixer.start()
+            except AudioEngineError as e:
+                logger.warning("Falling back to paplay: %s", e)
+                self._mixer = None
+        if self._use_capture_stream and (self._capture is None or not self._capture.running):
+            spec = await self.capture_spec()
+            cmd = [_PACAT, "--record", "--raw", f"--format={spec.format}", f"--rate={spec.rate}",
+                   f"--channels={spec.channels}", "--client-name=audio_guestbook"]
+            if self._pulse_source:
+                cmd.append(f"--device={self._pulse_source}")
+            self._capture = CaptureStream(cmd, spec)
+            try:
+                await self._capture.start()
+            except AudioEngineError as e:
+                logger.warning("Falling back to ffmpeg for recording: %s", e)
+                self._capture = None
+                self._use_capture_stream = False
+
+    async def capture_spec(self) -> SampleSpec:
+        """The format recordings are made in, probed from the source once and cached."""
+        if self._capture_spec is None:
+            native = await probe_source_spec(_PACTL, self._pulse_source)
+            self._capture_spec = negotiate_spec(
+                native, settings.record_format, settings.record_rate, settings.record_channels)
+            logger.info("Recording as %s (source native: %s)", self._capture_spec, native or "unknown")
+        return self._capture_spec
+
+    async def close(self):
+        """Close the sink control channel and the output and capture streams."""
+        if self._sink_control is not None:
+            await self._sink_control.close()
+        if self._mixer is not None:
+            await self._mixer.close()
+        if self._capture is not None:
+            await self._capture.close()
+
     async def set_volume(self, volume_percent: int):
         """Set the volume of the audio output.
         
         Args:
             volume_percent: Volume level as a percentage (0-100)
         """
-        if not self._pulse_sink:
+        if not self._sink_control:
             return
 
         volume_percent = max(0, min(100, volume_percent))  # Clamp between 0-100
-        volume_decimal = volume_percent / 100
-
-        cmd = [_PACTL, "set-sink-volume", self._pulse_sink, f"{volume_decimal:.2f}"]
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        await process.wait()
+        await self._sink_control.set_volume(volume_percent / 100)
 
     async def mute(self):
         """Mute the audio output."""
-        if not self._pulse_sink:
-            return
-
-        cmd = [_PACTL, "set-sink-mute", self._pulse_sink, "1"]
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        await process.wait()
+        if self._sink_control:
+            await self._sink_control.set_mute(True)
 
     async def unmute(self):
         """Unmute the audio output."""
-        if not self._pulse_sink:
-            return
+        if self._sink_control:
+            await self._sink_control.set_mute(False)
 
-        cmd = [_PACTL, "set-sink-mute", self._pulse_sink, "0"]
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        await process.wait()
+    async def _load(self, file_path: str):
+        """Load a file for the mixer, None if it can't be read (paplay would just stay silent too)."""
+        pcm = self.sound_bank.cached(file_path)
+        if pcm is not None:
+            return pcm
+        try:
+            return await asyncio.to_thread(self.sound_bank.get, file_path)
+        except Exception as e:
+            logger.warning("Could not load %s: %s", file_path, e)
+            return None
+
+    async def preload(self, file_paths):
+        """Transcode sounds and decode them into the sound bank ahead of their first play."""
+        file_paths = list(file_paths)
+        if self.transcode_cache is not None:
+            await asyncio.to_thread(self.transcode_cache.warm, file_paths)
+            file_paths = [self.transcode_cache.resolve(file_path) for file_path in file_paths]
+        if self._mixer is not None:
+            await asyncio.to_thread(self.sound_bank.preload, file_paths)
+
+    def _resolve(self, file_path: str) -> str:
+        """The transcoded artifact of `file_path` if one is ready, `file_path` itself otherwise."""
+        if self.transcode_cache is None:
+            return str(file_path)
+        artifact = self.transcode_cache.lookup(file_path)
+        if artifact is not None:
+            return str(artifact)
+        # New or changed since the last warm: decode it live this time, transcode it for the next call
+        logger.info("No transcode of %s yet, decoding it live", file_path)
+        task = asyncio.create_task(asyncio.to_thread(self.transcode_cache.warm, [file_path]))
+        self._warming.add(task)
+        task.add_done_callback(self._warming.discard)
+        return str(file_path)
+
+    async def play_audio(self, file_path: str, span: Span | None = None):
+        """Play an audio file. Can be cancelled/stopped.
 
-    async def play_audio(self, file_path: str):
+        `span` is ended when the backend actually starts the output.
+        """
+        await self.start()
+        file_path = self._resolve(file_path)
+        if self._mixer is not None:
+            pcm = await self._load(file_path)
+            if pcm is None:
+                return
+            try:
+                await self._mixer.play(Voice(pcm, span=span))
+                return
+            except AudioEngineError as e:
+                logger.warning("Output stream failed, playing %s with paplay: %s", file_path, e)
+        await self._play_subprocess(file_path, span)
+
+    async def _play_subprocess(self, file_path: str, span: Span | None = None):
         """Play an audio file using paplay. Can be cancelled/stopped."""
         cmd = [_PAPLAY]
         if self._pulse_sink:
@@ -80,6 +215,8 @@ class AudioManager:
             stdout=asyncio.subprocess.DEVNULL,
             stderr=asyncio.subprocess.DEVNULL
         )
+        if span is not None:
+            span.end()
 
         try:
             await process.wait()
@@ -89,31 +226,116 @@ class AudioManager:
             await process.wait()
             raise
 
-    async def play_audio_loop(self, file_path: str):
-        """Play an audio file in a loop using paplay. Can be cancelled/stopped."""
+    async def play_audio_loop(self, file_path: str, span: Span | None = None):
+        """Play an audio file in a gapless loop. Can be cancelled/stopped."""
+        await self.start()
+        file_path = self._resolve(file_path)
+        if self._mixer is not None:
+            pcm = await self._load(file_path)
+            if pcm is None:
+                # Nothing to loop, stay silent until cancelled
+                await asyncio.Event().wait()
+            try:
+                await self._mixer.play(Voice(pcm, loop=True, span=span))
+            except AudioEngineError as e:
+                logger.warning("Output stream failed, looping %s with paplay: %s", file_path, e)
         while True:
+            await self._play_subprocess(file_path, span)
+
+    async def play_cadence(self, cadence: Cadence, repeat: int | None = None, span: Span | None = None):
+        """Play `repeat` periods of a call-progress tone, forever if None. Can be cancelled/stopped."""
+        await self.start()
+        if self._mixer is not None:
+            try:
+                await self._mixer.play(CadenceVoice(cadence, self._mixer.rate, repeat, span))
+                return
+            except AudioEngineError as e:
+                logger.warning("Output stream failed, playing cadence with paplay: %s", e)
+
+        # paplay needs a file, render the periods once
+        # Continuous tones get a few seconds per file to keep respawns rare
+        path = self._rendered_file(("cadence", cadence), lambda: render_cadence(
+            cadence, settings.audio_rate, 0 if cadence.pattern else 10))
+        if repeat is None:
+            while True:
+                await self._play_subprocess(path, span)
+        for _ in range(repeat):
+            await self._play_subprocess(path, span)
+
+    async def play_dtmf(self, key: int | str, seconds: float, span: Span | None = None):
+        """Play the synthesized DTMF tone of a keypad key. Can be cancelled/stopped."""
+        await self.start()
+        if self._mixer is not None:
             try:
-                await self.play_audio(file_path)
-            except asyncio.CancelledError:
-                raise
+                await self._mixer.play(Voice(render_dtmf(key, seconds, self._mixer.rate), span=span))
+                return
+            except AudioEngineError as e:
+                logger.warning("Output stream failed, playing DTMF with paplay: %s", e)
+        await self._play_subprocess(self._rendered_file(
+            ("dtmf", key, seconds), lambda: render_dtmf(key, seconds, settings.audio_rate)), span)
 
-    async def record_audio(self, output_path: str, duration: int = 10):
+    def _rendered_file(self, key: tuple, render) -> str:
+        """Write the mono float PCM returned by `render` to a temporary WAV file, once per key.
+
+        The name is a digest of the key, so later runs find and reuse the file.
+        """
+        if key not in self._rendered_files:
+            digest = hashlib.sha256(repr((key, settings.audio_rate)).encode()).hexdigest()[:16]
+            path = Path(tempfile.gettempdir()) / f"audio_guestbook-{key[0]}-{digest}.wav"
+            if not path.exists():
+                pcm = render()
+                tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+                with wave.open(str(tmp_path), "wb") as wav:
+                    wav.setnchannels(1)
+                    wav.setsampwidth(2)
+                    wav.setframerate(settings.audio_rate)
+                    wav.writeframes((pcm * 32767).astype("<i2").tobytes())
+                os.replace(tmp_path, path)
+            self._rendered_files[key] = path
+        return str(self._rendered_files[key])
+
+    async def record_audio(self, output_path: Path, duration: int = 10,
+                           sinks: list[CaptureSink] | None = None):
+        """Record a WAV file for a given duration. Can be cancelled/stopped.
+
+        Extra `sinks` get the same chunks as the WAV file. They and the voice
+        activity settings are only supported by the in-process capture stream.
+        """
+        await self.start()
+        if self._capture is not None and self._capture.running:
+            wav_sink = StagedWavSink(output_path, settings.staging_flush_seconds, settings.staging_fsync_seconds)
+            if settings.vad_enabled:
+                wav_sink = SilenceGate([wav_sink],
+                                       threshold_dbfs=settings.vad_threshold_dbfs,
+                                       silence_seconds=settings.vad_silence_seconds,
+                                       leading_seconds=settings.vad_leading_seconds,
+                                       pad_seconds=settings.vad_pad_seconds)
+            try:
+                await record(self._capture, [wav_sink, LevelMeterSink(), *(sinks or [])], duration)
+            except AudioEngineError as e:
+                # The WAV file was finalized, keep what was recorded so far
+                logger.error("Recording to %s ended early: %s", output_path, e)
+            return
+        await self._record_subprocess(output_path, duration)
+
+    async def _record_subprocess(self, output_path: Path, duration: int):
         """Record a WAV file using ffmpeg for a given duration. Can be cancelled/stopped."""
-        
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(output_path.parent.mkdir, parents=True, exist_ok=True)
 
         cmd = [_FFMPEG]
         if self._pulse_source:
             cmd.extend(["-f", "pulse", "-i", self._pulse_source])
         else:
             cmd.extend(["-f", "pulse", "-i", "default"])
+        spec = await self.capture_spec()
         cmd.extend([
             "-t", str(duration),  # duration in seconds
-            "-acodec", "pcm_s16le",  # 16-bit signed little-endian
-            "-ar", "44100",  # 44.1 kHz
-            "-ac", "2",  # stereo
+            "-acodec", spec.ffmpeg_codec,  # sample format, e.g. pcm_s16le for 16-bit signed little-endian
+            "-ar", str(spec.rate),
+            "-ac", str(spec.channels),
+            "-f", "wav",  # the part suffix doesn't tell ffmpeg the format
             "-y",  # overwrite output file if it exists
-            str(output_path)
+            str(part_path(output_path))
         ])
 
         process = await asyncio.create_subprocess_exec(
@@ -123,8 +345,9 @@ class AudioManager:
         )
 
         try:
-            await asyncio.wait_for(process.wait(), timeout=duration + 1)
-        except asyncio.TimeoutError:
+            async with self.clock.timeout(duration + 1):
+                await process.wait()
+        except TimeoutError:
             if process:
                 process.terminate()
                 await process.wait()
@@ -132,4 +355,8 @@ class AudioManager:
             if process:
                 process.terminate()
                 await process.wait()
-            raise 
\ No newline at end of file
+            raise
+        finally:
+            # ffmpeg finalized the header when it exited, a crash leaves the part file for recovery
+            if part_path(output_path).exists():
+                os.replace(part_path(output_path), output_path) 
\ No newline at end of file
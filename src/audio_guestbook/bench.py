@@ -0,0 +1,403 @@
+"""Headless benchmark of the state machine.
+
+Builds the telephone's pins on a gpiozero MockFactory, scripts whole call
+sessions against them and replaces the audio backend with a fake that only
+records what it was asked to do. No sound hardware or PulseAudio is needed:
+
+    python -m audio_guestbook.bench --calls 50
+    python -m audio_guestbook.bench --scenario hangup-recording --json
+
+With --virtual-time the calls run on a VirtualClock, so timeouts, playback
+and full length recordings take no real time and thousands of calls replay
+in seconds. Reaction times are then 0, only real time measures those.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+from gpiozero.pins.mock import MockFactory
+
+from .clock import Clock, VirtualClock
+from .gpio_poller import GpioPoller
+from .latency import LatencyTracer, tracer
+from .metrics import StateMetrics
+from .settings import settings
+from .statemachine import contact_registry, run_statemachine
+
+# Same pins as run_tel.py
+ON_HOOK_PIN = 17
+OFF_HOOK_PIN = 18
+NUMBER_PINS = {num: num + 1 for num in range(10)}
+STAR_PIN = 23
+POUND_PIN = 24
+
+# Keypad buttons are debounced with 50 ms, edges closer than that are dropped
+_KEY_HOLD = 0.06
+# Longest wait for the state machine to react, on top of the fake recording length
+_STATE_TIMEOUT = 30
+
+
+class FakeAudioManager:
+    """Stands in for AudioManager: every call is timed and takes a fixed time instead of playing."""
+
+    def __init__(self, clock: Clock, play_seconds: float = 0.05, record_seconds: float = 0.5):
+        self.clock = clock
+        # Recordings are never written, only their names are made up
+        self.output_dir = settings.output_dir
+        # Nothing is decoded, so nothing is transcoded either
+        self.transcode_cache = None
+        self._play_seconds = play_seconds
+        self._record_seconds = record_seconds
+        # Method name -> (calls, total seconds)
+        self.calls: dict[str, list[float]] = {}
+
+    @contextlib.asynccontextmanager
+    async def _timed(self, name: str):
+        started = self.clock.monotonic()
+        try:
+            yield
+        finally:
+            stats = self.calls.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += self.clock.monotonic() - started
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def preload(self, paths):
+        pass
+
+    async def set_volume(self, volume: int):
+        async with self._timed("set_volume"):
+            pass
+
+    async def mute(self):
+        async with self._timed("mute"):
+            pass
+
+    async def unmute(self):
+        async with self._timed("unmute"):
+            pass
+
+    async def play_audio(self, file_path, span=None):
+        async with self._timed("play_audio"):
+            if span is not None:
+                span.end()
+            await self.clock.sleep(self._play_seconds)
+
+    async def play_dtmf(self, key, seconds, span=None):
+        async with self._timed("play_dtmf"):
+            if span is not None:
+                span.end()
+            await self.clock.sleep(seconds)
+
+    async def play_audio_loop(self, file_path, span=None):
+        async with self._timed("play_audio_loop"):
+            if span is not None:
+                span.end()
+            await asyncio.Event().wait()
+
+    async def play_cadence(self, cadence, repeat=None, span=None):
+        async with self._timed("play_cadence"):
+            if span is not None:
+                span.end()
+            if repeat is None:
+                await asyncio.Event().wait()
+            await self.clock.sleep(self._play_seconds * repeat)
+
+    async def record_audio(self, output_path, duration, sinks=None):
+        async with self._timed("record_audio"):
+            await self.clock.sleep(min(duration, self._record_seconds))
+
+
+class ObservedMetrics(StateMetrics):
+    """StateMetrics that the script can wait on."""
+
+    def __init__(self, timeout: float, trace_size: int = 4096):
+        super().__init__(trace_size)
+        self._timeout = timeout
+        # State name -> (times entered, Clock.monotonic() of the last entry)
+        self.entered: dict[str, tuple[int, float]] = {}
+        self._changed = asyncio.Event()
+
+    def record_transition(self, state: str, next_state: str, started: float, ended: float):
+        super().record_transition(state, next_state, started, ended)
+        count, _ = self.entered.get(next_state, (0, 0.0))
+        self.entered[next_state] = (count + 1, ended)
+        self._changed.set()
+
+    def mark(self, state: str) -> int:
+        return self.entered.get(state, (0, 0.0))[0]
+
+    async def wait_entered(self, state: str, mark: int) -> float:
+        """Wait until `state` was entered more often than `mark`, return when it was."""
+        async with asyncio.timeout(self._timeout):
+            while self.mark(state) <= mark:
+                self._changed.clear()
+                await self._changed.wait()
+        return self.entered[state][1]
+
+
+class MockHandset:
+    """Drives the mock pins like a caller would."""
+
+    def __init__(self, factory: MockFactory, clock: Clock, metrics: ObservedMetrics, reactions: LatencyTracer):
+        self.on_hook_pin = factory.pin(ON_HOOK_PIN)
+        self.off_hook_pin = factory.pin(OFF_HOOK_PIN)
+        self.key_pins = {**{num: factory.pin(pin) for num, pin in NUMBER_PINS.items()},
+                         "star": factory.pin(STAR_PIN), "pound": factory.pin(POUND_PIN)}
+        self.clock = clock
+        self.metrics = metrics
+        self._reactions = reactions
+        # Pulled up, nothing pressed and the handset on the hook
+        for pin in [self.off_hook_pin, *self.key_pins.values()]:
+            pin.drive_high()
+        self.on_hook_pin.drive_low()
+
+    async def _stimulus(self, name: str, state: str, action):
+        """Run `action` and measure how long the state machine takes to enter `state`."""
+        mark = self.metrics.mark(state)
+        started = self.clock.monotonic()
+        action()
+        self._reactions.observe(name, await self.metrics.wait_entered(state, mark) - started)
+
+    async def pick_up(self):
+        def action():
+            self.on_hook_pin.drive_high()
+            self.off_hook_pin.drive_low()
+        await self._stimulus("pick_up→PickedUpState", "PickedUpState", action)
+
+    async def hang_up(self):
+        def action():
+            self.on_hook_pin.drive_low()
+            self.off_hook_pin.drive_high()
+        await self._stimulus("hang_up→IdleState", "IdleState", action)
+
+    async def press(self, key: int | str):
+        self.key_pins[key].drive_low()
+        await self.clock.sleep(_KEY_HOLD)
+        self.key_pins[key].drive_high()
+        await self.clock.sleep(_KEY_HOLD)
+
+    async def dial(self, number: tuple[int | str, ...]):
+        """Dial `number` and wait until the state machine dials it."""
+        for key in number[:-1]:
+            await self.press(key)
+        await self._stimulus("last_key→DialingState", "DialingState", lambda: self.key_pins[number[-1]].drive_low())
+        await self.clock.sleep(_KEY_HOLD)
+        self.key_pins[number[-1]].drive_high()
+
+
+def _known_number() -> tuple[int | str, ...]:
+    return next(iter(contact_registry.directory)).number
+
+
+def _unknown_number() -> tuple[int | str, ...]:
+    """A single key no contact starts with, so it is dialed right away."""
+    first_keys = {contact.number[0] for contact in contact_registry.directory}
+    return (next(key for key in [*range(10), "star", "pound"] if key not in first_keys),)
+
+
+async def call(handset: MockHandset):
+    """Whole call: dial a contact, greeting, recording, goodbye, then hang up at the dial tone."""
+    await handset.pick_up()
+    mark = handset.metrics.mark("PickedUpState")
+    await handset.dial(_known_number())
+    await handset.metrics.wait_entered("PickedUpState", mark)
+    await handset.hang_up()
+
+
+async def unknown_number(handset: MockHandset):
+    await handset.pick_up()
+    mark = handset.metrics.mark("PickedUpState")
+    await handset.dial(_unknown_number())
+    await handset.metrics.wait_entered("PickedUpState", mark)
+    await handset.hang_up()
+
+
+async def hangup_dialing(handset: MockHandset):
+    await handset.pick_up()
+    await handset.press(_known_number()[0])
+    await handset.hang_up()
+
+
+async def _hangup_in(handset: MockHandset, state: str):
+    await handset.pick_up()
+    mark = handset.metrics.mark(state)
+    await handset.dial(_known_number())
+    await handset.metrics.wait_entered(state, mark)
+    await handset.hang_up()
+
+
+async def hangup_greeting(handset: MockHandset):
+    await _hangup_in(handset, "PlayGreetingState")
+
+
+async def hangup_recording(handset: MockHandset):
+    await _hangup_in(handset, "RecordMessageState")
+
+
+SCENARIOS = {
+    "call": call,
+    "unknown-number": unknown_number,
+    "hangup-dialing": hangup_dialing,
+    "hangup-greeting": hangup_greeting,
+    "hangup-recording": hangup_recording,
+}
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    reduced = LatencyTracer(window=len(values))
+    for value in values:
+        reduced.observe("", value)
+    return reduced.percentiles("")
+
+
+async def run_benchmark(scenarios: list[str], calls: int, play_seconds: float, record_seconds: float,
+                        clock: Clock, input_backend: str = "buttons") -> dict:
+    loop = asyncio.get_running_loop()
+    tasks_created = 0
+
+    def counting_task_factory(loop, coro, **kwargs):
+        nonlocal tasks_created
+        tasks_created += 1
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    loop.set_task_factory(counting_task_factory)
+
+    factory = MockFactory()
+    metrics = ObservedMetrics(_STATE_TIMEOUT + record_seconds)
+    reactions = LatencyTracer(window=max(calls, 1), clock=clock)
+    tracer.clock = clock
+    handset = MockHandset(factory, clock, metrics, reactions)
+    audio_manager = FakeAudioManager(clock, play_seconds, record_seconds)
+    poller = GpioPoller(factory, clock=clock) if input_backend == "poller" else None
+
+    statemachine_task = asyncio.create_task(run_statemachine(
+        factory, handset.on_hook_pin, handset.off_hook_pin,
+        {num: handset.key_pins[num] for num in range(10)}, handset.key_pins["star"], handset.key_pins["pound"],
+        audio_manager, metrics, clock, poller))
+    # The buttons only see edges once the state machine created them
+    await clock.sleep(0.1)
+
+    per_scenario: dict[str, dict[str, list[float]]] = {
+        name: {"seconds": [], "tasks": []} for name in scenarios}
+    transitions_before = sum(metrics.entries.values())
+    started, wall_started = clock.monotonic(), time.monotonic()
+    for i in range(calls):
+        name = scenarios[i % len(scenarios)]
+        call_started, tasks_before = clock.monotonic(), tasks_created
+        await SCENARIOS[name](handset)
+        per_scenario[name]["seconds"].append(clock.monotonic() - call_started)
+        per_scenario[name]["tasks"].append(tasks_created - tasks_before)
+    elapsed, wall_elapsed = clock.monotonic() - started, time.monotonic() - wall_started
+    transitions = sum(metrics.entries.values()) - transitions_before
+    tasks_alive = len(asyncio.all_tasks())
+
+    statemachine_task.cancel()
+    try:
+        await statemachine_task
+    except asyncio.CancelledError:
+        pass
+    loop.set_task_factory(None)
+
+    state_durations: dict[str, list[float]] = {}
+    for transition in metrics.trace:
+        state_durations.setdefault(transition.state, []).append(transition.duration)
+
+    return {
+        "calls": calls,
+        "virtual_time": isinstance(clock, VirtualClock),
+        "input_backend": input_backend,
+        # Call time, the same as wall time unless it is virtual
+        "seconds": elapsed,
+        "wall_seconds": wall_elapsed,
+        "transitions": transitions,
+        "transitions_per_second": transitions / wall_elapsed if wall_elapsed else 0.0,
+        "tasks_created": tasks_created,
+        "tasks_per_call": tasks_created / calls if calls else 0.0,
+        # Still running when the last call ended, grows with leaked tasks
+        "tasks_alive": tasks_alive,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "scenarios": {name: {"calls": len(stats["seconds"]),
+                             "seconds": _percentiles(stats["seconds"]),
+                             "tasks_per_call": sum(stats["tasks"]) / len(stats["tasks"]) if stats["tasks"] else 0.0}
+                      for name, stats in per_scenario.items()},
+        "state_seconds": {state: _percentiles(durations) for state, durations in sorted(state_durations.items())},
+        "reactions": reactions.report(),
+        "latency": tracer.report(),
+        "audio_calls": {name: {"calls": count, "seconds": total}
+                        for name, (count, total) in sorted(audio_manager.calls.items())},
+    }
+
+
+def _print_report(report: dict):
+    def ms(stats: dict[str, float]) -> str:
+        if not stats.get("count"):
+            return "-"
+        return " ".join(f"{k}={stats[k] * 1000:.1f}ms" for k in ("p50", "p90", "p99", "max"))
+
+    if report["virtual_time"]:
+        print(f"📊 {report['calls']} calls in {report['wall_seconds']:.2f} s "
+              f"({report['seconds']:.0f} s virtual time)")
+    else:
+        print(f"📊 {report['calls']} calls in {report['wall_seconds']:.2f} s")
+    print(f"   transitions/s: {report['transitions_per_second']:.1f} ({report['transitions']} transitions)")
+    print(f"   tasks per call: {report['tasks_per_call']:.1f}, still alive: {report['tasks_alive']}")
+    print(f"   peak RSS: {report['peak_rss_mb']:.1f} MiB, input: {report['input_backend']}")
+    print("Scenarios:")
+    for name, stats in report["scenarios"].items():
+        print(f"   {name:18} {stats['calls']:4} calls, {stats['tasks_per_call']:.1f} tasks/call, {ms(stats['seconds'])}")
+    print("Time in state:")
+    for state, stats in report["state_seconds"].items():
+        print(f"   {state:18} {ms(stats)}")
+    print("Reaction to input:")
+    for name, stats in {**report["reactions"], **report["latency"]}.items():
+        print(f"   {name:24} {ms(stats)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m audio_guestbook.bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=len(SCENARIOS) * 4, help="number of call sessions to run")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, repeatable (default: all in turn)")
+    parser.add_argument("--play-seconds", type=float, default=0.05, help="duration of every fake playback")
+    parser.add_argument("--record-seconds", type=float, default=0.5, help="duration of every fake recording")
+    parser.add_argument("--virtual-time", action="store_true",
+                        help="run on a virtual clock, waiting and recording take no real time")
+    parser.add_argument("--input-backend", choices=["buttons", "poller"], default="buttons",
+                        help="a gpiozero Button per pin or one thread polling all pins")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the state machine's output")
+    args = parser.parse_args()
+    if args.virtual_time and args.input_backend == "poller":
+        parser.error("the poller thread runs in real time, it can't be used with --virtual-time")
+
+    scenarios = args.scenario or list(SCENARIOS)
+    clock = VirtualClock() if args.virtual_time else Clock()
+    benchmark = run_benchmark(scenarios, args.calls, args.play_seconds, args.record_seconds, clock,
+                              args.input_backend)
+    if args.verbose:
+        report = clock.run(benchmark)
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = clock.run(benchmark)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
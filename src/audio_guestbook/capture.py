@@ -0,0 +1,425 @@
+import asyncio
+import contextlib
+import logging
+import math
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator
+
+import numpy as np
+
+from .audio_engine import AudioEngineError, to_float32
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for the next chunk before the capture stream counts as dead
+_CHUNK_TIMEOUT = 2.0
+
+
+@dataclass(frozen=True)
+class SampleSpec:
+    """Sample format of a capture stream, named like PulseAudio does (s16le, 1ch, 48000Hz)."""
+    format: str = "s16le"
+    rate: int = 44100
+    channels: int = 2
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype({"u8": "u1", "s16le": "<i2", "s32le": "<i4", "float32le": "<f4"}[self.format])
+
+    @property
+    def ffmpeg_codec(self) -> str:
+        return PCM_CODECS[self.format]
+
+    @property
+    def sample_width(self) -> int:
+        return self.dtype.itemsize
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.sample_width * self.channels
+
+    def __str__(self):
+        return f"{self.format} {self.channels}ch {self.rate}Hz"
+
+
+# Sample formats WAV files can store and ffmpeg's codec for each, anything else is converted by PulseAudio
+PCM_CODECS = {"u8": "pcm_u8", "s16le": "pcm_s16le", "s32le": "pcm_s32le"}
+
+
+def parse_sample_spec(text: str) -> SampleSpec | None:
+    """Parse a PulseAudio sample spec like "s16le 1ch 48000Hz"."""
+    try:
+        format, channels, rate = text.split()
+        return SampleSpec(format, int(rate.removesuffix("Hz")), int(channels.removesuffix("ch")))
+    except ValueError:
+        return None
+
+
+def negotiate_spec(native: SampleSpec | None, format: str | None = None,
+                   rate: int | None = None, channels: int | None = None) -> SampleSpec:
+    """Pick the recording format: the source's native spec unless explicitly overridden.
+
+    Only an explicit rate or channel override makes PulseAudio resample or remix.
+    An explicit format has to be one WAV files can store.
+    """
+    base = native or SampleSpec()
+    if format is None:
+        format = base.format if base.format in PCM_CODECS else "s16le"
+    elif format not in PCM_CODECS:
+        raise ValueError(f"Can't record WAV files in {format!r}, expected one of {list(PCM_CODECS)}")
+    return SampleSpec(format, rate or base.rate, channels or base.channels)
+
+
+async def probe_source_spec(pactl: str, source: str | None) -> SampleSpec | None:
+    """Ask PulseAudio for the native sample spec of `source` (or the default source)."""
+    async def run(*args) -> str:
+        process = await asyncio.create_subprocess_exec(
+            pactl, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await process.communicate()
+        return stdout.decode(errors="replace")
+
+    try:
+        if not source:
+            source = (await run("get-default-source")).strip()
+        for line in (await run("list", "short", "sources")).splitlines():
+            fields = line.split("\t")
+            if len(fields) >= 4 and fields[1] == source:
+                return parse_sample_spec(fields[3])
+    except OSError as e:
+        logger.warning("Could not probe %s: %s", source, e)
+    return None
+
+
+class CaptureSink:
+    """Receives the chunks of a recording.
+
+    A sink may set `finished` to end the recording early.
+    """
+    finished: bool = False
+
+    async def open(self, spec: SampleSpec):
+        pass
+
+    async def write(self, chunk: np.ndarray):
+        raise NotImplementedError("Each sink must implement write()")
+
+    async def close(self):
+        pass
+
+
+class WavSink(CaptureSink):
+    """Writes the recording to a WAV file, the header is finalized on close."""
+
+    def __init__(self, output_path: Path):
+        self.output_path = output_path
+        self._wav: wave.Wave_write | None = None
+
+    async def open(self, spec: SampleSpec):
+        if spec.format == "float32le":
+            raise ValueError("WAV sink can only write integer PCM")
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._wav = wave.open(str(self.output_path), "wb")
+        self._wav.setnchannels(spec.channels)
+        self._wav.setsampwidth(spec.sample_width)
+        self._wav.setframerate(spec.rate)
+
+    async def write(self, chunk: np.ndarray):
+        self._wav.writeframesraw(chunk.tobytes())
+
+    async def close(self):
+        if self._wav is not None:
+            # Patches the header with the final length
+            self._wav.close()
+            self._wav = None
+
+
+class LevelMeterSink(CaptureSink):
+    """Tracks peak and RMS level of a recording in dBFS."""
+
+    def __init__(self):
+        self.peak = 0.0
+        self._sum_squares = 0.0
+        self._samples = 0
+
+    async def write(self, chunk: np.ndarray):
+        samples = to_float32(chunk)
+        if samples.size:
+            self.peak = max(self.peak, float(np.abs(samples).max()))
+            self._sum_squares += float(np.square(samples, dtype=np.float64).sum())
+            self._samples += samples.size
+
+    @property
+    def peak_dbfs(self) -> float:
+        return 20 * math.log10(self.peak) if self.peak > 0 else -math.inf
+
+    @property
+    def rms_dbfs(self) -> float:
+        if not self._samples or not self._sum_squares:
+            return -math.inf
+        return 10 * math.log10(self._sum_squares / self._samples)
+
+    async def close(self):
+        logger.info("Recording level: peak %.1f dBFS, rms %.1f dBFS", self.peak_dbfs, self.rms_dbfs)
+
+
+class SilenceGate(CaptureSink):
+    """Voice activity gate in front of other sinks.
+
+    Every chunk is classified as voice or silence by its RMS level. Leading and
+    trailing silence is trimmed down to `pad_seconds` before it reaches the
+    wrapped sinks, and the recording is finished after `silence_seconds` of
+    silence following speech, or `leading_seconds` without any speech at all.
+    """
+
+    def __init__(self, sinks: list[CaptureSink], threshold_dbfs: float = -45.0,
+                 silence_seconds: float = 4.0, leading_seconds: float = 10.0,
+                 pad_seconds: float = 0.3):
+        self._sinks = sinks
+        # Compare mean squares instead of dBFS, saves a log per chunk
+        self._threshold = 10 ** (threshold_dbfs / 10)
+        self._silence_seconds = silence_seconds
+        self._leading_seconds = leading_seconds
+        self._pad_seconds = pad_seconds
+        self._rate = 0
+        self._pending: list[np.ndarray] = []
+        self._pending_frames = 0
+        self._silent_frames = 0
+        self._heard_voice = False
+        self.voiced_frames = 0
+        self.trimmed_frames = 0
+
+    async def open(self, spec: SampleSpec):
+        self._rate = spec.rate
+        for sink in self._sinks:
+            await sink.open(spec)
+
+    def _is_voice(self, chunk: np.ndarray) -> bool:
+        samples = to_float32(chunk)
+        return samples.size > 0 and float(np.mean(np.square(samples))) >= self._threshold
+
+    async def _forward(self, chunks: list[np.ndarray]):
+        for chunk in chunks:
+            for sink in self._sinks:
+                await sink.write(chunk)
+
+    def _keep_tail(self, seconds: float) -> list[np.ndarray]:
+        """The pending chunks covering the last `seconds`, counting the rest as trimmed."""
+        frames = int(seconds * self._rate)
+        kept = []
+        for chunk in reversed(self._pending):
+            if frames <= 0:
+                self.trimmed_frames += len(chunk)
+                continue
+            kept.append(chunk[-frames:])
+            self.trimmed_frames += max(0, len(chunk) - frames)
+            frames -= len(chunk)
+        return kept[::-1]
+
+    async def write(self, chunk: np.ndarray):
+        if self._is_voice(chunk):
+            if self._heard_voice:
+                await self._forward(self._pending)
+            else:
+                await self._forward(self._keep_tail(self._pad_seconds))
+            await self._forward([chunk])
+            self._heard_voice = True
+            self._pending.clear()
+            self._pending_frames = 0
+            self._silent_frames = 0
+            self.voiced_frames += len(chunk)
+            return
+
+        self._pending.append(chunk)
+        self._pending_frames += len(chunk)
+        self._silent_frames += len(chunk)
+        limit = self._silence_seconds if self._heard_voice else self._leading_seconds
+        if self._silent_frames >= limit * self._rate:
+            self.finished = True
+        elif not self._heard_voice and self._pending_frames > 2 * self._pad_seconds * self._rate:
+            # Only the pad before the first word is ever written, don't hold on to more
+            self._pending = self._keep_tail(self._pad_seconds)
+            self._pending_frames = sum(len(c) for c in self._pending)
+
+    async def close(self):
+        try:
+            if self._heard_voice:
+                await self._forward(self._keep_tail(self._pad_seconds))
+            else:
+                self.trimmed_frames += self._pending_frames
+            self._pending.clear()
+            if self._rate:
+                logger.info("Voice activity: %.1f s voice, %.1f s silence trimmed",
+                            self.voiced_frames / self._rate, self.trimmed_frames / self._rate)
+        finally:
+            for sink in self._sinks:
+                await sink.close()
+
+
+class EncoderSink(CaptureSink):
+    """Pipes the recording into an encoder process, e.g. ffmpeg writing FLAC."""
+
+    def __init__(self, command: list[str]):
+        """`command` must read raw PCM of the stream's sample spec from stdin."""
+        self._command = command
+        self._process: asyncio.subprocess.Process | None = None
+
+    @classmethod
+    def ffmpeg(cls, ffmpeg: str, spec: SampleSpec, output_path: Path, codec_args: list[str]):
+        return cls([ffmpeg, "-v", "error", "-f", spec.format, "-ar", str(spec.rate),
+                    "-ac", str(spec.channels), "-i", "-", *codec_args, "-y", str(output_path)])
+
+    async def open(self, spec: SampleSpec):
+        self._process = await asyncio.create_subprocess_exec(
+            *self._command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+
+    async def write(self, chunk: np.ndarray):
+        self._process.stdin.write(chunk.tobytes())
+        # Backpressure: a slow encoder slows down the pipeline instead of growing the pipe buffer
+        await self._process.stdin.drain()
+
+    async def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            await self._process.wait()
+            self._process = None
+
+
+class CaptureStream:
+    """A long-lived capture stream from the audio source.
+
+    A single `pacat --record` process is opened once and read in fixed-size
+    chunks. While nobody is recording the chunks are dropped, so a recording
+    starts on a stream that is already running instead of waiting for a process
+    to start up.
+    """
+
+    def __init__(self, command: list[str], spec: SampleSpec, chunk_frames: int = 4800):
+        self._command = command
+        self.spec = spec
+        self._chunk_frames = chunk_frames
+        self._process: asyncio.subprocess.Process | None = None
+        self._task: asyncio.Task | None = None
+        self._subscribers: list[asyncio.Queue] = []
+        self.overruns = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Open the capture stream if it is not already running."""
+        if self.running:
+            return
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *self._command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            raise AudioEngineError(f"Could not open capture stream: {e}") from e
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Close the capture stream."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._process and self._process.returncode is None:
+            self._process.terminate()
+            # Drain what is left in the pipe, wait() alone never returns while its reading is paused
+            await self._process.communicate()
+        self._process = None
+
+    async def chunks(self, max_queued: int = 16) -> AsyncIterator[np.ndarray]:
+        """Yield (frames, channels) chunks from now on until the generator is closed.
+
+        At most `max_queued` chunks are buffered for a slow consumer. Once they
+        are used up the oldest chunk is dropped for the new one, so memory stays
+        bounded, the stream never waits for a consumer and the overrun shows up
+        in `overruns` instead of being hidden.
+        """
+        if not self.running:
+            raise AudioEngineError("Capture stream is not running")
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._subscribers.append(queue)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), timeout=_CHUNK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise AudioEngineError("Capture stream stalled") from None
+                if chunk is None:
+                    raise AudioEngineError("Capture stream closed")
+                yield chunk
+        finally:
+            self._subscribers.remove(queue)
+
+    async def _run(self):
+        chunk_bytes = self._chunk_frames * self.spec.frame_bytes
+        try:
+            while True:
+                data = await self._process.stdout.readexactly(chunk_bytes)
+                chunk = np.frombuffer(data, dtype=self.spec.dtype).reshape(-1, self.spec.channels)
+                for queue in list(self._subscribers):
+                    self._offer(queue, chunk)
+        except (asyncio.IncompleteReadError, ConnectionResetError) as e:
+            logger.error("Capture stream closed unexpectedly: %s", e)
+            for queue in list(self._subscribers):
+                self._offer(queue, None)
+
+    def _offer(self, queue: asyncio.Queue, item: np.ndarray | None):
+        # Never wait for a consumer: one that left would never drain its queue
+        if queue.full():
+            self.overruns += 1
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+
+async def record(stream: CaptureStream, sinks: list[CaptureSink], duration: float,
+                 max_queued: int = 16):
+    """Feed `duration` seconds of the capture stream into the sinks. Can be cancelled/stopped.
+
+    The sinks are always closed, also on cancellation, so files are finalized
+    cleanly when the guest hangs up mid-message.
+    """
+    spec = stream.spec
+    frames_left = int(duration * spec.rate)
+    opened: list[CaptureSink] = []
+    try:
+        for sink in sinks:
+            await sink.open(spec)
+            opened.append(sink)
+        async with contextlib.aclosing(stream.chunks(max_queued)) as chunks:
+            async for chunk in chunks:
+                chunk = chunk[:frames_left]
+                for sink in sinks:
+                    await sink.write(chunk)
+                frames_left -= len(chunk)
+                if frames_left <= 0 or any(sink.finished for sink in sinks):
+                    break
+    finally:
+        cancelled = None
+        for sink in opened:
+            try:
+                await sink.close()
+            except asyncio.CancelledError as e:
+                # Still close the other sinks, cancelled once more while closing
+                cancelled = e
+            except Exception as e:
+                logger.error("Could not close %s: %s", type(sink).__name__, e)
+        if cancelled is not None:
+            raise cancelled
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import contextlib
+import csv
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import urllib.parse
+import wave
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, TextIO
+
+logger = logging.getLogger(__name__)
+
+# One row per recording with the dialed number, contact, times, size, format and checksum,
+# e.g. python -m audio_guestbook.catalog list --contact JanundLydia --since 2026-10-17
+
+# Formats the recorder and the encoder write, by suffix
+SUFFIXES = {".wav": "wav", ".flac": "flac", ".opus": "opus"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    dialed_number TEXT,
+    contact TEXT,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    duration REAL,
+    size INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_started_at ON recordings (started_at);
+CREATE INDEX IF NOT EXISTS recordings_contact ON recordings (contact, started_at);
+CREATE INDEX IF NOT EXISTS recordings_dialed_number ON recordings (dialed_number, started_at);
+"""
+
+_COLUMNS = "path, dialed_number, contact, started_at, ended_at, duration, size, format, sha256"
+
+
+@dataclass(frozen=True)
+class Recording:
+    path: str
+    dialed_number: str | None
+    contact: str | None
+    # Seconds since the epoch
+    started_at: float
+    ended_at: float | None
+    duration: float | None
+    size: int
+    format: str
+    sha256: str
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+
+def format_number(number) -> str | None:
+    """A dialed number as the digits on the keypad, "*" and "#" for star and pound."""
+    if number is None:
+        return None
+    return "".join({"star": "*", "pound": "#"}.get(key, str(key)) for key in number)
+
+
+def recording_started(path: Path) -> datetime:
+    """When a recording started, from its `YYYYmmdd_HHMMSS_mmm_<random>` name or else its mtime."""
+    try:
+        date, time_of_day, millis = path.name.split("_")[:3]
+        return datetime.strptime(f"{date}_{time_of_day}_{millis[:3]}000", "%Y%m%d_%H%M%S_%f")
+    except ValueError:
+        return datetime.fromtimestamp(path.stat().st_mtime)
+
+
+def _flac_duration(f) -> float | None:
+    # STREAMINFO is always the first metadata block: 20 bits rate, 3 channels, 5 bits per sample, 36 total samples
+    header = f.read(4 + 4 + 18)
+    if header[:4] != b"fLaC" or header[4] & 0x7F != 0:
+        return None
+    (packed,) = struct.unpack(">Q", header[18:26])
+    rate = packed >> 44
+    samples = packed & ((1 << 36) - 1)
+    return samples / rate if rate and samples else None
+
+
+def _opus_duration(f) -> float | None:
+    # The granule position of the last Ogg page counts 48 kHz samples, including the pre-skip of the header
+    head = f.read(64)
+    if head[:4] != b"OggS" or b"OpusHead" not in head:
+        return None
+    pre_skip = struct.unpack_from("<H", head, head.index(b"OpusHead") + 10)[0]
+    size = os.fstat(f.fileno()).st_size
+    f.seek(max(0, size - 65536))
+    tail = f.read()
+    last_page = tail.rfind(b"OggS")
+    if last_page < 0 or last_page + 14 > len(tail):
+        return None
+    granule = struct.unpack_from("<q", tail, last_page + 6)[0]
+    return max(0, granule - pre_skip) / 48000
+
+
+def _duration(path: Path, format: str) -> float | None:
+    """Duration from the file's header, without decoding any audio."""
+    try:
+        if format == "wav":
+            with wave.open(str(path), "rb") as wav:
+                return wav.getnframes() / wav.getframerate()
+        with open(path, "rb") as f:
+            return _flac_duration(f) if format == "flac" else _opus_duration(f)
+    except (OSError, EOFError, wave.Error, struct.error) as e:
+        logger.warning("Could not read the duration of %s: %s", path.name, e)
+        return None
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe(path: Path, dialed_number: str | None = None, contact: str | None = None) -> Recording:
+    """Read everything the catalog stores about the recording at `path`."""
+    format = SUFFIXES[path.suffix.lower()]
+    started_at = recording_started(path).timestamp()
+    duration = _duration(path, format)
+    return Recording(
+        path=str(path.resolve()),
+        dialed_number=dialed_number,
+        contact=contact,
+        started_at=started_at,
+        ended_at=started_at + duration if duration is not None else None,
+        duration=duration,
+        size=path.stat().st_size,
+        format=format,
+        sha256=_sha256(path),
+    )
+
+
+class RecordingCatalog:
+    """Recordings indexed in an SQLite database in WAL mode.
+
+    Reads may come from any thread or process while the recorder writes.
+    Recordings are cataloged by `submit()` from the event loop; reading and
+    hashing the file happens in a worker thread in `run()`, in the order of
+    submission, so a call never waits for the SD card.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # One writer, but the worker thread and callers may share the connection
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # Committed transactions survive a crash, a power loss may lose the last ones
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        self._queue: asyncio.Queue[Callable[[], None]] = asyncio.Queue()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add(self, recording: Recording):
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO recordings ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                dataclasses.astuple(recording))
+
+    def add_file(self, path: Path, dialed_number: str | None = None, contact: str | None = None):
+        self.add(describe(path, dialed_number, contact))
+
+    def replace_file(self, old_path: Path, new_path: Path):
+        """`old_path` was replaced by `new_path`, e.g. encoded; the call details stay."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT dialed_number, contact, duration, ended_at FROM recordings WHERE path = ?",
+                (str(old_path.resolve()),)).fetchone()
+        if row is None:
+            recording = describe(new_path)
+        else:
+            dialed_number, contact, duration, ended_at = row
+            recording = describe(new_path, dialed_number, contact)
+            if recording.duration is None:
+                recording = dataclasses.replace(recording, duration=duration, ended_at=ended_at)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM recordings WHERE path = ?", (str(old_path.resolve()),))
+            self._db.execute(
+                f"INSERT OR REPLACE INTO recordings ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                dataclasses.astuple(recording))
+
+    def submit(self, path: Path, context=None):
+        """Catalog a finished recording with the dialed number and contact of the call's context."""
+        dialed_number = format_number(context.dialed_number) if context is not None else None
+        contact = context.selected_contact.name if context is not None and context.selected_contact else None
+        self._queue.put_nowait(lambda: self.add_file(path, dialed_number, contact))
+
+    def submit_replaced(self, old_path: Path, new_path: Path):
+        self._queue.put_nowait(lambda: self.replace_file(old_path, new_path))
+
+    async def run(self):
+        """Catalog submitted recordings until cancelled."""
+        while True:
+            job = await self._queue.get()
+            try:
+                await asyncio.to_thread(job)
+            except (OSError, KeyError, sqlite3.Error) as e:
+                logger.error("Cataloging a recording failed: %s", e)
+
+    def query(self, contact: str | None = None, dialed_number: str | None = None,
+              since: datetime | None = None, until: datetime | None = None,
+              limit: int | None = None) -> list[Recording]:
+        """Recordings matching all given filters, oldest first."""
+        return list(self.iter(contact, dialed_number, since, until, limit))
+
+    def iter(self, contact: str | None = None, dialed_number: str | None = None,
+             since: datetime | None = None, until: datetime | None = None,
+             limit: int | None = None) -> Iterator[Recording]:
+        """Like `query()`, but streams the rows instead of loading them all."""
+        where, params = [], []
+        if contact is not None:
+            where.append("contact = ?")
+            params.append(contact)
+        if dialed_number is not None:
+            where.append("dialed_number = ?")
+            params.append(dialed_number)
+        if since is not None:
+            where.append("started_at >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            where.append("started_at < ?")
+            params.append(until.timestamp())
+        sql = f"SELECT {_COLUMNS} FROM recordings"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY started_at, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        # A separate connection, so a long export neither holds the lock nor sees half a write
+        uri = f"file:{urllib.parse.quote(str(self.path))}?mode=ro"
+        with contextlib.closing(sqlite3.connect(uri, uri=True)) as db:
+            db.row_factory = lambda cursor, row: Recording(*row)
+            yield from db.execute(sql, params)
+
+    def export(self, out: TextIO, format: str = "jsonl", **filters) -> int:
+        """Write the matching recordings to `out` as JSON lines or CSV, returns the number written."""
+        if format not in ("jsonl", "csv"):
+            raise ValueError(f"Unknown export format {format!r}, expected 'jsonl' or 'csv'")
+        writer = None
+        if format == "csv":
+            writer = csv.DictWriter(out, [field.name for field in dataclasses.fields(Recording)])
+            writer.writeheader()
+        count = 0
+        for recording in self.iter(**filters):
+            if writer is not None:
+                writer.writerow(recording.to_dict())
+            else:
+                out.write(json.dumps(recording.to_dict()) + "\n")
+            count += 1
+        return count
+
+    def backfill(self, directory: Path) -> int:
+        """Catalog the recordings in `directory` that aren't yet, returns how many were added.
+
+        Recordings made before the catalog existed have no dialed number or contact.
+        """
+        with self._lock:
+            known = {path for (path,) in self._db.execute("SELECT path FROM recordings")}
+        recordings = []
+        for path in sorted(directory.iterdir()):
+            # Partial and temporary files are finished by recovery and the encoder, not cataloged
+            if path.suffix.lower() not in SUFFIXES or ".tmp" in path.suffixes or not path.is_file():
+                continue
+            if str(path.resolve()) in known:
+                continue
+            try:
+                recordings.append(describe(path))
+            except OSError as e:
+                logger.warning("Skipping %s: %s", path.name, e)
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR IGNORE INTO recordings ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [dataclasses.astuple(recording) for recording in recordings])
+        return len(recordings)
+
+
+def main(argv: list[str] | None = None):
+    from .settings import settings
+
+    parser = argparse.ArgumentParser(prog="python -m audio_guestbook.catalog",
+                                     description="Catalog of all recordings in an SQLite database.")
+    parser.add_argument("--db", type=Path, default=settings.catalog_file,
+                        help="catalog database (default: CATALOG_FILE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill", help="catalog existing recordings")
+    backfill.add_argument("directories", type=Path, nargs="*", default=[settings.output_dir])
+    for name, help in (("list", "print matching recordings"), ("export", "write matching recordings")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--contact")
+        command.add_argument("--number", help="dialed number, e.g. 3005")
+        command.add_argument("--since", type=datetime.fromisoformat)
+        command.add_argument("--until", type=datetime.fromisoformat)
+        command.add_argument("--limit", type=int)
+        if name == "export":
+            command.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    args = parser.parse_args(argv)
+
+    if args.db is None:
+        parser.error("no catalog database, set CATALOG_FILE or pass --db")
+    catalog = RecordingCatalog(args.db)
+    try:
+        if args.command == "backfill":
+            for directory in args.directories:
+                print(f"{directory}: {catalog.backfill(directory)} recordings added")
+            return
+        filters = dict(contact=args.contact, dialed_number=args.number,
+                       since=args.since, until=args.until, limit=args.limit)
+        if args.command == "export":
+            catalog.export(sys.stdout, args.format, **filters)
+        else:
+            for recording in catalog.iter(**filters):
+                started = datetime.fromtimestamp(recording.started_at).strftime("%Y-%m-%d %H:%M:%S")
+                duration = f"{recording.duration:6.1f} s" if recording.duration is not None else "     ? s"
+                print(f"{started}  {duration}  {recording.dialed_number or '-':>8}  "
+                      f"{recording.contact or '-':20}  {Path(recording.path).name}")
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
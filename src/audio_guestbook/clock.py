@@ -0,0 +1,78 @@
+import asyncio
+import selectors
+import time
+
+
+class Clock:
+    """Real time, as used in production.
+
+    Everything in the call flow that sleeps, times out or takes a timestamp
+    goes through a Clock, so a simulation can swap in a VirtualClock.
+    """
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    def timeout(self, seconds: float | None) -> asyncio.Timeout:
+        return asyncio.timeout(seconds)
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.new_event_loop()
+
+    def run(self, main):
+        """Like asyncio.run(), on an event loop that follows this clock."""
+        with asyncio.Runner(loop_factory=self.new_event_loop) as runner:
+            return runner.run(main)
+
+
+class VirtualClock(Clock):
+    """Simulated time that jumps ahead whenever the event loop only waits for a timer.
+
+    Run the code under test with `run()`: its event loop reports the virtual
+    time from loop.time(), so asyncio.sleep(), asyncio.timeout() and
+    call_later() all follow it, and a 120 s recording passes in no time. Time
+    only advances while nothing is ready to run, so the order of events is the
+    same as in real time. Waiting for real IO (processes, sound cards) is not
+    compressed, this is meant for fake audio backends and mock pins.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += max(0.0, seconds)
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return _VirtualEventLoop(self)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout: float | None = None):
+        ready = super().select(0)
+        if ready or timeout is not None and timeout <= 0:
+            return ready
+        if timeout is None:
+            # No timer pending, only another thread or IO can wake the loop up
+            return super().select(None)
+        # The loop would sleep until its next timer, skip there instead
+        self._clock.advance(timeout)
+        return []
+
+
+class _VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        self._virtual_clock = clock
+        super().__init__(_VirtualSelector(clock))
+
+    def time(self) -> float:
+        return self._virtual_clock.now
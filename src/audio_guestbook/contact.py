@@ -1,5 +1,15 @@
-from dataclasses import dataclass
+import asyncio
+import csv
+import json
+import logging
+import os
+import tomllib
+from dataclasses import dataclass, field
+from enum import Enum, auto
+from pathlib import Path
+from typing import Callable
 
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -15,8 +25,176 @@ class Contact:
         return f"Contact(name={self.name}, number={self.number})"
 
 
-def was_dialed(number: tuple[int|str], contacts: list[Contact]) -> Contact | None:
+class DialResult(Enum):
+    # A contact's number, and no other number continues it
+    COMPLETE = auto()
+    # A contact's number, but also the start of a longer one
+    AMBIGUOUS = auto()
+    # Not a number yet, but the start of one
+    PREFIX = auto()
+    # No number starts like this
+    DEAD = auto()
+
+
+@dataclass
+class _TrieNode:
+    children: dict[int | str, '_TrieNode'] = field(default_factory=dict)
+    contact: Contact | None = None
+
+
+class ContactDirectory:
+    """Contacts indexed by number in a prefix trie.
+
+    A lookup walks one node per digit, independent of the number of contacts,
+    and tells whether the digits dialed so far can still become a number.
+    """
+
+    def __init__(self, contacts: list[Contact]):
+        self._root = _TrieNode()
+        self._size = 0
+        self.contacts = list(contacts)
+        for contact in contacts:
+            node = self._root
+            for digit in contact.number:
+                node = node.children.setdefault(digit, _TrieNode())
+            if node.contact is None:
+                self._size += 1
+            node.contact = contact
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self.contacts)
+
+    def _find(self, number: tuple[int|str]) -> _TrieNode | None:
+        node = self._root
+        for digit in number:
+            node = node.children.get(digit)
+            if node is None:
+                return None
+        return node
+
+    def lookup(self, number: tuple[int|str]) -> tuple[DialResult, Contact | None]:
+        node = self._find(number)
+        if node is None:
+            return (DialResult.DEAD, None)
+        if node.contact is None:
+            return (DialResult.PREFIX, None)
+        if node.children:
+            return (DialResult.AMBIGUOUS, node.contact)
+        return (DialResult.COMPLETE, node.contact)
+
+    def get(self, number: tuple[int|str]) -> Contact | None:
+        node = self._find(number)
+        return node.contact if node else None
+
+
+def was_dialed(number: tuple[int|str], contacts: list[Contact] | ContactDirectory) -> Contact | None:
+    if isinstance(contacts, ContactDirectory):
+        return contacts.get(number)
     for contact in contacts:
         if contact.number == number:
             return contact
     return None
+
+
+_KEY_NAMES = {"*": "star", "#": "pound"}
+
+
+def parse_number(number: str) -> tuple[int|str]:
+    """Parse a dialable number like "3005" or "*12#" into the key tuple the keypad produces."""
+    return tuple(int(c) if c.isdigit() else _KEY_NAMES[c] for c in str(number) if not c.isspace())
+
+
+def load_contacts(path: Path) -> list[Contact]:
+    """Load contacts from a TOML, JSON or CSV file.
+
+    Every entry has a `name`, a `number` (e.g. "3005") and a `greeting` path,
+    relative paths are resolved against the directory of the file. TOML and
+    JSON keep the entries in a `contacts` array, CSV has a header row.
+    """
+    suffix = path.suffix.lower()
+    if suffix == ".toml":
+        with open(path, "rb") as f:
+            entries = tomllib.load(f)["contacts"]
+    elif suffix == ".json":
+        with open(path) as f:
+            data = json.load(f)
+        entries = data["contacts"] if isinstance(data, dict) else data
+    elif suffix == ".csv":
+        with open(path, newline="") as f:
+            entries = list(csv.DictReader(f))
+    else:
+        raise ValueError(f"Unsupported contacts file format: {path}")
+
+    if not isinstance(entries, list):
+        raise ValueError(f"Expected a list of contacts, got {type(entries).__name__}")
+    return [_contact(path, entry) for entry in entries]
+
+
+def _contact(path: Path, entry) -> Contact:
+    # Wrong types raise ValueError like any other broken file, not TypeError from deep inside
+    if not isinstance(entry, dict):
+        raise ValueError(f"Contact entry is not a table: {entry!r}")
+    name, number, greeting = entry["name"], entry["number"], entry["greeting"]
+    if not isinstance(name, str) or not isinstance(greeting, str) \
+            or not isinstance(number, (str, int)) or isinstance(number, bool):
+        raise ValueError(f"Contact entry needs a name, number and greeting: {entry!r}")
+    return Contact(name=name, number=parse_number(number), greeting_path=path.parent / greeting)
+
+
+class ContactRegistry:
+    """The contact directory, loaded from a file and reloaded when the file changes.
+
+    `directory` is replaced as a whole on reload, so a call that took a reference
+    to it at pickup keeps a consistent view until it ends. A file that fails to
+    load keeps the previous directory.
+    """
+
+    def __init__(self, path: Path | None, default: list[Contact], poll_interval: float = 2.0):
+        self._path = path
+        self._poll_interval = poll_interval
+        self._mtime_ns: int | None = None
+        self.directory = ContactDirectory(default)
+        # Called with the new directory after every successful reload
+        self.on_reload: list[Callable[[ContactDirectory], None]] = []
+        if path is not None:
+            self.reload()
+
+    def reload(self) -> bool:
+        """Reload the file if its mtime changed, returns whether the directory was replaced."""
+        try:
+            mtime_ns = os.stat(self._path).st_mtime_ns
+        except OSError as e:
+            if self._mtime_ns is not None:
+                logger.warning("Contacts file %s is gone, keeping %d contacts: %s",
+                               self._path, len(self.directory), e)
+                self._mtime_ns = None
+            return False
+        if mtime_ns == self._mtime_ns:
+            return False
+        self._mtime_ns = mtime_ns
+
+        try:
+            directory = ContactDirectory(load_contacts(self._path))
+        except (OSError, ValueError, KeyError, tomllib.TOMLDecodeError) as e:
+            logger.error("Could not load contacts from %s, keeping the previous ones: %s", self._path, e)
+            return False
+        self.directory = directory
+        logger.info("Loaded %d contacts from %s", len(directory), self._path)
+        for callback in self.on_reload:
+            callback(directory)
+        return True
+
+    async def watch(self):
+        """Poll the file for changes until cancelled."""
+        if self._path is None:
+            return
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            try:
+                self.reload()
+            except Exception:
+                # The next edit of the file may fix it, keep watching
+                logger.exception("Reloading contacts from %s failed", self._path)
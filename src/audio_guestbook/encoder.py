@@ -0,0 +1,156 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import wave
+from pathlib import Path
+from typing import Callable
+
+_FFMPEG = "ffmpeg"
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg output arguments and file suffix per archive format
+FORMATS: dict[str, tuple[list[str], str]] = {
+    "flac": (["-c:a", "flac", "-compression_level", "5"], ".flac"),
+    "opus": (["-c:a", "libopus", "-b:a", "32k", "-application", "voip"], ".opus"),
+}
+
+# Encoded duration may differ slightly from the original (opus pre-skip, frame padding)
+_DURATION_TOLERANCE = 0.1
+
+
+class EncodeError(Exception):
+    pass
+
+
+class RecordingEncoder:
+    """Compresses finished recordings in the background.
+
+    Jobs are persisted as small JSON files in `queue_dir` before they are
+    queued, so encodes interrupted by a reboot are picked up again by `run()`.
+    Encoding runs in a niced ffmpeg process, one recording at a time, so it
+    never competes with the event loop or a running call for CPU. The original
+    WAV is only replaced once the encoded file decoded back to the same length.
+    """
+
+    def __init__(self, queue_dir: Path, format: str = "flac", niceness: int = 10,
+                 ffmpeg: str = _FFMPEG):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown encode format {format!r}, expected one of {list(FORMATS)}")
+        self._queue_dir = queue_dir
+        self._format = format
+        self._niceness = niceness
+        self._ffmpeg = ffmpeg
+        self._queue: asyncio.Queue[Path] = asyncio.Queue()
+        # Called with (original path, encoded path) after an original was replaced
+        self.on_encoded: list[Callable[[Path, Path], None]] = []
+
+    def submit(self, source: Path):
+        """Persist an encode job for `source` and queue it."""
+        self._queue_dir.mkdir(parents=True, exist_ok=True)
+        job_path = self._job_path(source)
+        tmp_path = job_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"source": str(source), "format": self._format}, f)
+            f.flush()
+            # An empty job left by a power cut would fail instead of encoding
+            os.fsync(f.fileno())
+        os.replace(tmp_path, job_path)
+        self._queue.put_nowait(job_path)
+
+    def pending(self, source: Path) -> bool:
+        """Whether `source` is still waiting to be encoded and replaced."""
+        return self._job_path(source).exists()
+
+    async def run(self):
+        """Resume persisted jobs, then encode queued recordings until cancelled."""
+        if self._queue_dir.is_dir():
+            for job_path in sorted(self._queue_dir.glob("*.json")):
+                logger.info("Resuming encode job %s", job_path.name)
+                self._queue.put_nowait(job_path)
+
+        while True:
+            job_path = await self._queue.get()
+            try:
+                await self._run_job(job_path)
+            except Exception as e:
+                # Bad WAVs, truncated or unknown jobs must not stop the queue
+                logger.error("Encoding %s failed: %s", job_path.name, e)
+                # Keep the job for inspection, but don't retry it on every start
+                with contextlib.suppress(FileNotFoundError):
+                    os.replace(job_path, job_path.with_suffix(".failed"))
+
+    def _job_path(self, source: Path) -> Path:
+        return self._queue_dir / f"{source.stem}.json"
+
+    async def _run_job(self, job_path: Path):
+        try:
+            job = json.loads(job_path.read_text())
+        except FileNotFoundError:
+            # Submitted twice, already done
+            return
+        source = Path(job["source"])
+        codec_args, suffix = FORMATS[job["format"]]
+        target = source.with_suffix(suffix)
+
+        if not source.exists():
+            if target.exists():
+                # Crashed between replacing the original and removing the job
+                job_path.unlink()
+                return
+            raise EncodeError(f"{source} does not exist")
+
+        with wave.open(str(source), "rb") as wav:
+            rate, channels = wav.getframerate(), wav.getnchannels()
+            duration = wav.getnframes() / rate
+
+        # Keep the suffix last, ffmpeg picks the container from it
+        tmp = target.with_name(f"{target.stem}.tmp{suffix}")
+        try:
+            await self._ffmpeg_run(["-i", str(source), *codec_args, "-y", str(tmp)])
+            decoded_duration = await self._decoded_duration(tmp, rate, channels)
+            if abs(decoded_duration - duration) > _DURATION_TOLERANCE:
+                raise EncodeError(
+                    f"{tmp.name} decodes to {decoded_duration:.2f} s instead of {duration:.2f} s")
+            with open(tmp, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp, target)
+        finally:
+            tmp.unlink(missing_ok=True)
+        source.unlink()
+        job_path.unlink()
+        logger.info("Encoded %s to %s", source.name, target.name)
+        for callback in self.on_encoded:
+            callback(source, target)
+
+    async def _spawn(self, args: list[str], **kwargs) -> asyncio.subprocess.Process:
+        process = await asyncio.create_subprocess_exec(self._ffmpeg, "-v", "error", *args, **kwargs)
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, self._niceness)
+        except OSError:
+            # Already done or not permitted, not worth failing the encode for
+            pass
+        return process
+
+    async def _ffmpeg_run(self, args: list[str]):
+        process = await self._spawn(args, stdout=asyncio.subprocess.DEVNULL,
+                                    stderr=asyncio.subprocess.PIPE)
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise EncodeError(stderr.decode(errors="replace").strip() or f"ffmpeg exited with {process.returncode}")
+
+    async def _decoded_duration(self, path: Path, rate: int, channels: int) -> float:
+        """Decode `path` back to PCM and return its duration, failing on any decode error."""
+        process = await self._spawn(
+            ["-i", str(path), "-f", "s16le", "-ar", str(rate), "-ac", str(channels), "-"],
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        decoded_bytes = 0
+        while chunk := await process.stdout.read(1 << 16):
+            decoded_bytes += len(chunk)
+        stderr = await process.stderr.read()
+        await process.wait()
+        if process.returncode != 0 or stderr.strip():
+            raise EncodeError(f"{path.name} does not decode cleanly: {stderr.decode(errors='replace').strip()}")
+        return decoded_bytes / (2 * channels * rate)
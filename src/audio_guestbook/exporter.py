@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Finished recordings, as written by the recorder and the encoder
+SUFFIXES = {".wav", ".flac", ".opus"}
+
+_CHUNK_BYTES = 256 * 1024
+# How often a paused export checks whether the phones are idle again
+_PAUSE_POLL_SECONDS = 1.0
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportPaused(Exception):
+    """A phone was picked up, the transfer stops where it is and resumes later."""
+
+
+class _ThrottledReader:
+    """File reader for transfers: at most `rate` bytes per second, stops as soon as `busy()` is true."""
+
+    def __init__(self, f, rate: int | None, busy: Callable[[], bool]):
+        self._f = f
+        self._rate = rate
+        self._busy = busy
+        self._started = time.monotonic()
+        self._sent = 0
+
+    def read(self, size: int = _CHUNK_BYTES) -> bytes:
+        if self._busy():
+            raise ExportPaused()
+        if self._rate:
+            ahead = self._sent / self._rate - (time.monotonic() - self._started)
+            if ahead > 0:
+                time.sleep(ahead)
+        chunk = self._f.read(min(size, _CHUNK_BYTES) if size > 0 else _CHUNK_BYTES)
+        self._sent += len(chunk)
+        return chunk
+
+
+def _sha256(path: Path, reader_factory=None) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        reader = reader_factory(f) if reader_factory else f
+        while chunk := reader.read(_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync_directory(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DirectoryTarget:
+    """A mounted directory, e.g. a USB stick or network share.
+
+    Files are written as `<name>.part`, which a resumed transfer appends to,
+    read back and checked against the checksum, then renamed into place and
+    listed in a `SHA256SUMS` file next to them (`sha256sum -c SHA256SUMS`).
+    Every write is fsynced, the stick may be pulled any time.
+    The directory itself is never created: an unmounted stick is skipped
+    instead of filling the mount point on the SD card.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def __str__(self):
+        return str(self.root)
+
+    def available(self) -> bool:
+        return self.root.is_dir()
+
+    def offset(self, name: str) -> int:
+        part = self.root / f"{name}.part"
+        return part.stat().st_size if part.exists() else 0
+
+    def send(self, name: str, source, offset: int, size: int, sha256: str,
+             throttle: Callable[[object], _ThrottledReader]):
+        dest = self.root / name
+        part = dest.with_name(dest.name + ".part")
+        # Checked per file, the stick may have been pulled since the batch started
+        if not self.available():
+            raise ExportError(f"{self.root} is no longer available")
+        dest.parent.mkdir(exist_ok=True)
+        reader = throttle(source)
+        with open(part, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            while chunk := reader.read(_CHUNK_BYTES):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        # Read back what the stick actually stored
+        if part.stat().st_size != size or _sha256(part, throttle) != sha256:
+            part.unlink()
+            raise ExportError(f"{name} arrived corrupted at {self.root}, sending it again")
+        os.replace(part, dest)
+        # A file sent again replaces its old line, so `sha256sum -c` keeps passing
+        sums = dest.parent / "SHA256SUMS"
+        try:
+            lines = [line for line in sums.read_text().splitlines(keepends=True)
+                     if line.rstrip("\n").split("  ", 1)[-1] != dest.name]
+        except FileNotFoundError:
+            lines = []
+        lines.append(f"{sha256}  {dest.name}\n")
+        sums_part = sums.with_name(sums.name + ".part")
+        with open(sums_part, "w") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(sums_part, sums)
+        _fsync_directory(dest.parent)
+
+
+class HttpTarget:
+    """An HTTP endpoint that takes files with resumable PUT requests.
+
+    `HEAD <url>/<name>` answers how many bytes of the file the server has
+    (Content-Length, 404 for none). `PUT <url>/<name>` sends the rest with a
+    `Content-Range` header and the file's SHA-256 in `X-Checksum-SHA256`,
+    which the server checks once the file is complete.
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url.rstrip("/")
+        self._timeout = timeout
+
+    def __str__(self):
+        return self.url
+
+    def _file_url(self, name: str) -> str:
+        return f"{self.url}/{urllib.parse.quote(name)}"
+
+    def available(self) -> bool:
+        return True
+
+    def offset(self, name: str) -> int:
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self._file_url(name), method="HEAD"),
+                                        timeout=self._timeout) as response:
+                return int(response.headers.get("Content-Length", 0))
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return 0
+            raise ExportError(f"HEAD {name}: {e}") from e
+
+    def send(self, name: str, source, offset: int, size: int, sha256: str,
+             throttle: Callable[[object], _ThrottledReader]):
+        request = urllib.request.Request(self._file_url(name), data=throttle(source), method="PUT", headers={
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(size - offset),
+            # Only the total if the server already has everything, it just didn't get to answer
+            "Content-Range": f"bytes {offset}-{size - 1}/{size}" if offset < size else f"bytes */{size}",
+            "X-Checksum-SHA256": sha256,
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self._timeout):
+                pass
+        except urllib.error.HTTPError as e:
+            raise ExportError(f"PUT {name}: {e}") from e
+
+
+def open_target(target: str) -> DirectoryTarget | HttpTarget:
+    """A target from EXPORT_TARGET: an http(s):// URL or a directory."""
+    if target.startswith(("http://", "https://")):
+        return HttpTarget(target)
+    return DirectoryTarget(Path(target))
+
+
+class RecordingExporter:
+    """Ships finished recordings to a target in the background, in batches.
+
+    Every `interval` the source directories are scanned for recordings that
+    changed since they were last sent, which the state file records by size
+    and mtime, so the scan never opens a file it already exported. Pending
+    recordings go out in batches of `batch_files`, the state is saved after
+    each batch. Transfers are limited to `rate` bytes per second and stop as
+    soon as `busy()` is true, e.g. while a phone is off the hook. They resume
+    where they stopped once the phones are idle again.
+    """
+
+    def __init__(self, sources: list[Path], target: DirectoryTarget | HttpTarget, state_path: Path,
+                 busy: Callable[[], bool] = lambda: False, skip: Callable[[Path], bool] = lambda path: False,
+                 interval: float = 60, rate: int | None = None, batch_files: int = 20):
+        self._sources = sources
+        self._target = target
+        self._state_path = state_path
+        self._busy = busy
+        # Recordings that aren't finished yet, e.g. still waiting to be encoded
+        self._skip = skip
+        self._interval = interval
+        self._rate = rate
+        self._batch_files = batch_files
+        # Target name -> {"size", "mtime_ns", "sha256", "exported"}
+        self._state: dict[str, dict] = {}
+
+    async def run(self):
+        """Export pending recordings every `interval` until cancelled."""
+        self._state = await asyncio.to_thread(self._load_state)
+        while True:
+            try:
+                await self.export_pending()
+            except (OSError, ExportError) as e:
+                logger.error("Export to %s failed: %s", self._target, e)
+            await asyncio.sleep(self._interval)
+
+    async def _wait_idle(self):
+        while self._busy():
+            await asyncio.sleep(_PAUSE_POLL_SECONDS)
+
+    async def export_pending(self) -> int:
+        """Send everything not exported yet, returns the number of recordings sent."""
+        await self._wait_idle()
+        if not await asyncio.to_thread(self._target.available):
+            logger.debug("Export target %s is not available", self._target)
+            return 0
+        pending = await asyncio.to_thread(self._scan)
+        sent = 0
+        for start in range(0, len(pending), self._batch_files):
+            try:
+                for name, path in pending[start:start + self._batch_files]:
+                    if await self._export_resuming(name, path):
+                        sent += 1
+            finally:
+                # Also keeps the checksums and what was sent when the target went away
+                await asyncio.to_thread(self._save_state)
+        if sent:
+            logger.info("Exported %d recordings to %s", sent, self._target)
+        return sent
+
+    async def _export_resuming(self, name: str, path: Path) -> bool:
+        """Export one recording, pausing and resuming as often as the phones are used."""
+        while True:
+            await self._wait_idle()
+            try:
+                await asyncio.to_thread(self._export, name, path)
+                return True
+            except ExportPaused:
+                logger.info("Export of %s paused while a phone is in use", name)
+            except FileNotFoundError:
+                # Replaced by its encoded version meanwhile, which the next scan finds
+                return False
+            except ExportError as e:
+                if not await asyncio.to_thread(self._target.available):
+                    # E.g. the stick was pulled, the next scan starts over
+                    raise
+                logger.error("Exporting %s failed, retrying with the next scan: %s", name, e)
+                return False
+
+    def _scan(self) -> list[tuple[str, Path]]:
+        pending = []
+        for source in self._sources:
+            if not source.is_dir():
+                continue
+            with os.scandir(source) as entries:
+                for entry in entries:
+                    path = Path(entry.path)
+                    if not entry.is_file() or path.suffix.lower() not in SUFFIXES or ".tmp" in path.suffixes:
+                        continue
+                    name = f"{source.name}/{entry.name}"
+                    stat = entry.stat()
+                    known = self._state.get(name)
+                    if known is not None and known.get("exported") and \
+                            (known["size"], known["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                        continue
+                    if self._skip(path):
+                        continue
+                    pending.append((name, path))
+        return sorted(pending)
+
+    def _reader(self, f) -> _ThrottledReader:
+        return _ThrottledReader(f, self._rate, self._busy)
+
+    def _export(self, name: str, path: Path):
+        stat = path.stat()
+        entry = self._state.get(name)
+        if entry is None or (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            # The checksum is kept, so a paused transfer doesn't read the whole file again
+            entry = self._state[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                         "sha256": _sha256(path, self._reader), "exported": None}
+        offset = min(self._target.offset(name), stat.st_size)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            self._target.send(name, f, offset, stat.st_size, entry["sha256"], self._reader)
+        entry["exported"] = time.time()
+        logger.info("Exported %s to %s%s", name, self._target, f" (resumed at {offset} bytes)" if offset else "")
+
+    def _load_state(self) -> dict[str, dict]:
+        try:
+            return json.loads(self._state_path.read_text())
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.error("Export state %s is unreadable, exporting everything again: %s", self._state_path, e)
+            return {}
+
+    def _save_state(self):
+        self._state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._state))
+        os.replace(tmp_path, self._state_path)
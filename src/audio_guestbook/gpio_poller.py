@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from .clock import Clock
+
+if TYPE_CHECKING:
+    from .async_button import AsyncButton
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PolledPin:
+    """A pin read by the poller, in place of factory.pin() which would claim the line for gpiozero."""
+    number: int
+
+
+class _LgpioGroup:
+    """All input lines claimed as one lgpio group, read with a single call."""
+
+    def __init__(self, factory, pins: list[int]):
+        import lgpio
+        self._lgpio = lgpio
+        # A chip handle of our own, the lines must not be claimed through gpiozero
+        self._handle = lgpio.gpiochip_open(factory.chip)
+        try:
+            lgpio.group_claim_input(self._handle, pins, lgpio.SET_PULL_UP)
+        except Exception:
+            lgpio.gpiochip_close(self._handle)
+            raise
+        self._leader = pins[0]
+
+    def read(self) -> int:
+        _, levels = self._lgpio.group_read(self._handle, self._leader)
+        return levels
+
+    def close(self):
+        self._lgpio.group_free(self._handle, self._leader)
+        self._lgpio.gpiochip_close(self._handle)
+
+
+class _MockGroup:
+    """The same for gpiozero mock pins, read one after the other."""
+
+    def __init__(self, factory, pins: list[int]):
+        self._pins = [factory.pin(pin) for pin in pins]
+        for pin in self._pins:
+            pin.pull = "up"
+
+    def read(self) -> int:
+        levels = 0
+        for bit, pin in enumerate(self._pins):
+            if pin.state:
+                levels |= 1 << bit
+        return levels
+
+    def close(self):
+        pass
+
+
+def open_group(factory, pins: list[int]):
+    from gpiozero.pins.mock import MockFactory
+    if isinstance(factory, MockFactory):
+        return _MockGroup(factory, pins)
+    return _LgpioGroup(factory, pins)
+
+
+class GpioPoller:
+    """Polls the pins of all buttons in one thread, instead of a gpiozero Button per pin.
+
+    Every scan reads all lines as one bitmask. A line that changes is reported
+    at once and then ignored for `debounce` seconds; if it ended up on the
+    other level by then, that edge follows. All edges of a scan reach the
+    event loop in one call_soon_threadsafe(). Buttons are pulled up and
+    pressed when low, like gpiozero's Button(pull_up=True).
+    """
+
+    def __init__(self, factory, interval: float = 0.005, debounce: float = 0.05, clock: Clock | None = None):
+        self._factory = factory
+        self._interval = interval
+        self._debounce = debounce
+        self._clock = clock or Clock()
+        self._buttons: dict[int, AsyncButton] = {}
+        self._group = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def add(self, button: 'AsyncButton'):
+        if self._thread is not None:
+            raise RuntimeError("Buttons have to be added before the poller starts")
+        if button.pin in self._buttons:
+            raise ValueError(f"Pin {button.pin} is already polled")
+        self._buttons[button.pin] = button
+
+    def start(self):
+        """Claim the lines and start polling, edges go to the running event loop."""
+        if self._thread is not None:
+            return
+        loop = asyncio.get_running_loop()
+        pins = list(self._buttons)
+        self._group = open_group(self._factory, pins)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._scan, args=(loop, pins), name="gpio-poller", daemon=True)
+        self._thread.start()
+        logger.info("Polling %d pins every %.0f ms", len(pins), self._interval * 1000)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._group.close()
+        self._group = None
+
+    def _scan(self, loop: asyncio.AbstractEventLoop, pins: list[int]):
+        read, monotonic, debounce = self._group.read, self._clock.monotonic, self._debounce
+        stable = read()
+        # Bits that changed less than `debounce` ago, and when they may change again
+        locked = 0
+        unlock_at: dict[int, float] = {}
+        while not self._stop.wait(self._interval):
+            try:
+                levels = read()
+            except Exception:
+                logger.exception("Reading the GPIO lines failed, input stopped")
+                return
+            now = monotonic()
+            if locked:
+                for bit, until in list(unlock_at.items()):
+                    if now >= until:
+                        locked &= ~bit
+                        del unlock_at[bit]
+            changed = (levels ^ stable) & ~locked
+            if not changed:
+                continue
+            stable ^= changed
+            locked |= changed
+            edges = []
+            while changed:
+                bit = changed & -changed
+                changed ^= bit
+                unlock_at[bit] = now + debounce
+                edges.append((pins[bit.bit_length() - 1], not levels & bit, now))
+            try:
+                loop.call_soon_threadsafe(self._deliver, edges)
+            except RuntimeError:
+                # The loop is closed, nobody is listening anymore
+                return
+
+    def _deliver(self, edges: list[tuple[int, bool, float]]):
+        for pin, pressed, timestamp in edges:
+            self._buttons[pin].deliver(pressed, timestamp)
@@ -0,0 +1,70 @@
+import json
+import logging
+from collections import deque
+
+from .clock import Clock
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """A latency measurement that started at `start` (the tracer's clock) and ends once."""
+
+    def __init__(self, tracer: 'LatencyTracer', name: str, start: float):
+        self._tracer = tracer
+        self.name = name
+        self.start = start
+        self.ended = False
+
+    def end(self, at: float | None = None, delay: float = 0.0):
+        """End the span `at` (now by default), plus a `delay` still to come, e.g. buffered audio."""
+        if not self.ended:
+            self.ended = True
+            if at is None:
+                at = self._tracer.clock.monotonic()
+            self._tracer.observe(self.name, at + delay - self.start)
+
+
+class LatencyTracer:
+    """Collects latencies along the path from a GPIO edge to audible output.
+
+    Every named latency keeps its last `window` samples, percentiles are
+    computed from those on demand. All timestamps are from `clock`, the
+    real monotonic clock unless a simulation replaced it.
+    """
+
+    def __init__(self, window: int = 512, clock: Clock | None = None):
+        self._window = window
+        self.clock = clock or Clock()
+        self._samples: dict[str, deque[float]] = {}
+
+    def observe(self, name: str, seconds: float):
+        self._samples.setdefault(name, deque(maxlen=self._window)).append(seconds)
+
+    def begin(self, name: str, start: float | None) -> Span | None:
+        """Start a span at `start`, None if the start is unknown (nothing to measure)."""
+        return Span(self, name, start) if start is not None else None
+
+    def percentiles(self, name: str) -> dict[str, float]:
+        samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return {"count": 0}
+
+        def pick(p: float) -> float:
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {"count": len(samples), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99),
+                "max": samples[-1]}
+
+    def report(self) -> dict[str, dict[str, float]]:
+        return {name: self.percentiles(name) for name in sorted(self._samples)}
+
+    def dump(self):
+        """Log all percentiles in milliseconds, e.g. from a SIGUSR1 handler."""
+        for name, stats in self.report().items():
+            logger.info("Latency %s: %s", name, json.dumps(
+                {k: round(v * 1000, 1) if k != "count" else v for k, v in stats.items()}))
+
+
+# Global tracer, like settings every component reports to the same one
+tracer = LatencyTracer()
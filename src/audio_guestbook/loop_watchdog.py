@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from .latency import LatencyTracer, tracer as default_tracer
+
+logger = logging.getLogger(__name__)
+
+
+def run(main, event_loop: str = "asyncio", debug: bool = False, slow_callback_seconds: float = 0.05):
+    """Like asyncio.run(), on uvloop if `event_loop` is "uvloop" and it is installed.
+
+    With `debug` the loop runs in asyncio's debug mode, which also logs every
+    callback and task step that takes longer than `slow_callback_seconds`.
+    Debug mode records a traceback for every callback, only use it to diagnose.
+    """
+    loop_factory = None
+    if event_loop == "uvloop":
+        try:
+            import uvloop
+            loop_factory = uvloop.new_event_loop
+        except ImportError:
+            logger.warning("uvloop is not installed, using the asyncio event loop")
+    elif event_loop != "asyncio":
+        raise ValueError(f"Unknown event loop {event_loop!r}, expected 'asyncio' or 'uvloop'")
+
+    async def configured():
+        if debug:
+            asyncio.get_running_loop().slow_callback_duration = slow_callback_seconds
+        return await main
+
+    with asyncio.Runner(loop_factory=loop_factory, debug=debug) as runner:
+        return runner.run(configured())
+
+
+class LoopWatchdog:
+    """Measures how late the event loop gets around to things and names what held it up.
+
+    A task asks to be woken every `interval`; how much later it actually runs
+    is the loop's lag, observed as "loop lag" in the latency tracer. A thread
+    watches that task: once it is `threshold` overdue, the loop is stuck in
+    some callback, and the thread logs the running task and the stack of the
+    loop's thread at that moment, which is the code blocking it.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.05, tracer: LatencyTracer = default_tracer):
+        self._interval = interval
+        self._threshold = threshold
+        self._tracer = tracer
+        # time.monotonic() when the task should wake up next
+        self._deadline = time.monotonic() + interval
+        self._reported_deadline: float | None = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        """Sample the lag until cancelled."""
+        loop = asyncio.get_running_loop()
+        thread = threading.Thread(target=self._watch, args=(loop, threading.get_ident()),
+                                  name="loop-watchdog", daemon=True)
+        self._stop.clear()
+        thread.start()
+        try:
+            while True:
+                self._deadline = time.monotonic() + self._interval
+                await asyncio.sleep(self._interval)
+                lag = max(0.0, time.monotonic() - self._deadline)
+                self._tracer.observe("loop lag", lag)
+                if lag >= self._threshold:
+                    logger.warning("Event loop ran %.0f ms late", lag * 1000)
+        finally:
+            self._stop.set()
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, loop_thread: int):
+        while not self._stop.wait(self._threshold / 2):
+            deadline = self._deadline
+            overdue = time.monotonic() - deadline
+            if overdue < self._threshold or deadline == self._reported_deadline:
+                continue
+            # Once per stall, the stack is the same until the loop comes around again
+            self._reported_deadline = deadline
+            frame = sys._current_frames().get(loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "  (unknown)\n"
+            task = asyncio.current_task(loop)
+            logger.warning("Event loop blocked for %.0f ms so far, in %s at:\n%s", overdue * 1000,
+                           f"task {task.get_name()} ({task.get_coro()!r})" if task is not None else "a callback",
+                           stack.rstrip())
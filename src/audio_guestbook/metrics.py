@@ -0,0 +1,152 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from .latency import LatencyTracer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, covering key presses up to full length recordings
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Size at which the JSONL snapshots are rotated, an SD card must not fill up with them
+_JSONL_MAX_BYTES = 2**20
+
+
+@dataclass(frozen=True)
+class Transition:
+    state: str
+    next_state: str
+    # Clock.monotonic() when the state was entered
+    started: float
+    duration: float
+
+
+@dataclass
+class Histogram:
+    bounds: tuple[float, ...] = DEFAULT_BUCKETS
+    # One count per bound plus the +Inf bucket, not cumulative
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(le, count) pairs as Prometheus expects them."""
+        result, running = [], 0
+        for bound, count in zip([*map(str, self.bounds), "+Inf"], self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class StateMetrics:
+    """Transition trace and per-state statistics of the state machine.
+
+    The trace is a ring buffer of the last `trace_size` transitions, so memory
+    stays constant on a device that runs for weeks. Entries per state and time
+    spent in each state are kept as counters and histograms, which is also how
+    dialing latency and recording lengths show up.
+    """
+
+    def __init__(self, trace_size: int = 256, buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+                 latency: LatencyTracer | None = None):
+        # Latency percentiles exported along with the state metrics, e.g. the event loop's lag
+        self.latency = latency
+        self.trace: deque[Transition] = deque(maxlen=trace_size)
+        self.entries: dict[str, int] = {}
+        self.durations: dict[str, Histogram] = {}
+        self._buckets = buckets
+        self.started = time.monotonic()
+
+    def record_transition(self, state: str, next_state: str, started: float, ended: float):
+        duration = ended - started
+        self.trace.append(Transition(state, next_state, started, duration))
+        self.entries[state] = self.entries.get(state, 0) + 1
+        self.durations.setdefault(state, Histogram(self._buckets)).observe(duration)
+
+    def to_prometheus(self, prefix: str = "telephone") -> str:
+        lines = [
+            f"# TYPE {prefix}_uptime_seconds gauge",
+            f"{prefix}_uptime_seconds {time.monotonic() - self.started:.3f}",
+            f"# TYPE {prefix}_state_entries_total counter",
+        ]
+        lines += [f"{prefix}_state_entries_total{_labels(state=state)} {count}"
+                  for state, count in sorted(self.entries.items())]
+        lines.append(f"# TYPE {prefix}_state_duration_seconds histogram")
+        for state, histogram in sorted(self.durations.items()):
+            for le, count in histogram.cumulative():
+                lines.append(f"{prefix}_state_duration_seconds_bucket{_labels(state=state, le=le)} {count}")
+            lines.append(f"{prefix}_state_duration_seconds_sum{_labels(state=state)} {histogram.total:.6f}")
+            lines.append(f"{prefix}_state_duration_seconds_count{_labels(state=state)} {histogram.count}")
+        if self.latency is not None:
+            lines.append(f"# TYPE {prefix}_latency_seconds summary")
+            for name, stats in self.latency.report().items():
+                for quantile in ("0.5", "0.9", "0.99"):
+                    lines.append(f"{prefix}_latency_seconds{_labels(name=name, quantile=quantile)} "
+                                 f"{stats[f'p{round(float(quantile) * 100)}']:.6f}")
+                lines.append(f"{prefix}_latency_seconds_count{_labels(name=name)} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        return {
+            "time": time.time(),
+            "uptime": time.monotonic() - self.started,
+            "entries": self.entries,
+            "durations": {state: asdict(histogram) for state, histogram in self.durations.items()},
+            "last_transitions": [asdict(t) for t in list(self.trace)[-10:]],
+            "latency": self.latency.report() if self.latency is not None else {},
+        }
+
+    def export(self, prometheus_path: Path | None = None, jsonl_path: Path | None = None):
+        """Write the Prometheus text file atomically and/or append a snapshot to a JSONL file.
+
+        The JSONL file is rotated to `<name>.1` once it reached 1 MiB.
+        """
+        _write_export(prometheus_path, self.to_prometheus(), jsonl_path, json.dumps(self.to_json()))
+
+    async def export_periodically(self, directory: Path, interval: float):
+        """Export to `directory` every `interval` seconds until cancelled."""
+        directory.mkdir(parents=True, exist_ok=True)
+        while True:
+            await asyncio.sleep(interval)
+            # Render on the loop, only the file IO goes to a thread
+            try:
+                await asyncio.to_thread(_write_export, directory / "telephone.prom", self.to_prometheus(),
+                                        directory / "telephone-metrics.jsonl", json.dumps(self.to_json()))
+            except OSError as e:
+                logger.error("Could not export metrics to %s: %s", directory, e)
+
+
+def _write_export(prometheus_path: Path | None, prometheus_text: str,
+                  jsonl_path: Path | None, json_line: str, jsonl_max_bytes: int = _JSONL_MAX_BYTES):
+    if prometheus_path is not None:
+        tmp_path = prometheus_path.with_suffix(".tmp")
+        tmp_path.write_text(prometheus_text)
+        os.replace(tmp_path, prometheus_path)
+    if jsonl_path is not None:
+        # One older generation is kept, so the snapshots never take more than twice the cap
+        try:
+            if jsonl_path.stat().st_size >= jsonl_max_bytes:
+                os.replace(jsonl_path, jsonl_path.with_name(jsonl_path.name + ".1"))
+        except FileNotFoundError:
+            pass
+        with open(jsonl_path, "a") as f:
+            f.write(json_line + "\n")
@@ -0,0 +1,84 @@
+import json
+import tomllib
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .settings import Settings
+
+
+@dataclass(frozen=True)
+class PhoneConfig:
+    """Pins and audio devices of one handset."""
+    name: str
+    pin_on: int
+    pin_off: int
+    pin_star: int
+    pin_pound: int
+    number_pins: dict[int, int] = field(default_factory=dict)
+    audio_sink: str | None = None
+    audio_source: str | None = None
+    # Recordings of this handset, settings.output_dir if unset
+    output_dir: Path | None = None
+
+    def pins(self) -> list[int]:
+        return [self.pin_on, self.pin_off, self.pin_star, self.pin_pound, *self.number_pins.values()]
+
+
+def phone_from_settings(settings: Settings, name: str = "phone") -> PhoneConfig:
+    """The single handset configured through PIN_* and AUDIO_* variables."""
+    return PhoneConfig(
+        name=name,
+        pin_on=settings.pin_on,
+        pin_off=settings.pin_off,
+        pin_star=settings.pin_start,
+        pin_pound=settings.pin_pound,
+        number_pins={num: settings.get_pin_number(str(num)) for num in range(10)},
+        audio_sink=settings.audio_sink,
+        audio_source=settings.audio_source,
+        output_dir=settings.output_dir,
+    )
+
+
+def load_phones(path: Path) -> list[PhoneConfig]:
+    """Load handsets from a TOML or JSON file.
+
+    The file keeps the entries in a `phones` array. Every entry has a unique
+    `name`, the pins `on`, `off`, `star`, `pound` and a `numbers` table of
+    digit to pin, and optionally `audio_sink`, `audio_source` and `output_dir`
+    (relative to the file). No pin may be used twice.
+    """
+    suffix = path.suffix.lower()
+    if suffix == ".toml":
+        with open(path, "rb") as f:
+            entries = tomllib.load(f)["phones"]
+    elif suffix == ".json":
+        with open(path) as f:
+            data = json.load(f)
+        entries = data["phones"] if isinstance(data, dict) else data
+    else:
+        raise ValueError(f"Unsupported phones file format: {path}")
+
+    phones = [PhoneConfig(
+        name=entry["name"],
+        pin_on=int(entry["on"]),
+        pin_off=int(entry["off"]),
+        pin_star=int(entry["star"]),
+        pin_pound=int(entry["pound"]),
+        number_pins={int(num): int(pin) for num, pin in entry["numbers"].items()},
+        audio_sink=entry.get("audio_sink"),
+        audio_source=entry.get("audio_source"),
+        output_dir=path.parent / entry["output_dir"] if "output_dir" in entry else None,
+    ) for entry in entries]
+
+    names = [phone.name for phone in phones]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Phone names in {path} are not unique: {names}")
+    used: dict[int, str] = {}
+    for phone in phones:
+        if sorted(phone.number_pins) != list(range(10)):
+            raise ValueError(f"Phone {phone.name} needs a pin for every digit 0-9")
+        for pin in phone.pins():
+            if pin in used:
+                raise ValueError(f"Pin {pin} is used by both {used[pin]} and {phone.name}")
+            used[pin] = phone.name
+    return phones
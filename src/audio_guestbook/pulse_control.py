@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# PulseAudio's PA_VOLUME_NORM, 100 %
+VOLUME_NORM = 65536
+
+_EVENT_RE = re.compile(r"Event '(\w+)' on sink #(\d+)")
+_VOLUME_RE = re.compile(r"(\d+) /")
+
+
+class SinkControl:
+    """Mute and volume of one PulseAudio sink, with the current state cached.
+
+    Changes go through one long-lived `pacmd` shell, so a change is a line
+    written to a pipe instead of a process spawn, and several changes are
+    pipelined without waiting for each other. Calls that wouldn't change the
+    cached state are skipped. The cache only holds what the sink reported: a
+    `pactl subscribe` watcher refreshes it on every change of the sink,
+    including ours, and pacmd's answers are logged since a rejected command
+    never changes the sink. If pacmd is not available (e.g. on PipeWire)
+    every change falls back to one pactl call, cached once it succeeded.
+    """
+
+    def __init__(self, sink: str, pactl: str = "pactl", pacmd: str = "pacmd"):
+        self._sink = sink
+        self._pactl = pactl
+        self._pacmd = pacmd
+        self._shell: asyncio.subprocess.Process | None = None
+        self._shell_reader: asyncio.Task | None = None
+        self._watcher: asyncio.Task | None = None
+        self._sink_index: str | None = None
+        self.muted: bool | None = None
+        self.volume: int | None = None
+
+    async def start(self):
+        """Open the control shell and the change watcher, and read the current state."""
+        if self._watcher is not None:
+            return
+        try:
+            self._shell = await asyncio.create_subprocess_exec(
+                self._pacmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
+            )
+            self._shell_reader = asyncio.create_task(self._read_shell(self._shell))
+        except OSError as e:
+            logger.warning("No pacmd control shell, using pactl per change: %s", e)
+            self._shell = None
+        await self.refresh()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        if self._shell is not None and self._shell.returncode is None:
+            self._shell.stdin.close()
+            await self._shell.wait()
+        if self._shell_reader is not None:
+            await self._shell_reader
+            self._shell_reader = None
+        self._shell = None
+
+    async def refresh(self):
+        """Re-read mute and volume of the sink, unknown values are simply not cached."""
+        mute = await self._pactl_output("get-sink-mute", self._sink)
+        self.muted = {"yes": True, "no": False}.get(mute.partition(":")[2].strip())
+        match = _VOLUME_RE.search(await self._pactl_output("get-sink-volume", self._sink))
+        self.volume = int(match.group(1)) if match else None
+
+    async def set_mute(self, muted: bool):
+        if self.muted == muted:
+            return
+        if await self._command("set-sink-mute", self._sink, "1" if muted else "0"):
+            self.muted = muted
+
+    async def set_volume(self, fraction: float):
+        volume = round(max(0.0, fraction) * VOLUME_NORM)
+        if self.volume == volume:
+            return
+        if await self._command("set-sink-volume", self._sink, str(volume)):
+            self.volume = volume
+
+    async def _command(self, *args: str) -> bool:
+        """Run a command, returns whether it is known to have succeeded.
+
+        Commands piped to pacmd are not waited for, the watcher caches their effect.
+        """
+        if self._shell is not None and self._shell.returncode is None:
+            try:
+                self._shell.stdin.write((" ".join(args) + "\n").encode())
+                return False
+            except (BrokenPipeError, ConnectionResetError) as e:
+                logger.warning("pacmd control shell closed, using pactl: %s", e)
+                self._shell = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self._pactl, *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            logger.error("pactl %s failed: %s", args[0], e)
+            return False
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            logger.error("pactl %s failed: %s", args[0], stderr.decode(errors="replace").strip())
+            return False
+        return True
+
+    async def _read_shell(self, shell: asyncio.subprocess.Process):
+        # pacmd answers successful commands with nothing but its prompt, anything else is an error
+        while line := await shell.stdout.readline():
+            text = line.decode(errors="replace").replace(">>>", "").strip()
+            if text and not text.startswith("Welcome to PulseAudio"):
+                logger.error("pacmd: %s", text)
+
+    async def _pactl_output(self, *args: str) -> str:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self._pactl, *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError:
+            return ""
+        try:
+            stdout, _ = await process.communicate()
+        finally:
+            # Cancelled by close() while pactl still runs
+            if process.returncode is None:
+                process.kill()
+                await process.communicate()
+        return stdout.decode(errors="replace")
+
+    async def _watch(self):
+        for line in (await self._pactl_output("list", "short", "sinks")).splitlines():
+            fields = line.split("\t")
+            if len(fields) >= 2 and fields[1] == self._sink:
+                self._sink_index = fields[0]
+        if self._sink_index is None:
+            return
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self._pactl, "subscribe",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError:
+            return
+        try:
+            while line := await process.stdout.readline():
+                match = _EVENT_RE.search(line.decode(errors="replace"))
+                if match and match.group(2) == self._sink_index:
+                    # Also how the changes sent through pacmd get cached
+                    await self.refresh()
+        finally:
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
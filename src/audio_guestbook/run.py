@@ -1,112 +1,243 @@
-from gpiozero.pins.mock import MockFactory
-from gpiozero.pins.lgpio import LGPIOFactory
-from .statemachine import run_statemachine
+from .statemachine import Context, IdleState, Phone, recording_finished_hooks, run_phones
+from .metrics import StateMetrics
+from .latency import tracer
 from .async_button import AsyncButton
 from .audio_manager import AudioManager
+from .clock import Clock
+from .phones import load_phones, phone_from_settings
 from .settings import settings
+from .staging import recover_recordings
+from .startup import report
+from . import loop_watchdog
 
 import asyncio
 
+import signal
 import sys
 
 import logging
 
-if settings.mock_inputs:
-    factory = MockFactory()
-else:
-    factory = LGPIOFactory()
+logger = logging.getLogger(__name__)
+
+# Created on first use, so only the selected backend is ever imported
+factory = None
+
+
+def get_pin_factory():
+    global factory
+    if factory is None:
+        if settings.mock_inputs:
+            from gpiozero.pins.mock import MockFactory
+            factory = MockFactory()
+        else:
+            from gpiozero.pins.lgpio import LGPIOFactory
+            factory = LGPIOFactory()
+    return factory
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("%s stopped", task.get_name(), exc_info=task.exception())
 
 
 def main():
     logging.basicConfig(level=logging.INFO)
 
     sys.stdout.reconfigure(line_buffering=True)
-    if len(sys.argv) > 1 and sys.argv[1] == "--check-pins":
-        asyncio.run(check_pin_assignments())
-    else:
-        asyncio.run(run_telephone_input_loop())
+    entry = check_pin_assignments if len(sys.argv) > 1 and sys.argv[1] == "--check-pins" else run_telephone_input_loop
+    loop_watchdog.run(entry(), settings.event_loop, settings.asyncio_debug, settings.loop_lag_threshold_ms / 1000)
 
 
 async def run_telephone_input_loop():
-    on_hook_pin = factory.pin(settings.pin_on,)
-    off_hook_pin = factory.pin(settings.pin_off)
-    number_button_pins = {num: factory.pin(
-        settings.get_pin_number(str(num))) for num in range(10)}
-    star_button_pin = factory.pin(settings.pin_start)
-    pound_button_pin = factory.pin(settings.pin_pound)
+    with report.phase("phone config"):
+        phone_configs = load_phones(settings.phones_file) if settings.phones_file else [phone_from_settings(settings)]
 
-    # Create audio manager with default devices
-    audio_manager = AudioManager()
-
-    statemachine_task = asyncio.create_task(run_statemachine(
-        factory, on_hook_pin, off_hook_pin, number_button_pins, star_button_pin, pound_button_pin, audio_manager))
-    if not settings.mock_inputs:
-        await statemachine_task
-    else:
-        async def read_user_input():
-            phone_is_picked_up = False  # Initial state
-
-            while True:
-                print("\nCommands:")
-                print("[space]: Toggle Handset (Pick up / Put down)")
-                print("*: Press Star Button")
-                print("#: Press Pound Button")
-                print("0-9: Press Number ")
-                print("q: Quit")
-
-                # Read input asynchronously
-                line = await asyncio.get_event_loop().run_in_executor(None, input, ">> ")
-                cmd = line.lower()
-
-                if cmd == " ":
-                    if not phone_is_picked_up:
-                        # Pick up phone
-                        on_hook_pin.drive_high()
-                        off_hook_pin.drive_low()
-                        print("📞 Phone picked up")
-                    else:
-                        # Put down phone
-                        on_hook_pin.drive_low()
-                        off_hook_pin.drive_high()
-                        print("📴 Phone put down")
-                    phone_is_picked_up = not phone_is_picked_up  # Toggle state
-
-                elif cmd == "*":
-                    print("Pressing Star Button")
-                    star_button_pin.drive_low()
-                    await asyncio.sleep(0.2)
-                    star_button_pin.drive_high()
-                elif cmd == "#":
-                    print("Pressing Pound Button")
-                    pound_button_pin.drive_low()
-                    await asyncio.sleep(0.2)
-                    pound_button_pin.drive_high()
-                elif cmd.isdigit() and 0 <= int(cmd) <= 9:
-                    print(f"Pressing Number {cmd}")
-                    number_button_pins[int(cmd)].drive_low()
-                    await asyncio.sleep(0.2)
-                    number_button_pins[int(cmd)].drive_high()
-                elif cmd == "q":
-                    print("Exiting...")
-                    return
+    # Real time, simulations run the state machine on a VirtualClock instead
+    clock = Clock()
 
-                else:
-                    print("Invalid command")
-        # Create and start the input reading task
-        input_task = asyncio.create_task(read_user_input())
+    with report.phase("pin factory"):
+        factory = get_pin_factory()
+    # One poller thread reads the pins of all phones, started by run_phones
+    poller = None
+    if settings.input_backend == "poller":
+        from .gpio_poller import GpioPoller, PolledPin
+        poller = GpioPoller(factory, settings.input_poll_ms / 1000, settings.input_debounce_ms / 1000, clock)
 
-        # Wait for either the statemachine task or input task to complete
-        done, pending = await asyncio.wait(
-            [statemachine_task, input_task],
-            return_when=asyncio.FIRST_COMPLETED
-        )
+    # One set of metrics for all phones, exported with the latency percentiles
+    metrics = StateMetrics(settings.trace_size, latency=tracer)
 
-        # Cancel any remaining tasks
-        for task in pending:
+    phones = []
+    sound_bank = None
+    transcode_cache = None
+    for config in phone_configs:
+        with report.phase(f"audio {config.name}"):
+            # Every handset has its own devices, the decoded and transcoded sounds are shared
+            audio_manager = AudioManager(config.audio_sink, config.audio_source, config.output_dir,
+                                         sound_bank=sound_bank, clock=clock, transcode_cache=transcode_cache)
+            sound_bank = audio_manager.sound_bank
+            transcode_cache = audio_manager.transcode_cache
+            # Open the output stream now so the first dial tone doesn't pay for it
+            await audio_manager.start()
+        with report.phase(f"buttons {config.name}"):
+            # The poller claims its lines itself, a gpiozero pin would hold them already
+            pin = factory.pin if poller is None else PolledPin
+            phones.append(Phone(
+                config.name, factory, pin(config.pin_on), pin(config.pin_off),
+                {num: pin(number) for num, number in config.number_pins.items()},
+                pin(config.pin_star), pin(config.pin_pound), audio_manager, metrics, clock, poller))
+
+    with report.phase("recovery"):
+        # Recordings cut short by a crash or power loss, done before any phone can start a new one
+        recovered = []
+        for directory in sorted({phone.audio_manager.output_dir for phone in phones}):
+            recovered += await asyncio.to_thread(recover_recordings, directory)
+
+    statemachine_task = asyncio.create_task(run_phones(phones))
+    # Let the phones start waiting for pickup before anything else competes for the CPU
+    await asyncio.sleep(0)
+    report.ready()
+
+    # Long-running helpers, their failures are logged and they are stopped with the phones
+    background_tasks: list[asyncio.Task] = []
+
+    def start_background(coro, name: str):
+        task = asyncio.create_task(coro, name=name)
+        task.add_done_callback(_log_failure)
+        background_tasks.append(task)
+
+    try:
+        # Everything below isn't needed to take the first call
+        with report.phase("deferred start"):
+            catalog = None
+            if settings.catalog_file is not None:
+                from .catalog import RecordingCatalog
+                catalog = RecordingCatalog(settings.catalog_file)
+                recording_finished_hooks.append(catalog.submit)
+                start_background(catalog.run(), "catalog")
+
+            encoder = None
+            if settings.encode_format != "none":
+                from .encoder import RecordingEncoder
+                encoder = RecordingEncoder(settings.output_dir / ".encode-queue", settings.encode_format,
+                                           niceness=settings.encode_nice)
+                recording_finished_hooks.append(lambda path, context: encoder.submit(path))
+                if catalog is not None:
+                    # Encoded files replace the originals in the catalog too
+                    encoder.on_encoded.append(catalog.submit_replaced)
+                start_background(encoder.run(), "encoder")
+
+            if settings.export_target is not None:
+                from .exporter import RecordingExporter, open_target
+                exporter = RecordingExporter(
+                    sorted({phone.audio_manager.output_dir for phone in phones}),
+                    open_target(settings.export_target), settings.output_dir / ".export-state.json",
+                    # Never competes with a call, let alone a recording
+                    busy=lambda: any(phone.state is not IdleState for phone in phones),
+                    # WAVs about to be replaced by their encoded version are exported as that
+                    skip=encoder.pending if encoder is not None else lambda path: False,
+                    interval=settings.export_interval_seconds,
+                    rate=settings.export_bandwidth_kbps * 1024 or None,
+                    batch_files=settings.export_batch_files)
+                start_background(exporter.run(), "exporter")
+
+            # Recovered recordings are handed on like finished ones
+            for path in recovered:
+                for hook in recording_finished_hooks:
+                    hook(path, Context(None, None))
+
+            # Lag of the loop with whatever blocks it, in the latency percentiles below
+            watchdog = loop_watchdog.LoopWatchdog(settings.loop_lag_interval_ms / 1000,
+                                                  settings.loop_lag_threshold_ms / 1000)
+            start_background(watchdog.run(), "loop watchdog")
+
+            # kill -USR1 <pid> logs the latency percentiles
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, tracer.dump)
+
+            if settings.metrics_dir is not None:
+                start_background(metrics.export_periodically(settings.metrics_dir, settings.metrics_interval),
+                                 "metrics export")
+
+        if "--startup-report" in sys.argv:
+            print(report.format())
+        if not settings.mock_inputs:
+            await statemachine_task
+        else:
+            # The mock keyboard drives the first handset
+            on_hook_pin = factory.pin(phone_configs[0].pin_on)
+            off_hook_pin = factory.pin(phone_configs[0].pin_off)
+            number_button_pins = {num: factory.pin(pin) for num, pin in phone_configs[0].number_pins.items()}
+            star_button_pin = factory.pin(phone_configs[0].pin_star)
+            pound_button_pin = factory.pin(phone_configs[0].pin_pound)
+
+            async def read_user_input():
+                phone_is_picked_up = False  # Initial state
+
+                while True:
+                    print("\nCommands:")
+                    print("[space]: Toggle Handset (Pick up / Put down)")
+                    print("*: Press Star Button")
+                    print("#: Press Pound Button")
+                    print("0-9: Press Number ")
+                    print("q: Quit")
+
+                    # Read input asynchronously
+                    line = await asyncio.get_event_loop().run_in_executor(None, input, ">> ")
+                    cmd = line.lower()
+
+                    if cmd == " ":
+                        if not phone_is_picked_up:
+                            # Pick up phone
+                            on_hook_pin.drive_high()
+                            off_hook_pin.drive_low()
+                            print("📞 Phone picked up")
+                        else:
+                            # Put down phone
+                            on_hook_pin.drive_low()
+                            off_hook_pin.drive_high()
+                            print("📴 Phone put down")
+                        phone_is_picked_up = not phone_is_picked_up  # Toggle state
+
+                    elif cmd == "*":
+                        print("Pressing Star Button")
+                        star_button_pin.drive_low()
+                        await clock.sleep(0.2)
+                        star_button_pin.drive_high()
+                    elif cmd == "#":
+                        print("Pressing Pound Button")
+                        pound_button_pin.drive_low()
+                        await clock.sleep(0.2)
+                        pound_button_pin.drive_high()
+                    elif cmd.isdigit() and 0 <= int(cmd) <= 9:
+                        print(f"Pressing Number {cmd}")
+                        number_button_pins[int(cmd)].drive_low()
+                        await clock.sleep(0.2)
+                        number_button_pins[int(cmd)].drive_high()
+                    elif cmd == "q":
+                        print("Exiting...")
+                        return
+
+                    else:
+                        print("Invalid command")
+            # Create and start the input reading task
+            input_task = asyncio.create_task(read_user_input())
+
+            # Wait for either the statemachine task or input task to complete
+            done, pending = await asyncio.wait(
+                [statemachine_task, input_task],
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            # Cancel any remaining tasks
+            for task in pending:
+                task.cancel()
+    finally:
+        for task in background_tasks:
             task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
 
 
 async def check_pin_assignments():
+    factory = get_pin_factory()
     on_hook_pin = factory.pin(settings.pin_on)
     off_hook_pin = factory.pin(settings.pin_off)
     number_button_pins = {num: factory.pin(
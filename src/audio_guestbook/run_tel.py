@@ -3,6 +3,7 @@ from gpiozero.pins.mock import MockFactory
 from audio_guestbook.audio_manager import AudioManager
 from .statemachine import run_statemachine
 from .async_button import AsyncButton
+from .clock import Clock
 
 import asyncio
 
@@ -17,8 +18,10 @@ async def run_telephone_input_loop():
     star_button_pin = factory.pin(23)
     pound_button_pin = factory.pin(24)
     
-    audio_manager = AudioManager("alsa_output.usb-Logitech_Logitech_G430_Gaming_Headset-00.analog-stereo", "alsa_input.usb-Logitech_Logitech_G430_Gaming_Headset-00.mono-fallback")
-    statemachine_task = asyncio.create_task(run_statemachine(factory, on_hook_pin, off_hook_pin, number_button_pins, star_button_pin, pound_button_pin, audio_manager))
+    clock = Clock()
+    audio_manager = AudioManager("alsa_output.usb-Logitech_Logitech_G430_Gaming_Headset-00.analog-stereo", "alsa_input.usb-Logitech_Logitech_G430_Gaming_Headset-00.mono-fallback", clock=clock)
+    await audio_manager.start()
+    statemachine_task = asyncio.create_task(run_statemachine(factory, on_hook_pin, off_hook_pin, number_button_pins, star_button_pin, pound_button_pin, audio_manager, clock=clock))
     
     async def read_user_input():
         phone_is_picked_up = False  # Initial state
@@ -51,17 +54,17 @@ async def run_telephone_input_loop():
             elif cmd == "*":
                 print("Pressing Star Button")
                 star_button_pin.drive_low()
-                await asyncio.sleep(0.2)
+                await clock.sleep(0.2)
                 star_button_pin.drive_high()
             elif cmd == "#":
                 print("Pressing Pound Button") 
                 pound_button_pin.drive_low()
-                await asyncio.sleep(0.2)
+                await clock.sleep(0.2)
                 pound_button_pin.drive_high()
             elif cmd.isdigit() and 0 <= int(cmd) <= 9:
                 print(f"Pressing Number {cmd}")
                 number_button_pins[int(cmd)].drive_low()
-                await asyncio.sleep(0.2)
+                await clock.sleep(0.2)
                 number_button_pins[int(cmd)].drive_high()
             elif cmd == "q":
                 print("Exiting...")
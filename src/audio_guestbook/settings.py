@@ -3,8 +3,8 @@ from pathlib import Path
 from typing import Dict, Optional
 from dotenv import find_dotenv, load_dotenv
 
-# Load environment variables from .env file if it exists
-load_dotenv(find_dotenv(usecwd=True))
+# Load environment variables from .env file if it exists, only search parent directories without one here
+load_dotenv(".env" if os.path.isfile(".env") else find_dotenv(usecwd=True))
 
 def str_to_bool(value: str) -> bool:
     return value.lower() in ('true', '1', 'yes', 'on')
@@ -18,10 +18,79 @@ class Settings:
         self.output_dir: Path = Path(os.getenv("AUDIO_OUTPUT_DIR", "recordings"))
         self.mock_inputs: bool = str_to_bool(os.getenv("MOCK_INPUTS", "true"))
         self.recording_length: int = int(os.getenv("RECORDING_LENGTH", 30))
+
+        # Recording format, unset values record in the source's native format
+        self.record_format: Optional[str] = os.getenv("RECORD_FORMAT") or None
+        self.record_rate: Optional[int] = int(os.getenv("RECORD_RATE")) if os.getenv("RECORD_RATE") else None
+        self.record_channels: Optional[int] = int(os.getenv("RECORD_CHANNELS")) if os.getenv("RECORD_CHANNELS") else None
+
+        # Voice activity: stop recordings after trailing silence and trim silence at both ends
+        self.vad_enabled: bool = str_to_bool(os.getenv("VAD_ENABLED", "false"))
+        self.vad_threshold_dbfs: float = float(os.getenv("VAD_THRESHOLD_DBFS", -45))
+        self.vad_silence_seconds: float = float(os.getenv("VAD_SILENCE_SECONDS", 4))
+        self.vad_leading_seconds: float = float(os.getenv("VAD_LEADING_SECONDS", 10))
+        self.vad_pad_seconds: float = float(os.getenv("VAD_PAD_SECONDS", 0.3))
+
+        # Recordings are staged in RAM and written in batches of this much audio, fsynced every STAGING_FSYNC_SECONDS
+        self.staging_flush_seconds: float = float(os.getenv("STAGING_FLUSH_SECONDS", 2))
+        self.staging_fsync_seconds: float = float(os.getenv("STAGING_FSYNC_SECONDS", 5))
+
+        # Catalog of all recordings (SQLite), empty disables it
+        catalog_file = os.getenv("CATALOG_FILE", str(self.output_dir / "catalog.sqlite3"))
+        self.catalog_file: Optional[Path] = Path(catalog_file) if catalog_file else None
+
+        # Background compression of finished recordings: "none", "flac" or "opus"
+        self.encode_format: str = os.getenv("ENCODE_FORMAT", "none").lower()
+        self.encode_nice: int = int(os.getenv("ENCODE_NICE", 10))
+
+        # Finished recordings are copied to this directory (e.g. a USB stick) or http(s):// URL, unset disables it
+        self.export_target: Optional[str] = os.getenv("EXPORT_TARGET") or None
+        self.export_interval_seconds: float = float(os.getenv("EXPORT_INTERVAL_SECONDS", 60))
+        # Transfer rate limit in KiB/s, 0 for none; exports pause while any phone is off the hook
+        self.export_bandwidth_kbps: int = int(os.getenv("EXPORT_BANDWIDTH_KBPS", 1024))
+        self.export_batch_files: int = int(os.getenv("EXPORT_BATCH_FILES", 20))
+
+        # Playback engine: "mixer" keeps one output stream open, "subprocess" spawns paplay per sound
+        self.audio_backend: str = os.getenv("AUDIO_BACKEND", "mixer").lower()
+        self.audio_rate: int = int(os.getenv("AUDIO_RATE", 48000))
+        self.audio_channels: int = int(os.getenv("AUDIO_CHANNELS", 2))
+        self.audio_latency_ms: int = int(os.getenv("AUDIO_LATENCY_MS", 40))
+        # Call-progress tones ("de", "us" or "uk") and DTMF tone lengths, all synthesized
+        self.tone_plan: str = os.getenv("TONE_PLAN", "de").lower()
+        self.dtmf_seconds: float = float(os.getenv("DTMF_SECONDS", 0.1))
+        self.dtmf_short_seconds: float = float(os.getenv("DTMF_SHORT_SECONDS", 0.07))
+        # Greetings and other sounds not in the sink's format are transcoded here once, empty disables it
+        transcode_cache_dir = os.getenv("TRANSCODE_CACHE_DIR", str(self.output_dir / ".sound-cache"))
+        self.transcode_cache_dir: Optional[Path] = Path(transcode_cache_dir) if transcode_cache_dir else None
+        # Memory budget for decoded sounds kept in RAM
+        self.sound_bank_bytes: int = int(float(os.getenv("SOUND_BANK_MB", 32)) * 2**20)
         
-        # Ensure output directory exists
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Event loop: "asyncio" or "uvloop" (if installed); the loop is watched and lag above the threshold logged with its cause
+        self.event_loop: str = os.getenv("EVENT_LOOP", "asyncio").lower()
+        self.loop_lag_interval_ms: float = float(os.getenv("LOOP_LAG_INTERVAL_MS", 100))
+        self.loop_lag_threshold_ms: float = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 50))
+        # asyncio debug mode, also logs every callback slower than the threshold; costly, for diagnosis only
+        self.asyncio_debug: bool = str_to_bool(os.getenv("ASYNCIO_DEBUG", "false"))
+
+        # State machine metrics, exported as Prometheus text file and JSONL if a directory is set
+        self.metrics_dir: Optional[Path] = Path(os.getenv("METRICS_DIR")) if os.getenv("METRICS_DIR") else None
+        self.metrics_interval: float = float(os.getenv("METRICS_INTERVAL", 60))
+        self.trace_size: int = int(os.getenv("TRACE_SIZE", 256))
+
+        # Contacts file (TOML, JSON or CSV), watched for changes; unset uses the built-in contacts
+        self.contacts_file: Optional[Path] = Path(os.getenv("CONTACTS_FILE")) if os.getenv("CONTACTS_FILE") else None
+        self.contacts_poll_seconds: float = float(os.getenv("CONTACTS_POLL_SECONDS", 2))
+
+        # Handsets served by this process (TOML or JSON); unset serves one phone from the PIN_* variables
+        self.phones_file: Optional[Path] = Path(os.getenv("PHONES_FILE")) if os.getenv("PHONES_FILE") else None
+
+        # The output directory is created by the audio manager once it starts, not on import
         
+        # Button input: "buttons" for a gpiozero Button per pin, "poller" reads all pins as one group in one thread
+        self.input_backend: str = os.getenv("INPUT_BACKEND", "buttons").lower()
+        self.input_poll_ms: float = float(os.getenv("INPUT_POLL_MS", 5))
+        self.input_debounce_ms: float = float(os.getenv("INPUT_DEBOUNCE_MS", 50))
+
         # Pin mappings
         self.pin_mappings: Dict[str, int] = {}
         
@@ -0,0 +1,138 @@
+import logging
+import os
+import struct
+import threading
+import wave
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from .audio_engine import load_pcm
+
+logger = logging.getLogger(__name__)
+
+_MAPPABLE_WIDTHS = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+@dataclass
+class SoundBankStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    resident_bytes: int = 0
+    entries: int = 0
+
+    def __str__(self):
+        return (f"{self.entries} sounds, {self.resident_bytes / 2**20:.1f} MiB, "
+                f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions")
+
+
+def _wav_data_offset(file_path: str | Path) -> int | None:
+    """Byte offset of the data chunk in a RIFF/WAVE file, None if it isn't one."""
+    with open(file_path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"data":
+                return f.tell()
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def map_wav(file_path: str | Path, rate: int) -> np.ndarray | None:
+    """Memory-map the samples of a WAV file that needs no conversion for playback.
+
+    Returns None if the file has to be decoded (other sample rate, 24 bit, ...).
+    """
+    try:
+        with wave.open(str(file_path), "rb") as wav:
+            channels, width, file_rate, frames = (
+                wav.getnchannels(), wav.getsampwidth(), wav.getframerate(), wav.getnframes())
+        offset = _wav_data_offset(file_path)
+    except (wave.Error, EOFError):
+        return None
+    if file_rate != rate or width not in _MAPPABLE_WIDTHS or offset is None or frames == 0:
+        return None
+    return np.memmap(file_path, dtype=np.dtype(_MAPPABLE_WIDTHS[width]).newbyteorder("<"),
+                     mode="r", offset=offset, shape=(frames, channels))
+
+
+class SoundBank:
+    """Cache of decoded sounds, ready to be fed to the mixer.
+
+    Entries are keyed by path and mtime, so an edited file is picked up on the
+    next play. Total size is bounded by `budget_bytes`, least recently played
+    sounds are evicted first. Thread safe, loading usually runs in a worker thread.
+    """
+
+    def __init__(self, budget_bytes: int, rate: int, channels: int, ffmpeg: str = "ffmpeg"):
+        self._budget_bytes = budget_bytes
+        self._rate = rate
+        self._channels = channels
+        self._ffmpeg = ffmpeg
+        self._entries: OrderedDict[tuple[str, int], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = SoundBankStats()
+
+    def cached(self, file_path: str | Path) -> np.ndarray | None:
+        """Return the PCM of `file_path` if it is in the bank, without decoding anything."""
+        try:
+            key = (str(file_path), os.stat(file_path).st_mtime_ns)
+        except OSError:
+            return None
+        with self._lock:
+            pcm = self._entries.get(key)
+            if pcm is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+            return pcm
+
+    def get(self, file_path: str | Path) -> np.ndarray:
+        """Return the PCM of `file_path`, decoding it on a miss."""
+        pcm = self.cached(file_path)
+        if pcm is not None:
+            return pcm
+        path = str(file_path)
+        key = (path, os.stat(path).st_mtime_ns)
+        with self._lock:
+            self.stats.misses += 1
+
+        pcm = map_wav(path, self._rate)
+        if pcm is None:
+            pcm = load_pcm(path, self._rate, self._channels, self._ffmpeg)
+        self._insert(key, pcm)
+        return pcm
+
+    def preload(self, file_paths):
+        """Decode all given files into the bank, skipping the ones that can't be loaded."""
+        for file_path in file_paths:
+            try:
+                self.get(file_path)
+            except Exception as e:
+                logger.warning("Could not preload %s: %s", file_path, e)
+        logger.info("Sound bank: %s", self.stats)
+
+    def _insert(self, key: tuple[str, int], pcm: np.ndarray):
+        if pcm.nbytes > self._budget_bytes:
+            logger.info("%s exceeds the sound bank budget, not caching it", key[0])
+            return
+        with self._lock:
+            # Drop older versions of the same file
+            for stale in [k for k in self._entries if k[0] == key[0]]:
+                self._evict(stale)
+            self._entries[key] = pcm
+            self.stats.resident_bytes += pcm.nbytes
+            while self.stats.resident_bytes > self._budget_bytes:
+                self._evict(next(iter(self._entries)))
+                self.stats.evictions += 1
+            self.stats.entries = len(self._entries)
+
+    def _evict(self, key: tuple[str, int]):
+        pcm = self._entries.pop(key)
+        self.stats.resident_bytes -= pcm.nbytes
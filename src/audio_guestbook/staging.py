@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from .capture import CaptureSink, SampleSpec
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+
+# SD cards and most file systems work in 4 KiB blocks, every batch covers whole blocks
+_BLOCK_BYTES = 4096
+# The header is padded with a JUNK chunk to one block, so the audio data starts block aligned
+_HEADER_BYTES = _BLOCK_BYTES
+# RIFF header, fmt chunk and the JUNK chunk's own header come before the padding
+_JUNK_BYTES = _HEADER_BYTES - 12 - 24 - 8 - 8
+
+
+def part_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + PART_SUFFIX)
+
+
+def _wav_header(spec: SampleSpec, data_bytes: int) -> bytes:
+    header = b"".join([
+        b"RIFF", struct.pack("<I", _HEADER_BYTES - 8 + data_bytes), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, spec.channels, spec.rate,
+                             spec.rate * spec.frame_bytes, spec.frame_bytes, spec.sample_width * 8),
+        b"JUNK", struct.pack("<I", _JUNK_BYTES), bytes(_JUNK_BYTES),
+        b"data", struct.pack("<I", data_bytes),
+    ])
+    assert len(header) == _HEADER_BYTES
+    return header
+
+
+def _fsync_directory(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class StagedWavSink(CaptureSink):
+    """Writes a recording so that a power loss costs seconds of audio, not the message.
+
+    Audio is staged in RAM and written to `<name>.wav.part` next to the final
+    file in batches of whole 4 KiB blocks of about `flush_seconds` each, while
+    the next batch keeps filling. Every `fsync_seconds` of audio the header is
+    patched to the length on disk and the file is fsynced, so the part file is
+    a valid WAV up to that point. On close the rest is written and the file is
+    renamed into place. Part files left by a crash are finalized by
+    `recover_recordings()`.
+    """
+
+    def __init__(self, output_path: Path, flush_seconds: float = 2.0, fsync_seconds: float = 5.0):
+        self.output_path = output_path
+        self._flush_seconds = flush_seconds
+        self._fsync_seconds = fsync_seconds
+        self._part_path = part_path(output_path)
+        self._fd: int | None = None
+        self._spec: SampleSpec | None = None
+        self._buffer = bytearray()
+        self._flush_bytes = _BLOCK_BYTES
+        self._fsync_bytes = _BLOCK_BYTES
+        # Audio bytes written to the part file, and how many of them are synced
+        self._data_bytes = 0
+        self._synced_bytes = 0
+        self._flushing: asyncio.Task | None = None
+        self._finishing: asyncio.Task | None = None
+
+    async def open(self, spec: SampleSpec):
+        if spec.format == "float32le":
+            raise ValueError("WAV sink can only write integer PCM")
+        self._spec = spec
+        bytes_per_second = spec.rate * spec.frame_bytes
+        self._flush_bytes = max(_BLOCK_BYTES, int(self._flush_seconds * bytes_per_second) // _BLOCK_BYTES * _BLOCK_BYTES)
+        self._fsync_bytes = int(self._fsync_seconds * bytes_per_second)
+        await asyncio.to_thread(self._create)
+
+    def _create(self):
+        self._part_path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self._part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(self._fd, _wav_header(self._spec, 0))
+        # The format has to survive a crash for the recovery to make sense of the data
+        os.fsync(self._fd)
+        _fsync_directory(self._part_path.parent)
+
+    async def write(self, chunk: np.ndarray):
+        self._buffer += chunk.tobytes()
+        if len(self._buffer) < self._flush_bytes:
+            return
+        if self._flushing is not None:
+            # The card is slower than the audio, wait instead of piling up batches.
+            # Shielded: cancelling a to_thread() task doesn't stop its write, close() has to wait for it
+            await asyncio.shield(self._flushing)
+        batch_bytes = len(self._buffer) // _BLOCK_BYTES * _BLOCK_BYTES
+        batch = bytes(self._buffer[:batch_bytes])
+        del self._buffer[:batch_bytes]
+        self._flushing = asyncio.create_task(asyncio.to_thread(self._append, batch))
+
+    def _append(self, data: bytes, final: bool = False):
+        os.pwrite(self._fd, data, _HEADER_BYTES + self._data_bytes)
+        self._data_bytes += len(data)
+        if final or self._data_bytes - self._synced_bytes >= self._fsync_bytes:
+            self._patch_header()
+            os.fsync(self._fd)
+            self._synced_bytes = self._data_bytes
+
+    def _patch_header(self):
+        os.pwrite(self._fd, struct.pack("<I", _HEADER_BYTES - 8 + self._data_bytes), 4)
+        os.pwrite(self._fd, struct.pack("<I", self._data_bytes), _HEADER_BYTES - 4)
+
+    async def close(self):
+        if self._finishing is None:
+            if self._fd is None:
+                return
+            tail = bytes(self._buffer)
+            self._buffer.clear()
+            flushing, self._flushing = self._flushing, None
+            # Runs on its own, so even a cancelled close() never finishes the file under a running batch
+            self._finishing = asyncio.create_task(self._finish_after(flushing, tail))
+        await asyncio.shield(self._finishing)
+
+    async def _finish_after(self, flushing: asyncio.Task | None, tail: bytes):
+        try:
+            if flushing is not None:
+                await flushing
+        finally:
+            # Even after a failed batch, finalize what made it to the card
+            await asyncio.to_thread(self._finish, tail)
+
+    def _finish(self, tail: bytes):
+        try:
+            self._append(tail, final=True)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+        os.replace(self._part_path, self.output_path)
+        _fsync_directory(self.output_path.parent)
+
+
+def _recover(path: Path) -> Path | None:
+    """Fix the header of one part file to the whole frames on disk and move it into place."""
+    with open(path, "r+b") as f:
+        head = f.read(_HEADER_BYTES * 16)
+        size = os.fstat(f.fileno()).st_size
+        if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            raise ValueError("not a WAV file")
+        offset, block_align, data_offset = 12, None, None
+        while offset + 8 <= len(head):
+            chunk_id, chunk_size = head[offset:offset + 4], struct.unpack_from("<I", head, offset + 4)[0]
+            if chunk_id == b"fmt ":
+                block_align = struct.unpack_from("<H", head, offset + 20)[0]
+            elif chunk_id == b"data":
+                data_offset = offset + 8
+                break
+            offset += 8 + chunk_size + (chunk_size & 1)
+        if not block_align or data_offset is None:
+            raise ValueError("no format or data chunk")
+
+        data_bytes = max(0, size - data_offset) // block_align * block_align
+        if data_bytes == 0:
+            path.unlink()
+            return None
+        f.truncate(data_offset + data_bytes)
+        f.seek(4)
+        f.write(struct.pack("<I", data_offset - 8 + data_bytes))
+        f.seek(data_offset - 4)
+        f.write(struct.pack("<I", data_bytes))
+        f.flush()
+        os.fsync(f.fileno())
+
+    output_path = path.with_name(path.name.removesuffix(PART_SUFFIX))
+    os.replace(path, output_path)
+    _fsync_directory(path.parent)
+    return output_path
+
+
+def recover_recordings(directory: Path) -> list[Path]:
+    """Finalize the part files a crash or power loss left in `directory`, returns the recovered recordings.
+
+    Part files that can't be read as WAV are left alone for inspection.
+    """
+    recovered = []
+    if not directory.is_dir():
+        return recovered
+    for path in sorted(directory.glob(f"*.wav{PART_SUFFIX}")):
+        try:
+            output_path = _recover(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error("Could not recover %s: %s", path.name, e)
+            continue
+        if output_path is None:
+            logger.info("Removed empty partial recording %s", path.name)
+        else:
+            logger.warning("Recovered partial recording %s", output_path.name)
+            recovered.append(output_path)
+    return recovered
@@ -0,0 +1,130 @@
+import contextlib
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedLoader:
+    """Wraps a module's loader to time executing the module, everything else is passed through."""
+
+    def __init__(self, loader, report: 'StartupReport'):
+        self._loader = loader
+        self._report = report
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._report._import_stack
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self._report.imports[module.__name__] = (cumulative - nested, cumulative)
+
+
+class _ImportTimer:
+    """Meta path finder that finds nothing itself, it only wraps the loaders other finders return."""
+
+    def __init__(self, report: 'StartupReport'):
+        self._report = report
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self._report)
+                return spec
+        return None
+
+
+def _process_age() -> float | None:
+    """Seconds since the interpreter process started, None where /proc isn't available."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces, the fields after it don't
+            fields = f.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupReport:
+    """Wall time of every startup phase up to ready for pickup, and optionally of every import.
+
+    Import accounting works like `python -X importtime`: per module the time
+    spent in its own body ("self") and including its imports ("cumulative").
+    It is only switched on by `track_imports()`, which has to happen before
+    the imports it should see.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Interpreter startup before this module was imported
+        self.interpreter = _process_age()
+        self.phases: list[tuple[str, float]] = []
+        # Module name -> (self, cumulative) seconds
+        self.imports: dict[str, tuple[float, float]] = {}
+        self.ready_after: float | None = None
+        self._import_stack: list[float] = []
+        self._timer: _ImportTimer | None = None
+
+    def track_imports(self):
+        if self._timer is None:
+            self._timer = _ImportTimer(self)
+            sys.meta_path.insert(0, self._timer)
+
+    def stop_tracking_imports(self):
+        if self._timer is not None:
+            sys.meta_path.remove(self._timer)
+            self._timer = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def ready(self):
+        """Everything needed to take a call is up, the rest of startup may follow."""
+        self.ready_after = time.perf_counter() - self.started
+        self.stop_tracking_imports()
+        logger.info("Ready for pickup %.2f s after start", self.ready_after + (self.interpreter or 0.0))
+
+    def format(self, top: int = 25) -> str:
+        lines = ["Startup report"]
+        if self.interpreter is not None:
+            lines.append(f"  {'interpreter':32} {self.interpreter * 1000:9.1f} ms")
+        for name, seconds in self.phases:
+            lines.append(f"  {name:32} {seconds * 1000:9.1f} ms")
+        if self.ready_after is not None:
+            total = self.ready_after + (self.interpreter or 0.0)
+            lines.append(f"  {'ready for pickup after':32} {total * 1000:9.1f} ms")
+        if self.imports:
+            lines.append(f"Slowest imports ({len(self.imports)} modules), self | cumulative:")
+            for name, (own, cumulative) in sorted(
+                    self.imports.items(), key=lambda item: item[1][1], reverse=True)[:top]:
+                lines.append(f"  {name:40} {own * 1000:8.1f} | {cumulative * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+# Global report, like the latency tracer every startup step reports to the same one
+report = StartupReport()
@@ -5,10 +5,16 @@ from enum import Enum, auto
 from pathlib import Path
 import time
 import random  # for simulating input
+from typing import Callable
 from gpiozero import Factory
 from .audio_manager import AudioManager
-from .async_button import AsyncButton, wait_for_any_button
-from .contact import Contact, was_dialed
+from .metrics import StateMetrics
+from .async_button import AsyncButton, ButtonEvent
+from .clock import Clock
+from .gpio_poller import GpioPoller
+from .contact import Contact, ContactRegistry, DialResult
+from .latency import tracer
+from .tones import DTMF_FREQUENCIES, TONE_PLANS
 
 from .settings import settings
 
@@ -21,20 +27,30 @@ BEEP_PATH = SOUNDS_PATH / "beep.wav"
 GOODBYE_PATH = SOUNDS_PATH / "goodbye.wav"
 WAEHLTON_PATH = SOUNDS_PATH / "dtmf" / "dtmf-eur-dialtone.wav"
 UNKNOWN_NUMBER_PATH = SOUNDS_PATH / "unknown_number.wav"
-RINGBACK_PATH = SOUNDS_PATH / "dtmf" / "dtmf-eur-ringback.wav"
-#STAR_PATH = SOUNDS_PATH / "tone_star.wav"
-STAR_PATH = SOUNDS_PATH / "dtmf" / f"dtmf-star.wav"
-POUND_PATH = SOUNDS_PATH / "dtmf" / "dtmf-pound.wav"
-NUMBER_PATHS = {
-    #num: SOUNDS_PATH / f"Dtmf-{num}.wav" for num in range(10)
-    num: SOUNDS_PATH / "dtmf" / f"dtmf-{num}.wav" for num in range(10)
-}
+# Call-progress and DTMF tones are synthesized, no pre-rendered files to load
+if settings.tone_plan not in TONE_PLANS:
+    raise ValueError(f"Unknown TONE_PLAN {settings.tone_plan!r}, expected one of {list(TONE_PLANS)}")
+TONES = TONE_PLANS[settings.tone_plan]
+DIAL_TONE = TONES.dial
+RINGBACK = TONES.ringback
 
 contacts = [
     Contact(name="JanundLydia", number=(3,0,0,5,),
             greeting_path=SOUNDS_PATH / "greetings/LydiaundJan_ampl_beep.mp3")
 ]
 
+# Contacts from settings.contacts_file if set, the built-in ones above otherwise
+contact_registry = ContactRegistry(settings.contacts_file, default=contacts,
+                                   poll_interval=settings.contacts_poll_seconds)
+
+# Sounds decoded into the sound bank at startup, so no call has to wait for the SD card
+PRELOAD_PATHS = [
+    UNKNOWN_NUMBER_PATH, GOODBYE_PATH,
+]
+
+# Called with the path and context of every finished recording, e.g. to compress it
+recording_finished_hooks: list[Callable[[Path, 'Context'], None]] = []
+
 # --- State Machine Framework ---
 
 
@@ -60,52 +76,57 @@ class Input:
     number_buttons: dict[int, AsyncButton]
     star_button: AsyncButton
     pound_button: AsyncButton
+    # Press and release edges of all keypad buttons, in order
+    key_events: asyncio.Queue[ButtonEvent] = dataclasses.field(default_factory=asyncio.Queue)
+    # All waiting and timestamps of the call flow, virtual in simulations
+    clock: Clock = dataclasses.field(default_factory=Clock)
+
+    def __post_init__(self):
+        # Clock.monotonic() of the GPIO edge of the key last returned by next_key()
+        self.last_key_time: float | None = None
+        self.key_for_pin: dict[int, int | str] = {
+            **{button.pin: num for num, button in self.number_buttons.items()},
+            self.star_button.pin: "star",
+            self.pound_button.pin: "pound",
+        }
 
     def get_buttons(self) -> list[AsyncButton]:
         return [*self.number_buttons.values(), self.star_button, self.pound_button]
 
+    def clear_key_events(self):
+        """Drop keypad edges that happened before anyone was listening."""
+        while not self.key_events.empty():
+            self.key_events.get_nowait()
+
+    async def next_key(self, timeout: float | None = None) -> int | str | None:
+        """Wait for the next keypad press, None if `timeout` passed without one."""
+        try:
+            async with self.clock.timeout(timeout):
+                while True:
+                    event = await self.key_events.get()
+                    if event.pressed:
+                        self.last_key_time = event.timestamp
+                        return self.key_for_pin[event.pin]
+        except TimeoutError:
+            return None
+
 
 class State:
     async def run(self, input: Input, context: Context, audio_manager: AudioManager) -> tuple[type['State'], Context]:
         raise NotImplementedError("Each state must implement run()")
 
 class HangableState(State):
+    """A state of a call, cancelled wherever it is as soon as the handset is hung up.
+
+    The hook switch is watched by the phone for the whole call, see `Phone`.
+    """
+
     async def run_hangable(self, input: Input, context: Context, audio_manager: AudioManager):
         raise NotImplementedError(
             "Override run_hangable() in subclasses of HangableState")
 
-    async def do_and_wait_for_hangup(self, do: asyncio.Task, input: Input, audio_manager: AudioManager):
-        done, pending = await asyncio.wait(
-            [do, asyncio.create_task(input.on_hook_button.wait_for_press())],
-            return_when=asyncio.FIRST_COMPLETED
-        )
-        for task in pending:
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-        return do not in done
-
     async def run(self, input: Input, context: Context, audio_manager: AudioManager):
-        # Wrap run_hangable in a task
-        task = asyncio.create_task(self.run_hangable(input, context, audio_manager))
-
-        # Wait for task or hangup
-        hangup_detected = await self.do_and_wait_for_hangup(task, input, audio_manager)
-
-        if hangup_detected:
-            # If hangup happened, cancel the main task
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                pass
-            # Return to idle state if hangup happened, no context change
-            return (IdleState, Context(None, None))
-        else:
-            # state's run_hangable completed, return its result with state and context
-            return task.result()
+        return await self.run_hangable(input, context, audio_manager)
 
 # --- Concrete States ---
 
@@ -133,51 +154,40 @@ class PickedUpState(HangableState):
             await audio_manager.unmute()
             await audio_manager.set_volume(100)
 
+            # Reloaded contacts only apply to the next call
+            directory = contact_registry.directory
+            input.clear_key_events()
+            span = tracer.begin("off_hook→dial_tone", input.off_hook_button.last_press_time)
+            # Back here after a call the handset wasn't picked up again, nothing to measure
+            input.off_hook_button.last_press_time = None
             wait_for_dialing_loop = asyncio.create_task(
-                audio_manager.play_audio_loop(WAEHLTON_PATH))
+                audio_manager.play_cadence(DIAL_TONE, span=span))
 
-            pressed_buttons = []
+            dialed_number = []
 
             while True:
                 # Only wait for timeout if already a button was pressed
-                pressed_button = await wait_for_any_button(input.get_buttons(), timeout=3 if len(pressed_buttons) > 0 else None)
+                key = await input.next_key(timeout=3 if len(dialed_number) > 0 else None)
 
                 if not wait_for_dialing_loop.cancelled():
                     wait_for_dialing_loop.cancel()
 
-                if pressed_button is None:
-                    # Translate pressed_buttons to list of ints and pound and star
-                    # by finding the key in the number_buttons dict and appending the number if pressed_button is in number_buttons
-                    dialed_number = []
-                    for pressed_button in pressed_buttons:
-                        if pressed_button in input.number_buttons.values():
-                            # Get number by finding key in number_buttons dict keys
-                            number = next(
-                                num for num, btn in input.number_buttons.items() if btn == pressed_button)
-                            dialed_number.append(number)
-                        elif pressed_button == input.star_button:
-                            dialed_number.append("star")
-                        elif pressed_button == input.pound_button:
-                            dialed_number.append("pound")
+                if key is not None:
+                    tracer.observe("keypress→state", input.clock.monotonic() - input.last_key_time)
+                    dialed_number.append(key)
+                    # Play the DTMF tone of the key
+                    asyncio.create_task(audio_manager.play_dtmf(
+                        key, settings.dtmf_seconds, span=tracer.begin("keypress→tone", input.last_key_time)))
+
+                    # Dial right away if the number can't get any longer or can't become a number
+                    result, _ = directory.lookup(tuple(dialed_number))
+                    if result in (DialResult.COMPLETE, DialResult.DEAD):
+                        key = None
 
+                if key is None:
                     dialed_number = tuple(dialed_number)
                     print(f"🔢 Dialed number: {dialed_number}")
-                    return (DialingState, Context(tuple(dialed_number), None))
-                else:
-                    pressed_buttons.append(pressed_button)
-
-                if pressed_button == input.star_button:
-                    # Play tone_star.wav
-                    asyncio.create_task(audio_manager.play_audio(STAR_PATH))
-                elif pressed_button == input.pound_button:
-                    # Play tone_pound.wav
-                    asyncio.create_task(audio_manager.play_audio(POUND_PATH))
-                elif pressed_button in input.number_buttons.values():
-                    # Get number by finding key in number_buttons dict
-                    number = next(
-                        num for num, btn in input.number_buttons.items() if btn == pressed_button)
-                    # Play tone_<number>.wav
-                    asyncio.create_task(audio_manager.play_audio(NUMBER_PATHS[number]))
+                    return (DialingState, Context(dialed_number, directory.get(dialed_number)))
 
         except asyncio.CancelledError:
             if wait_for_dialing_loop:
@@ -193,18 +203,16 @@ class DialingState(HangableState):
 
         # Play tones of dialed number
         for number in context.dialed_number:
-            tone_path = None
-            if (isinstance(number, int) and number >= 0 and number < 10) or (isinstance(number, str) and number in ["star", "pound"]):
-                tone_path = SOUNDS_PATH / f"dtmf/dtmf-{number}-short.wav"
-                await audio_manager.play_audio(tone_path)
+            if number in DTMF_FREQUENCIES:
+                await audio_manager.play_dtmf(number, settings.dtmf_short_seconds)
             else:
                 print(f"❌ Invalid number: {number}")
         
         # Short delay
-        await asyncio.sleep(0.5)
+        await input.clock.sleep(0.5)
         
-        # Find out contact
-        contact = was_dialed(context.dialed_number, contacts)
+        # Contact was looked up while dialing
+        contact = context.selected_contact
         # If contact is None, play unknown number sound
         if contact is None:
             await audio_manager.play_audio(UNKNOWN_NUMBER_PATH)
@@ -213,8 +221,7 @@ class DialingState(HangableState):
         # Play ringback random number of times between 3 and 10
         ringback_count = 1# random.randint(3, 10)
         print(f"🔔 Random ringback count: {ringback_count}")
-        for _ in range(0, ringback_count):
-            await audio_manager.play_audio(RINGBACK_PATH)
+        await audio_manager.play_cadence(RINGBACK, repeat=ringback_count)
 
         return (PlayGreetingState, Context(context.dialed_number, contact))
 
@@ -233,7 +240,7 @@ class RecordMessageState(HangableState):
     async def run_hangable(self, input: Input, context: Context, audio_manager: AudioManager):
         print("🎙️ Recording started...")
 
-        recordings_dir = settings.output_dir
+        recordings_dir = audio_manager.output_dir
 
         timestamp = datetime.now()
         random_number = random.randint(0, 10**8)  # Generates a random 3-digit number
@@ -241,7 +248,13 @@ class RecordMessageState(HangableState):
         filename = recordings_dir / Path(f"{timestamp.strftime('%Y%m%d_%H%M%S')}_{timestamp.microsecond//1000:03d}_{random_number}.wav")
 
         # Record audio
-        await audio_manager.record_audio(filename, settings.recording_length)
+        try:
+            await audio_manager.record_audio(filename, settings.recording_length)
+        finally:
+            # Most messages end with a hangup, record_audio finalized the file before it was cancelled
+            if filename.exists():
+                for hook in recording_finished_hooks:
+                    hook(filename, context)
         return (GoodbyeState, context)
 
 
@@ -263,31 +276,155 @@ states: dict[type[State], State] = {
     DisconnectState: DisconnectState(),
 }
 
+# --- Phones ---
+class Phone:
+    """One handset: its buttons, its audio manager and where it is in the call flow.
+
+    The states keep no data of their own and contacts and sounds are shared,
+    so any number of phones can run side by side on one event loop.
+    """
+
+    def __init__(self, name: str, pin_factory: Factory, on_hook_pin, off_hook_pin, number_button_pins: dict[int, object],
+                 star_button_pin, pound_button_pin, audio_manager: AudioManager,
+                 metrics: StateMetrics | None = None, clock: Clock | None = None,
+                 poller: GpioPoller | None = None):
+        self.name = name
+        self.audio_manager = audio_manager
+        self.metrics = metrics if metrics is not None else StateMetrics(settings.trace_size)
+        self.clock = clock if clock is not None else Clock()
+
+        # Pins are read by a gpiozero Button each, or all together by the poller shared between phones
+        self.poller = poller
+
+        key_events: asyncio.Queue[ButtonEvent] = asyncio.Queue()
+        on_hook_button = AsyncButton(on_hook_pin.number, pin_factory=pin_factory, clock=self.clock, poller=poller)
+        off_hook_button = AsyncButton(off_hook_pin.number, pin_factory=pin_factory, clock=self.clock, poller=poller)
+        number_buttons = {num: AsyncButton(
+            pin.number, pin_factory=pin_factory, bounce_time=0.05, events=key_events, clock=self.clock, poller=poller) for num, pin in number_button_pins.items()}
+        star_button = AsyncButton(star_button_pin.number, pin_factory=pin_factory, bounce_time=0.05, events=key_events, clock=self.clock, poller=poller)
+        pound_button = AsyncButton(
+            pound_button_pin.number, pin_factory=pin_factory, bounce_time=0.05, events=key_events, clock=self.clock, poller=poller)
+
+        self.input = Input(on_hook_button, off_hook_button,
+                           number_buttons, star_button, pound_button, key_events, self.clock)
+        self.state: type[State] = IdleState
+        self.context = Context(None, None)
+        # Clock.monotonic() when the current state was entered
+        self._state_started = self.clock.monotonic()
+
+    async def run(self):
+        """Run the call flow of this handset until cancelled."""
+        while True:
+            if issubclass(self.state, HangableState):
+                await self._run_call()
+            else:
+                await self._run_state()
+
+    async def _run_state(self):
+        self._state_started = self.clock.monotonic()
+        next_state_class, context = await states[self.state].run(self.input, self.context, self.audio_manager)
+        self.context = dataclasses.replace(context)
+        self.metrics.record_transition(self.state.__name__, next_state_class.__name__,
+                                       self._state_started, self.clock.monotonic())
+        self.state = next_state_class
+
+    async def _run_calls_states(self):
+        while issubclass(self.state, HangableState):
+            await self._run_state()
+
+    async def _run_call(self):
+        """Run the states of a call in one task, cancelled by the on-hook edge itself.
+
+        One callback on the hook switch covers the whole call, so hanging up
+        only has to unwind the state that is running.
+        """
+        on_hook_button = self.input.on_hook_button
+        call_started = self._state_started = self.clock.monotonic()
+        call = asyncio.create_task(self._run_calls_states())
+
+        def hang_up():
+            # Only once: a bouncing contact would interrupt the states' cleanup again and again
+            on_hook_button.on_press.remove(hang_up)
+            call.cancel()
+
+        on_hook_button.on_press.append(hang_up)
+        if on_hook_button.is_pressed:
+            # Hung up again before the call got going
+            hang_up()
+        try:
+            await call
+            return
+        except asyncio.CancelledError:
+            # Only a hangup ends the call like this, cancelling the phone goes on
+            if not call.cancelled() or asyncio.current_task().cancelling():
+                raise
+        finally:
+            if hang_up in on_hook_button.on_press:
+                on_hook_button.on_press.remove(hang_up)
+
+        # Cancelling the call stopped whatever it was playing
+        hung_up_at = on_hook_button.last_press_time
+        if hung_up_at is not None and hung_up_at >= call_started:
+            tracer.observe("on_hook→silence", self.clock.monotonic() - hung_up_at)
+        self.metrics.record_transition(self.state.__name__, IdleState.__name__,
+                                       self._state_started, self.clock.monotonic())
+        self.state = IdleState
+        self.context = Context(None, None)
+
+
 # --- Async Main Loop ---
-async def run_statemachine(pin_factory: Factory, on_hook_pin, off_hook_pin, number_button_pins: dict[int, object], star_button_pin, pound_button_pin, audio_manager: AudioManager):
-    on_hook_button = AsyncButton(on_hook_pin.number, pin_factory=pin_factory)
-    off_hook_button = AsyncButton(off_hook_pin.number, pin_factory=pin_factory)
-    number_buttons = {num: AsyncButton(
-        pin.number, pin_factory=pin_factory, bounce_time=0.05) for num, pin in number_button_pins.items()}
-    star_button = AsyncButton(star_button_pin.number, pin_factory=pin_factory, bounce_time=0.05)
-    pound_button = AsyncButton(
-        pound_button_pin.number, pin_factory=pin_factory, bounce_time=0.05)
-
-    input = Input(on_hook_button, off_hook_button,
-                      number_buttons, star_button, pound_button)
-    
-    context = Context(None, None)
-
-    old_state = None
-    state = IdleState
-
-    trace: list[tuple[type[State], Context]] = [(None, dataclasses.replace(context))]
-    while True:
-        next_state_class, context = await states[state].run(input, context, audio_manager)
-        context = dataclasses.replace(context)
-        trace.append((state, context))
-        old_state = state
-        state = next_state_class
+async def run_phones(phones: list[Phone]):
+    """Drive all phones concurrently, sharing the contacts and the preloaded sounds."""
+    def greeting_paths():
+        return [contact.greeting_path for contact in contact_registry.directory]
+
+    async def preload(paths):
+        # Audio managers usually share one sound bank and transcode cache, the later ones find everything cached
+        for phone in phones:
+            await phone.audio_manager.preload(paths)
+        # Transcodes of removed or changed greetings are no longer needed
+        keep = [*PRELOAD_PATHS, *greeting_paths()]
+        for cache in {id(cache): cache for phone in phones
+                      if (cache := phone.audio_manager.transcode_cache) is not None}.values():
+            await asyncio.to_thread(cache.prune, keep)
+
+    preload_task = asyncio.create_task(preload([*PRELOAD_PATHS, *greeting_paths()]))
+    # Transcode and decode changed greetings in the background, so the next caller doesn't wait for them
+    rewarm_tasks: set[asyncio.Task] = set()
+
+    def rewarm(directory):
+        task = asyncio.create_task(preload(greeting_paths()))
+        rewarm_tasks.add(task)
+        task.add_done_callback(rewarm_done)
+
+    def rewarm_done(task: asyncio.Task):
+        rewarm_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️ Preloading the reloaded greetings failed: {task.exception()!r}")
+    contact_registry.on_reload.append(rewarm)
+    contacts_watch_task = asyncio.create_task(contact_registry.watch())
+
+    # Pollers only start reading once every phone added its pins
+    pollers = {id(phone.poller): phone.poller for phone in phones if phone.poller is not None}.values()
+    for poller in pollers:
+        poller.start()
+
+    try:
+        await asyncio.gather(*(phone.run() for phone in phones))
+    finally:
+        for poller in pollers:
+            poller.close()
+        contact_registry.on_reload.remove(rewarm)
+        preload_task.cancel()
+        for task in rewarm_tasks:
+            task.cancel()
+        contacts_watch_task.cancel()
+
+
+async def run_statemachine(pin_factory: Factory, on_hook_pin, off_hook_pin, number_button_pins: dict[int, object], star_button_pin, pound_button_pin, audio_manager: AudioManager, metrics: StateMetrics | None = None, clock: Clock | None = None, poller: GpioPoller | None = None):
+    """Drive a single phone."""
+    await run_phones([Phone("phone", pin_factory, on_hook_pin, off_hook_pin, number_button_pins,
+                            star_button_pin, pound_button_pin, audio_manager, metrics, clock, poller)])
 
 if __name__ == "__main__":
     # asyncio.run(main())
@@ -0,0 +1,107 @@
+import math
+from dataclasses import dataclass
+from functools import lru_cache, reduce
+
+import numpy as np
+
+# Keypad rows and columns as in gen.sh, A-D are the fourth column
+DTMF_ROWS = (697, 770, 852, 941)
+DTMF_COLUMNS = (1209, 1336, 1477, 1633)
+DTMF_LAYOUT = (
+    (1, 2, 3, "A"),
+    (4, 5, 6, "B"),
+    (7, 8, 9, "C"),
+    ("star", 0, "pound", "D"),
+)
+DTMF_FREQUENCIES: dict[int | str, tuple[float, float]] = {
+    key: (DTMF_ROWS[row], DTMF_COLUMNS[column])
+    for row, keys in enumerate(DTMF_LAYOUT) for column, key in enumerate(keys)
+}
+
+# Fade in and out, so a tone that ends mid-period doesn't click
+_RAMP_SECONDS = 0.004
+
+
+@dataclass(frozen=True)
+class Cadence:
+    """A call-progress signal: a (multi) frequency tone switched on and off periodically.
+
+    `pattern` alternates on and off durations in seconds, starting with on, e.g.
+    (1.0, 4.0) for the German ringback. An empty pattern is a continuous tone.
+    """
+    frequencies: tuple[float, ...]
+    pattern: tuple[float, ...] = ()
+    level: float = 0.3
+
+
+@dataclass(frozen=True)
+class TonePlan:
+    """The call-progress tones of one country."""
+    dial: Cadence
+    ringback: Cadence
+    busy: Cadence
+
+
+TONE_PLANS: dict[str, TonePlan] = {
+    "de": TonePlan(dial=Cadence((425,)),
+                   ringback=Cadence((425,), (1.0, 4.0)),
+                   busy=Cadence((425,), (0.48, 0.48))),
+    "us": TonePlan(dial=Cadence((350, 440)),
+                   ringback=Cadence((440, 480), (2.0, 4.0)),
+                   busy=Cadence((480, 620), (0.5, 0.5))),
+    "uk": TonePlan(dial=Cadence((350, 450)),
+                   ringback=Cadence((400, 450), (0.4, 0.2, 0.4, 2.0)),
+                   busy=Cadence((400,), (0.375, 0.375))),
+}
+
+
+@lru_cache(maxsize=64)
+def periodic_tone(frequencies: tuple[float, ...], rate: int, level: float = 0.3) -> np.ndarray:
+    """Render the shortest buffer that loops seamlessly for the given frequencies.
+
+    For integer frequencies this is at most one second, e.g. 40 ms for 425 Hz at 48 kHz.
+    """
+    periods = [rate // math.gcd(rate, round(f)) for f in frequencies]
+    frames = reduce(math.lcm, periods, 1)
+    t = np.arange(frames, dtype=np.float64) / rate
+    tone = sum(np.sin(2 * np.pi * round(f) * t) for f in frequencies) / len(frequencies)
+    tone = (tone * level).astype(np.float32).reshape(-1, 1)
+    tone.flags.writeable = False
+    return tone
+
+
+def cadence_segments(cadence: Cadence, rate: int) -> list[tuple[bool, int]]:
+    """The pattern of a cadence as (tone on, frames) segments."""
+    if not cadence.pattern:
+        return [(True, rate)]
+    return [(i % 2 == 0, round(seconds * rate)) for i, seconds in enumerate(cadence.pattern)]
+
+
+def render_cadence(cadence: Cadence, rate: int, min_seconds: float = 0) -> np.ndarray:
+    """Render whole periods of a cadence into one buffer, for backends that can only play files."""
+    tone = periodic_tone(cadence.frequencies, rate, cadence.level)
+    period = []
+    for on, frames in cadence_segments(cadence, rate):
+        if on:
+            period.append(np.resize(tone, (frames, 1)))
+        else:
+            period.append(np.zeros((frames, 1), dtype=np.float32))
+    period = np.concatenate(period)
+    repeats = max(1, math.ceil(min_seconds * rate / len(period)))
+    return np.tile(period, (repeats, 1))
+
+
+@lru_cache(maxsize=128)
+def render_dtmf(key: int | str, seconds: float, rate: int, level: float = 0.3) -> np.ndarray:
+    """The dual tone of a keypad key, cut from the cached loop of its two frequencies."""
+    if key not in DTMF_FREQUENCIES:
+        raise ValueError(f"No DTMF tone for key {key!r}")
+    frames = round(seconds * rate)
+    pcm = np.resize(periodic_tone(DTMF_FREQUENCIES[key], rate, level), (frames, 1))
+    ramp = min(frames // 2, round(_RAMP_SECONDS * rate))
+    if ramp:
+        envelope = np.linspace(0.0, 1.0, ramp, dtype=np.float32).reshape(-1, 1)
+        pcm[:ramp] *= envelope
+        pcm[-ramp:] *= envelope[::-1]
+    pcm.flags.writeable = False
+    return pcm
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import threading
+import wave
+from pathlib import Path
+
+_FFMPEG = "ffmpeg"
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the artifacts are written differently, so old ones are rebuilt
+_VERSION = 1
+# Names of the artifacts and their temporary files, nothing else in the directory is ever pruned
+_ARTIFACT_RE = re.compile(r"[0-9a-f]{64}\.(wav|tmp)")
+
+
+class TranscodeCache:
+    """Sounds decoded ahead of time into WAV files in the sink's native format.
+
+    Artifacts are keyed by the SHA-256 of the source's content and the output
+    format, so they survive restarts and a changed greeting gets a new one.
+    `warm()` builds the artifacts in a worker thread, `lookup()` only returns
+    ready ones and never hashes or decodes, so playing stays cheap. Sources
+    that already are native WAV files are their own artifact.
+    """
+
+    def __init__(self, directory: Path, rate: int, channels: int, ffmpeg: str = _FFMPEG):
+        self.directory = directory
+        self._rate = rate
+        self._channels = channels
+        self._ffmpeg = ffmpeg
+        # Source path -> ((size, mtime), artifact path), for sources warmed by this process
+        # and as they were when warmed
+        self._artifacts: dict[str, tuple[tuple[int, int], Path]] = {}
+        self._lock = threading.Lock()
+        # Only one warm or prune at a time, lookups don't wait for them
+        self._work_lock = threading.Lock()
+
+    def lookup(self, source: str | Path) -> Path | None:
+        """The ready artifact for `source`, None on a miss (not warmed or changed since)."""
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._artifacts.get(str(source))
+        if entry is None or entry[0] != (stat.st_size, stat.st_mtime_ns) or not entry[1].exists():
+            return None
+        return entry[1]
+
+    def resolve(self, source: str | Path) -> str:
+        """The path to play for `source`: its artifact if ready, the source itself otherwise."""
+        artifact = self.lookup(source)
+        return str(artifact) if artifact is not None else str(source)
+
+    def warm(self, sources):
+        """Build the missing artifacts of `sources`, skipping the ones that can't be decoded."""
+        with self._work_lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for source in sources:
+                try:
+                    self._warm(Path(source))
+                except (OSError, subprocess.CalledProcessError) as e:
+                    logger.warning("Could not transcode %s: %s", source, e)
+
+    def _warm(self, source: Path):
+        stat = os.stat(source)
+        if self.lookup(source) is not None:
+            return
+        artifact = source if self._is_native(source) else self.directory / f"{self._content_hash(source)}.wav"
+        if not artifact.exists():
+            logger.info("Transcoding %s to %s", source, artifact.name)
+            tmp = artifact.with_suffix(".tmp")
+            try:
+                subprocess.run(
+                    [self._ffmpeg, "-v", "error", "-i", str(source), "-f", "wav", "-c:a", "pcm_s16le",
+                     "-ar", str(self._rate), "-ac", str(self._channels), "-y", str(tmp)],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+                with open(tmp, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp, artifact)
+            finally:
+                tmp.unlink(missing_ok=True)
+        with self._lock:
+            self._artifacts[str(source)] = ((stat.st_size, stat.st_mtime_ns), artifact)
+
+    def prune(self, keep):
+        """Delete every artifact written by this cache that isn't the current one of a source in `keep`."""
+        with self._work_lock:
+            with self._lock:
+                current = {str(source): self._artifacts.get(str(source)) for source in keep}
+                self._artifacts = {source: entry for source, entry in current.items() if entry is not None}
+            live = {entry[1] for entry in self._artifacts.values()}
+            if not self.directory.is_dir():
+                return
+            for path in self.directory.iterdir():
+                # Also removes temporary files of transcodes interrupted by a crash,
+                # but leaves alone whatever else shares the directory
+                if path not in live and _ARTIFACT_RE.fullmatch(path.name) and path.is_file():
+                    logger.info("Pruning stale transcode %s", path.name)
+                    path.unlink(missing_ok=True)
+
+    def _content_hash(self, source: Path) -> str:
+        digest = hashlib.sha256(f"v{_VERSION} s16le {self._rate} Hz {self._channels} ch\n".encode())
+        with open(source, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _is_native(self, source: Path) -> bool:
+        if source.suffix.lower() != ".wav":
+            return False
+        try:
+            with wave.open(str(source), "rb") as wav:
+                return (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) == (
+                    self._rate, self._channels, 2)
+        except (wave.Error, EOFError):
+            return False
@@ -0,0 +1,29 @@
+import asyncio
+import sys
+
+import numpy as np
+import pytest
+
+from audio_guestbook.audio_engine import AudioEngineError, Mixer, Voice
+
+# Takes whatever is played, like pacat on a sink nobody listens to
+_SINK = [sys.executable, "-c", "import sys\nwhile sys.stdin.buffer.read(4096): pass"]
+
+
+def test_a_failing_mix_ends_every_voice():
+    async def main():
+        mixer = Mixer(_SINK, rate=8000, channels=2, block_frames=80, latency=0.01)
+        await mixer.start()
+        try:
+            long = asyncio.create_task(mixer.play(Voice(np.zeros((80000, 2), dtype=np.float32))))
+            await asyncio.sleep(0.05)
+            # No channel axis, mixing it raises
+            broken = asyncio.create_task(mixer.play(Voice(np.zeros(800, dtype=np.float32))))
+            for task in (long, broken):
+                with pytest.raises(AudioEngineError):
+                    await asyncio.wait_for(task, 5)
+            assert not mixer.running
+        finally:
+            await mixer.close()
+
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+
+import numpy as np
+import pytest
+
+from audio_guestbook.capture import CaptureSink, CaptureStream, SampleSpec, negotiate_spec, record
+
+
+# Silence at ten times real time, like a source that never waits for anyone
+_FAST_SOURCE = [sys.executable, "-c", "import sys, time\n"
+                "while True:\n    sys.stdout.buffer.write(bytes(9600)); sys.stdout.flush(); time.sleep(0.01)"]
+
+
+class SlowSink(CaptureSink):
+    """Writes like an SD card in the middle of a flush."""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def write(self, chunk: np.ndarray):
+        await asyncio.sleep(0.02)
+        self.frames += len(chunk)
+
+
+def test_slow_subscriber_that_leaves_does_not_stall_the_stream():
+    async def main():
+        stream = CaptureStream(_FAST_SOURCE, SampleSpec("s16le", 48000, 1), chunk_frames=4800)
+        await stream.start()
+        try:
+            for _ in range(2):
+                sink = SlowSink()
+                await asyncio.wait_for(record(stream, [sink], duration=0.5, max_queued=2), timeout=5)
+                assert sink.frames == 24000
+            assert stream.overruns > 0
+            assert stream.running
+        finally:
+            await stream.close()
+
+    asyncio.run(main())
+
+
+def test_explicit_format_must_be_storable():
+    native = SampleSpec("float32le", 48000, 1)
+    assert negotiate_spec(native) == SampleSpec("s16le", 48000, 1)
+    assert negotiate_spec(native, "s32le").ffmpeg_codec == "pcm_s32le"
+    for format in ("float32le", "s24le"):
+        with pytest.raises(ValueError):
+            negotiate_spec(native, format)
@@ -0,0 +1,93 @@
+import asyncio
+import struct
+import wave
+
+import pytest
+
+from audio_guestbook import statemachine
+from audio_guestbook.catalog import RecordingCatalog, describe
+from audio_guestbook.contact import Contact
+from audio_guestbook.statemachine import Context, RecordMessageState
+
+
+def write_wav(path, seconds: float, rate: int = 8000):
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(2 * int(seconds * rate)))
+
+
+def test_iter_on_a_path_with_uri_characters(tmp_path):
+    directory = tmp_path / "event?#1"
+    directory.mkdir()
+    recording = directory / "20261017_120000_000.wav"
+    write_wav(recording, 1.5)
+    catalog = RecordingCatalog(directory / "catalog.sqlite3")
+    catalog.add_file(recording, dialed_number="0815", contact="Lydia")
+
+    for _ in range(3):
+        (found,) = catalog.iter(contact="Lydia")
+        assert found.duration == 1.5
+        assert found.dialed_number == "0815"
+    catalog.close()
+
+
+def test_recording_ended_by_a_hangup_is_cataloged(tmp_path, monkeypatch):
+    catalog = RecordingCatalog(tmp_path / "catalog.sqlite3")
+    monkeypatch.setattr(statemachine, "recording_finished_hooks", [catalog.submit])
+    context = Context((3, 0, 0, 5), Contact("Lydia", (3, 0, 0, 5), tmp_path / "greeting.wav"))
+
+    class AudioManager:
+        output_dir = tmp_path
+
+        async def record_audio(self, output_path, duration, sinks=None):
+            try:
+                await asyncio.Event().wait()
+            finally:
+                write_wav(output_path, 2.0)
+
+    async def main():
+        cataloging = asyncio.create_task(catalog.run())
+        call = asyncio.create_task(RecordMessageState().run_hangable(None, context, AudioManager()))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        while not catalog.query(contact="Lydia"):
+            await asyncio.sleep(0.01)
+        cataloging.cancel()
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+    (recording,) = catalog.query(contact="Lydia")
+    assert recording.dialed_number == "3005"
+    assert recording.duration == 2.0
+    catalog.close()
+
+
+def test_flac_duration_from_streaminfo(tmp_path):
+    path = tmp_path / "20261017_120000_000.flac"
+    rate, channels, bits, samples = 48000, 1, 16, 48000 * 90
+    packed = rate << 44 | (channels - 1) << 41 | (bits - 1) << 36 | samples
+    streaminfo = struct.pack(">HH", 4096, 4096) + bytes(6) + struct.pack(">Q", packed) + bytes(16)
+    path.write_bytes(b"fLaC" + b"\x80" + len(streaminfo).to_bytes(3, "big") + streaminfo + bytes(100))
+    assert describe(path).duration == 90.0
+
+
+def ogg_page(granule: int, payload: bytes) -> bytes:
+    return b"OggS" + struct.pack("<BBqIIIB", 0, 0, granule, 1, 0, 0, 1) + bytes([len(payload)]) + payload
+
+
+def test_opus_duration_from_the_last_granule(tmp_path):
+    path = tmp_path / "20261017_120000_000.opus"
+    head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, 312, 48000, 0, 0)
+    path.write_bytes(ogg_page(0, head) + ogg_page(0, b"OpusTags" + bytes(8))
+                     + ogg_page(48000 * 30, bytes(200)) + ogg_page(312 + 48000 * 61, bytes(200)))
+    assert describe(path).duration == 61.0
+
+
+def test_unreadable_header_has_no_duration(tmp_path):
+    path = tmp_path / "20261017_120000_000.flac"
+    path.write_bytes(b"not flac")
+    recording = describe(path)
+    assert recording.duration is None and recording.ended_at is None
@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+from audio_guestbook.contact import Contact, ContactDirectory, ContactRegistry, DialResult, parse_number
+
+LYDIA = Contact("Lydia", parse_number("30"), "lydia.mp3")
+JAN = Contact("Jan", parse_number("305"), "jan.mp3")
+STAR = Contact("Star", parse_number("*12#"), "star.mp3")
+DIRECTORY = ContactDirectory([LYDIA, JAN, STAR])
+
+
+def test_lookup_decides_as_soon_as_the_number_is_unique():
+    assert DIRECTORY.lookup((3,)) == (DialResult.PREFIX, None)
+    assert DIRECTORY.lookup((3, 0)) == (DialResult.AMBIGUOUS, LYDIA)
+    assert DIRECTORY.lookup((3, 0, 5)) == (DialResult.COMPLETE, JAN)
+    assert DIRECTORY.lookup((3, 1)) == (DialResult.DEAD, None)
+    assert DIRECTORY.lookup((3, 0, 5, 1)) == (DialResult.DEAD, None)
+    assert DIRECTORY.lookup(("star", 1, 2, "pound")) == (DialResult.COMPLETE, STAR)
+
+
+def test_duplicate_numbers_keep_the_last_contact():
+    other = Contact("Other", parse_number("30"), "other.mp3")
+    directory = ContactDirectory([LYDIA, other])
+    assert len(directory) == 1
+    assert directory.get((3, 0)) is other
+    assert directory.get((3,)) is None
+
+
+def test_registry_keeps_the_directory_when_the_file_breaks(tmp_path):
+    path = tmp_path / "contacts.toml"
+    path.write_text('[[contacts]]\nname = "Lydia"\nnumber = "30"\ngreeting = "lydia.mp3"\n')
+    registry = ContactRegistry(path, [])
+    assert registry.directory.get((3, 0)).greeting_path == tmp_path / "lydia.mp3"
+
+    path.write_text("not toml [")
+    # A different mtime, even on file systems with coarse timestamps
+    os.utime(path, ns=(0, 1))
+    assert not registry.reload()
+    assert registry.directory.get((3, 0)).name == "Lydia"
+
+    for i, broken in enumerate(['{"contacts": [{"name": "A", "number": "3005", "greeting": null}]}',
+                                '{"contacts": ["3005"]}', '{"contacts": 5}']):
+        json_path = tmp_path / f"broken{i}.json"
+        json_path.write_text(broken)
+        registry = ContactRegistry(json_path, [LYDIA])
+        assert registry.directory.get((3, 0)) is LYDIA
+
+
+def test_watch_keeps_running_after_a_failed_reload(tmp_path, monkeypatch):
+    path = tmp_path / "contacts.toml"
+    path.write_text('[[contacts]]\nname = "Lydia"\nnumber = "30"\ngreeting = "lydia.mp3"\n')
+    registry = ContactRegistry(path, [], poll_interval=0.01)
+    reload = registry.reload
+    calls = []
+
+    def failing_once():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("disk gone")
+        return reload()
+
+    monkeypatch.setattr(registry, "reload", failing_once)
+
+    async def main():
+        watching = asyncio.create_task(registry.watch())
+        path.write_text('[[contacts]]\nname = "Jan"\nnumber = "305"\ngreeting = "jan.mp3"\n')
+        os.utime(path, ns=(0, 1))
+        while registry.directory.get((3, 0, 5)) is None:
+            await asyncio.sleep(0.01)
+        assert not watching.done()
+        watching.cancel()
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+    assert len(calls) >= 2
@@ -0,0 +1,27 @@
+import asyncio
+import json
+
+from audio_guestbook.encoder import RecordingEncoder
+
+
+def test_bad_jobs_are_set_aside_and_the_queue_keeps_running(tmp_path):
+    queue_dir = tmp_path / "queue"
+    truncated = tmp_path / "truncated.wav"
+    truncated.write_bytes(b"RIFF\x00")
+    encoder = RecordingEncoder(queue_dir, "flac")
+    encoder.submit(truncated)
+    (queue_dir / "unknown.json").write_text(json.dumps({"source": str(truncated), "format": "mp3"}))
+    (queue_dir / "empty.json").write_text("")
+
+    async def main():
+        task = asyncio.create_task(encoder.run())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not list(queue_dir.glob("*.json")):
+                break
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(main())
+    assert sorted(path.name for path in queue_dir.iterdir()) == ["empty.failed", "truncated.failed", "unknown.failed"]
+    assert truncated.exists()
@@ -0,0 +1,44 @@
+import asyncio
+import shutil
+
+import pytest
+
+from audio_guestbook.exporter import DirectoryTarget, ExportError, RecordingExporter
+
+
+class PulledStick(DirectoryTarget):
+    """Unmounted while the batch is being sent, after its first file."""
+
+    def offset(self, name: str) -> int:
+        if (self.root / "recordings").exists():
+            shutil.rmtree(self.root)
+        return super().offset(name)
+
+
+def test_pulled_stick_is_not_recreated_on_the_sd_card(tmp_path):
+    recordings = tmp_path / "recordings"
+    recordings.mkdir()
+    for i in range(3):
+        (recordings / f"20261017_12000{i}_000.wav").write_bytes(bytes(1000))
+    stick = tmp_path / "stick"
+    stick.mkdir()
+    exporter = RecordingExporter([recordings], PulledStick(stick), tmp_path / "state.json")
+
+    with pytest.raises(ExportError):
+        asyncio.run(exporter.export_pending())
+    assert not stick.exists()
+
+
+def test_exports_once_and_lists_checksums(tmp_path):
+    recordings = tmp_path / "recordings"
+    recordings.mkdir()
+    (recordings / "20261017_120000_000.wav").write_bytes(b"RIFF" + bytes(1000))
+    (recordings / "20261017_120001_000.tmp.flac").write_bytes(bytes(10))
+    stick = tmp_path / "stick"
+    stick.mkdir()
+    exporter = RecordingExporter([recordings], DirectoryTarget(stick), tmp_path / "state.json")
+
+    assert asyncio.run(exporter.export_pending()) == 1
+    assert asyncio.run(exporter.export_pending()) == 0
+    assert (stick / "recordings" / "20261017_120000_000.wav").read_bytes() == b"RIFF" + bytes(1000)
+    assert (stick / "recordings" / "SHA256SUMS").read_text().endswith("  20261017_120000_000.wav\n")
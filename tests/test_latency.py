@@ -0,0 +1,19 @@
+import pytest
+
+from audio_guestbook.clock import VirtualClock
+from audio_guestbook.latency import LatencyTracer
+
+
+def test_spans_end_on_the_tracer_clock():
+    clock = VirtualClock(start=10.0)
+    tracer = LatencyTracer(clock=clock)
+    span = tracer.begin("edge→sound", clock.monotonic())
+    clock.advance(0.25)
+    span.end(delay=0.04)
+    assert tracer.percentiles("edge→sound")["max"] == pytest.approx(0.29)
+
+
+def test_span_ending_at_zero():
+    tracer = LatencyTracer(clock=VirtualClock(start=5.0))
+    tracer.begin("from zero", 0.0).end(at=0.0)
+    assert tracer.percentiles("from zero")["max"] == 0.0
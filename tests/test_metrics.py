@@ -0,0 +1,18 @@
+from audio_guestbook.metrics import StateMetrics, _write_export
+
+
+def test_jsonl_snapshots_are_rotated(tmp_path):
+    jsonl = tmp_path / "telephone-metrics.jsonl"
+    for i in range(10):
+        _write_export(None, "", jsonl, f'{{"n": {i}}}', jsonl_max_bytes=30)
+    assert jsonl.stat().st_size < 30 + len('{"n": 9}\n')
+    assert (tmp_path / "telephone-metrics.jsonl.1").exists()
+    assert jsonl.read_text().splitlines()[-1] == '{"n": 9}'
+    assert not list(tmp_path.glob("*.jsonl.2"))
+
+
+def test_prometheus_export_is_replaced(tmp_path):
+    metrics = StateMetrics()
+    metrics.export(tmp_path / "telephone.prom")
+    metrics.export(tmp_path / "telephone.prom")
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["telephone.prom"]
@@ -0,0 +1,42 @@
+import asyncio
+
+from audio_guestbook.pulse_control import SinkControl
+
+
+def fake_pactl(tmp_path, set_exit_code: int) -> str:
+    pactl = tmp_path / "pactl"
+    pactl.write_text(f"""#!/bin/sh
+case "$1" in
+    get-sink-mute) echo "Mute: no" ;;
+    get-sink-volume) echo "Volume: front-left: 32768 /  50% / -18.06 dB" ;;
+    set-*) echo "$@" >> {tmp_path}/calls; exit {set_exit_code} ;;
+esac
+""")
+    pactl.chmod(0o755)
+    return str(pactl)
+
+
+def test_failed_change_is_not_cached(tmp_path):
+    async def main():
+        control = SinkControl("sink", fake_pactl(tmp_path, 1), str(tmp_path / "no-pacmd"))
+        await control.start()
+        assert (control.muted, control.volume) == (False, 32768)
+        await control.set_mute(True)
+        await control.set_volume(1.0)
+        assert (control.muted, control.volume) == (False, 32768)
+        await control.close()
+
+    asyncio.run(main())
+
+
+def test_successful_change_is_cached_and_not_repeated(tmp_path):
+    async def main():
+        control = SinkControl("sink", fake_pactl(tmp_path, 0), str(tmp_path / "no-pacmd"))
+        await control.start()
+        await control.set_mute(True)
+        await control.set_mute(True)
+        assert control.muted is True
+        await control.close()
+
+    asyncio.run(main())
+    assert (tmp_path / "calls").read_text().splitlines() == ["set-sink-mute sink 1"]
@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+
+from audio_guestbook.capture import CaptureSink, SampleSpec, SilenceGate
+
+SPEC = SampleSpec("s16le", 1000, 1)
+
+
+class CollectingSink(CaptureSink):
+    def __init__(self):
+        self.frames = 0
+        self.closed = False
+
+    async def write(self, chunk: np.ndarray):
+        self.frames += len(chunk)
+
+    async def close(self):
+        self.closed = True
+
+
+def chunk(dbfs: float | None, frames: int = 100) -> np.ndarray:
+    """A chunk of a sine at `dbfs` RMS, silence for None."""
+    if dbfs is None:
+        return np.zeros((frames, 1), dtype="<i2")
+    amplitude = np.sqrt(2) * 10 ** (dbfs / 20)
+    sine = amplitude * np.sin(2 * np.pi * 100 * np.arange(frames) / SPEC.rate)
+    return (sine * 32767).astype("<i2").reshape(-1, 1)
+
+
+def feed(gate: SilenceGate, chunks: list[np.ndarray]) -> int:
+    """Write chunks until the gate finishes, returns how many it took."""
+    async def main():
+        await gate.open(SPEC)
+        written = 0
+        for c in chunks:
+            await gate.write(c)
+            written += 1
+            if gate.finished:
+                break
+        await gate.close()
+        return written
+
+    return asyncio.run(main())
+
+
+def test_threshold():
+    for level, voiced in ((-40.0, 100), (-50.0, 0), (None, 0)):
+        gate = SilenceGate([], threshold_dbfs=-45.0)
+        feed(gate, [chunk(level)])
+        assert gate.voiced_frames == voiced
+
+
+def test_trims_silence_around_speech_and_stops_after_trailing_silence():
+    sink = CollectingSink()
+    gate = SilenceGate([sink], silence_seconds=4.0, pad_seconds=0.3)
+    written = feed(gate, [chunk(None)] * 10 + [chunk(-20.0)] * 5 + [chunk(None)] * 100)
+    assert written == 10 + 5 + 40
+    assert gate.finished and sink.closed
+    # 0.3 s before the first word, the speech and 0.3 s after the last
+    assert sink.frames == 300 + 500 + 300
+    assert gate.voiced_frames == 500
+    assert gate.trimmed_frames == 700 + 3700
+
+
+def test_gives_up_without_speech():
+    sink = CollectingSink()
+    gate = SilenceGate([sink], leading_seconds=10.0)
+    written = feed(gate, [chunk(None)] * 200)
+    assert written == 100
+    assert gate.finished and sink.closed
+    assert sink.frames == 0
+    assert gate.trimmed_frames == 10000
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import shutil
+import time
+import wave
+
+import numpy as np
+import pytest
+
+from audio_guestbook.capture import SampleSpec
+from audio_guestbook.staging import StagedWavSink, part_path, recover_recordings
+
+SPEC = SampleSpec("s16le", 1000, 1)
+
+
+def frames(count: int, start: int = 0) -> np.ndarray:
+    return (np.arange(start, start + count) % 30000).astype("<i2").reshape(-1, 1)
+
+
+def read_wav(path):
+    with wave.open(str(path), "rb") as wav:
+        return wav.getframerate(), np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+
+
+def test_close_writes_a_complete_wav(tmp_path):
+    output = tmp_path / "message.wav"
+
+    async def main():
+        sink = StagedWavSink(output, flush_seconds=2.0, fsync_seconds=5.0)
+        await sink.open(SPEC)
+        for i in range(25):
+            await sink.write(frames(1000, i * 1000))
+        await sink.close()
+
+    asyncio.run(main())
+    assert not part_path(output).exists()
+    rate, samples = read_wav(output)
+    assert rate == 1000
+    assert np.array_equal(samples, frames(25000).ravel())
+
+
+def test_part_file_is_valid_up_to_the_last_sync_and_recovers(tmp_path):
+    output = tmp_path / "message.wav"
+    crashed = tmp_path / "crashed"
+    crashed.mkdir()
+
+    async def main():
+        sink = StagedWavSink(output, flush_seconds=2.0, fsync_seconds=5.0)
+        await sink.open(SPEC)
+        for i in range(12):
+            await sink.write(frames(1000, i * 1000))
+        await asyncio.sleep(0.2)
+        # What a power loss right now would leave behind
+        shutil.copy(part_path(output), crashed / part_path(output).name)
+        await sink.close()
+
+    asyncio.run(main())
+    leftover = crashed / part_path(output).name
+    # The header covers whole synced batches, more audio may follow it
+    _, synced = read_wav(leftover)
+    assert len(synced) >= 5000
+    assert np.array_equal(synced, frames(len(synced)).ravel())
+
+    # A torn write ends in half a frame
+    with open(leftover, "ab") as f:
+        f.write(b"\x01")
+    (recovered,) = recover_recordings(crashed)
+    assert recovered == crashed / "message.wav"
+    _, samples = read_wav(recovered)
+    assert len(samples) >= len(synced)
+    assert np.array_equal(samples, frames(len(samples)).ravel())
+    assert recovered.stat().st_size % 2 == 0
+
+
+def test_recovery_removes_empty_and_keeps_unreadable_part_files(tmp_path):
+    async def create_empty():
+        sink = StagedWavSink(tmp_path / "empty.wav")
+        await sink.open(SPEC)
+        shutil.copy(part_path(sink.output_path), tmp_path / "copy.wav.part")
+        await sink.close()
+
+    asyncio.run(create_empty())
+    (tmp_path / "broken.wav.part").write_bytes(b"not a wav")
+    assert recover_recordings(tmp_path) == []
+    assert not (tmp_path / "copy.wav.part").exists()
+    assert (tmp_path / "broken.wav.part").exists()
+
+
+def test_hangup_during_a_slow_flush_keeps_the_batch(tmp_path, monkeypatch):
+    output = tmp_path / "message.wav"
+    pwrite = os.pwrite
+
+    def slow_pwrite(fd, data, offset):
+        # An SD card in the middle of garbage collection
+        time.sleep(0.05)
+        return pwrite(fd, data, offset)
+
+    monkeypatch.setattr(os, "pwrite", slow_pwrite)
+
+    async def main():
+        sink = StagedWavSink(output, flush_seconds=1.0)
+        await sink.open(SPEC)
+        await sink.write(frames(2048))
+        # Waits for the first batch, which is still being written
+        writing = asyncio.create_task(sink.write(frames(2048, 2048)))
+        await asyncio.sleep(0.01)
+        writing.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await writing
+        await sink.close()
+
+    asyncio.run(main())
+    _, samples = read_wav(output)
+    assert np.array_equal(samples, frames(4096).ravel())
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from audio_guestbook import statemachine
+from audio_guestbook.statemachine import Context, RecordMessageState
+
+
+class HangupAudioManager:
+    """Records until cancelled and finalizes the file then, like AudioManager.record_audio."""
+
+    def __init__(self, output_dir, writes_file: bool = True):
+        self.output_dir = output_dir
+        self._writes_file = writes_file
+        self.recording = asyncio.Event()
+
+    async def record_audio(self, output_path, duration, sinks=None):
+        self.recording.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if self._writes_file:
+                output_path.write_bytes(b"RIFF")
+
+
+async def hang_up_mid_recording(audio_manager, context):
+    task = asyncio.create_task(RecordMessageState().run_hangable(None, context, audio_manager))
+    await audio_manager.recording.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_hanging_up_mid_recording_runs_the_hooks(tmp_path, monkeypatch):
+    finished = []
+    monkeypatch.setattr(statemachine, "recording_finished_hooks",
+                        [lambda path, context: finished.append((path, context))])
+    context = Context((3, 0, 0, 5), None)
+
+    asyncio.run(hang_up_mid_recording(HangupAudioManager(tmp_path), context))
+    ((path, hook_context),) = finished
+    assert path.parent == tmp_path and path.exists()
+    assert hook_context == context
+
+
+def test_no_hooks_without_a_recording(tmp_path, monkeypatch):
+    finished = []
+    monkeypatch.setattr(statemachine, "recording_finished_hooks",
+                        [lambda path, context: finished.append(path)])
+
+    asyncio.run(hang_up_mid_recording(HangupAudioManager(tmp_path, writes_file=False), Context(None, None)))
+    assert finished == []
@@ -0,0 +1,18 @@
+from audio_guestbook.transcode_cache import TranscodeCache
+
+
+def test_prune_only_removes_what_the_cache_wrote(tmp_path):
+    cache = TranscodeCache(tmp_path, 48000, 2)
+    stale = tmp_path / f"{'ab' * 32}.wav"
+    interrupted = tmp_path / f"{'cd' * 32}.tmp"
+    for path in (stale, interrupted):
+        path.write_bytes(b"RIFF")
+    # An operator pointed the cache at a directory shared with other files
+    (tmp_path / "contacts.toml").write_text("")
+    (tmp_path / "catalog.sqlite3").write_bytes(b"")
+    (tmp_path / f"{'ef' * 32}.wav").mkdir()
+
+    cache.prune([])
+    assert not stale.exists() and not interrupted.exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "catalog.sqlite3", "contacts.toml", f"{'ef' * 32}.wav"]